@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Экспорт детектора полей в CPU-бэкенды, квантование в INT8 и отчет по задержке
+и совпадению с PyTorch
+
+Запуск:
+    python benchmarks/detector_backends.py export yolo_training/overfit_models/best_overfit_model.pt
+    python benchmarks/detector_backends.py report yolo_training/overfit_models/best_overfit_model.pt data/
+    python benchmarks/detector_backends.py report best.pt data/ --backends onnx openvino --output backends.json
+    python benchmarks/detector_backends.py quantize best.pt yolo_training/augmented_dataset --eval data/
+"""
+import os
+
+# Только CPU
+os.environ["CUDA_VISIBLE_DEVICES"] = ""
+
+import sys
+import json
+import time
+import argparse
+import statistics
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+# Добавляем путь к модулям
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.page_image import PageImage
+from src.inference_backends import (
+    BACKENDS, EXPORT_FORMATS, DEFAULT_IMGSZ, DetectorBackend, OnnxInt8Backend,
+    load_backend, export_model, compare_detections, read_manifest, register_artifact,
+)
+from src.quantization import (
+    CALIBRATION_METHODS, DEFAULT_CALIBRATION_SIZE, calibration_images, quantize_detector,
+)
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".tiff", ".bmp"}
+
+# Допуски совпадения с PyTorch: поля не теряются и не появляются, боксы почти совпадают
+MIN_IOU = 0.9
+MAX_CONF_DRIFT = 0.05
+
+# INT8 против FP32: набор полей тот же, боксы и уверенность - с запасом на шум квантования
+INT8_MIN_IOU = 0.8
+INT8_MAX_CONF_DRIFT = 0.1
+
+# Допуски (min IoU, дрейф уверенности) бэкенда по умолчанию
+TOLERANCES = {"onnx_int8": (INT8_MIN_IOU, INT8_MAX_CONF_DRIFT)}
+
+
+def load_pages(sources: List[Path]) -> List[np.ndarray]:
+    """Страницы в BGR: PDF растеризуются как в конвейере (масштаб 2.0), изображения читаются как есть"""
+    paths = []
+    for source in sources:
+        paths += sorted(p for p in source.iterdir() if p.is_file()) if source.is_dir() else [source]
+
+    pages = []
+    for path in paths:
+        suffix = path.suffix.lower()
+        if suffix == ".pdf":
+            import fitz  # PyMuPDF
+            with fitz.open(path) as document:
+                for page_number, page in enumerate(document):
+                    pixmap = page.get_pixmap(matrix=fitz.Matrix(2.0, 2.0), colorspace=fitz.csRGB, alpha=False)
+                    pages.append(PageImage.from_pixmap(pixmap, page_index=page_number, scale=2.0).to_bgr())
+        elif suffix in IMAGE_EXTENSIONS:
+            pages.append(PageImage.from_file(path).to_bgr())
+    return pages
+
+
+def measure_backend(backend: DetectorBackend, pages: List[np.ndarray], repeats: int,
+                    batch_size: int, conf: float, iou: float) -> Dict[str, Any]:
+    """Задержка страницы (пакет из одной) и пропускная способность пакетами"""
+    backend.predict(pages[:1], conf, iou)  # прогрев
+
+    latencies = []
+    for _ in range(repeats):
+        for page in pages:
+            start = time.perf_counter()
+            backend.predict([page], conf, iou)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for i in range(0, len(pages), batch_size):
+            backend.predict(pages[i:i + batch_size], conf, iou)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p90_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.9))], 2),
+        "pages_per_sec": round(len(pages) * repeats / elapsed, 2),
+    }
+
+
+def parity_summary(stats: Dict[int, Dict[str, Any]], min_iou: float, max_drift: float) -> Dict[str, Any]:
+    """Итог сравнения с эталонной моделью по всем классам"""
+    ious = [entry["min_iou"] for entry in stats.values() if entry["min_iou"] is not None]
+    drifts = [entry["max_conf_drift"] for entry in stats.values() if entry["max_conf_drift"] is not None]
+    summary = {
+        "matched": sum(entry["matched"] for entry in stats.values()),
+        "missed": sum(entry["missed"] for entry in stats.values()),
+        "extra": sum(entry["extra"] for entry in stats.values()),
+        "min_iou": round(min(ious), 4) if ious else None,
+        "max_conf_drift": round(max(drifts), 4) if drifts else None,
+        "by_class": stats,
+    }
+    summary["passed"] = (
+        summary["missed"] == 0 and summary["extra"] == 0
+        and (summary["min_iou"] is None or summary["min_iou"] >= min_iou)
+        and (summary["max_conf_drift"] is None or summary["max_conf_drift"] <= max_drift)
+    )
+    return summary
+
+
+def run_report(args) -> Dict[str, Any]:
+    pages = load_pages(args.sources)
+    if not pages:
+        raise RuntimeError("Нет страниц для замера")
+    print(f"📄 Страниц: {len(pages)}")
+
+    report: Dict[str, Any] = {"weights": str(args.weights), "reference": "pytorch",
+                              "pages": len(pages), "backends": {}}
+    reference = None
+    for name in args.backends:
+        start = time.perf_counter()
+        backend = load_backend(args.weights, name, args.threads)
+        load_ms = (time.perf_counter() - start) * 1000
+        if backend is None or backend.name != name:
+            print(f"⏭️  {name}: нет артефакта или среды выполнения")
+            continue
+
+        entry = {"load_ms": round(load_ms, 1), "artifact": str(backend.artifact)}
+        entry.update(measure_backend(backend, pages, args.repeats, args.batch_size, args.conf, args.iou))
+
+        detections = backend.predict(pages, args.conf, args.iou)
+        if name == "pytorch":
+            reference = detections
+        elif reference is not None:
+            min_iou, max_drift = TOLERANCES.get(name, (MIN_IOU, MAX_CONF_DRIFT))
+            entry["parity"] = parity_summary(
+                compare_detections(reference, detections),
+                min_iou if args.min_iou is None else args.min_iou,
+                max_drift if args.max_conf_drift is None else args.max_conf_drift,
+            )
+        report["backends"][name] = entry
+
+    # Ускорение относительно PyTorch
+    baseline = report["backends"].get("pytorch")
+    for entry in report["backends"].values():
+        if baseline:
+            entry["speedup"] = round(baseline["p50_ms"] / entry["p50_ms"], 2)
+    return report
+
+
+def run_quantize(args) -> Dict[str, Any]:
+    """INT8-модель, сравнение с FP32 ONNX и запись в манифест при соблюдении допусков"""
+    images = calibration_images(args.calibration, args.limit)
+    print(f"🎯 Калибровочных страниц: {len(images)}")
+    start = time.perf_counter()
+    artifact = quantize_detector(args.weights, images, args.artifact, args.method)
+    print(f"⚙️  INT8-модель: {artifact} ({time.perf_counter() - start:.1f} с)")
+
+    start = time.perf_counter()
+    fp32 = load_backend(args.weights, "onnx", args.threads)
+    if fp32 is None or fp32.name != "onnx":
+        raise RuntimeError("FP32-модель ONNX не загружена")
+    load_ms = {"onnx": (time.perf_counter() - start) * 1000}
+    manifest = read_manifest(args.weights)
+    start = time.perf_counter()
+    int8 = OnnxInt8Backend(artifact, int(manifest.get("imgsz", DEFAULT_IMGSZ)),
+                           len(manifest.get("names", {})), args.threads)
+    load_ms["onnx_int8"] = (time.perf_counter() - start) * 1000
+
+    pages = load_pages(args.eval or args.calibration)
+    if not pages:
+        raise RuntimeError("Нет страниц для сравнения")
+    print(f"📄 Страниц для сравнения: {len(pages)}")
+
+    report: Dict[str, Any] = {"weights": str(args.weights), "reference": "onnx", "artifact": str(artifact),
+                              "calibration_pages": len(images), "pages": len(pages), "backends": {}}
+    for backend in (fp32, int8):
+        entry = {"load_ms": round(load_ms[backend.name], 1), "artifact": str(backend.artifact)}
+        entry.update(measure_backend(backend, pages, args.repeats, args.batch_size, args.conf, args.iou))
+        report["backends"][backend.name] = entry
+
+    report["backends"]["onnx_int8"]["parity"] = parity_summary(
+        compare_detections(fp32.predict(pages, args.conf, args.iou), int8.predict(pages, args.conf, args.iou)),
+        args.min_iou, args.max_conf_drift,
+    )
+    baseline = report["backends"]["onnx"]
+    for entry in report["backends"].values():
+        entry["speedup"] = round(baseline["p50_ms"] / entry["p50_ms"], 2)
+
+    report["passed"] = report["backends"]["onnx_int8"]["parity"]["passed"]
+    if report["passed"]:
+        register_artifact(args.weights, "onnx_int8", artifact)
+    else:
+        # Модель вне допусков не должна попасть в YoloFieldDetector
+        artifact.unlink(missing_ok=True)
+    return report
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"{'бэкенд':<12} {'загрузка':>10} {'p50, мс':>9} {'p90, мс':>9} {'стр/с':>8} {'x':>6}  "
+          f"совпадение с {report['reference']}")
+    for name, entry in report["backends"].items():
+        parity = entry.get("parity")
+        if parity is None:
+            verdict = "эталон" if name == report["reference"] else "нет эталона"
+        else:
+            verdict = (f"{'✅' if parity['passed'] else '❌'} пропущено {parity['missed']}, лишних {parity['extra']}, "
+                       f"min IoU {parity['min_iou']}, дрейф уверенности {parity['max_conf_drift']}")
+        print(f"{name:<12} {entry['load_ms']:>8.0f}мс {entry['p50_ms']:>9.1f} {entry['p90_ms']:>9.1f} "
+              f"{entry['pages_per_sec']:>8.2f} {entry.get('speedup', 1.0):>6.2f}  {verdict}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    arg_parser = argparse.ArgumentParser(description="CPU-бэкенды детектора полей")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Экспорт весов .pt и запись манифеста")
+    export.add_argument("weights", type=Path)
+    export.add_argument("--formats", nargs="+", choices=EXPORT_FORMATS, default=list(EXPORT_FORMATS))
+    export.add_argument("--imgsz", type=int, default=DEFAULT_IMGSZ)
+
+    report = commands.add_parser("report", help="Задержка по бэкендам и совпадение с PyTorch")
+    report.add_argument("weights", type=Path)
+    report.add_argument("sources", type=Path, nargs="+", help="PDF, изображения или каталоги")
+    report.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    report.add_argument("--repeats", type=int, default=3)
+    report.add_argument("--batch-size", type=int, default=4)
+    report.add_argument("--threads", type=int, help="Потоков инференса")
+    report.add_argument("--conf", type=float, default=0.25)
+    report.add_argument("--iou", type=float, default=0.6)
+    report.add_argument("--min-iou", type=float, help=f"По умолчанию {MIN_IOU}, для INT8 {INT8_MIN_IOU}")
+    report.add_argument("--max-conf-drift", type=float,
+                        help=f"По умолчанию {MAX_CONF_DRIFT}, для INT8 {INT8_MAX_CONF_DRIFT}")
+    report.add_argument("--output", "-o", type=Path, help="JSON с отчетом")
+
+    quantize = commands.add_parser("quantize", help="INT8-квантование ONNX-модели и сравнение с FP32")
+    quantize.add_argument("weights", type=Path)
+    quantize.add_argument("calibration", type=Path, nargs="+",
+                          help="Калибровочные изображения или каталоги (например, аугментированный набор)")
+    quantize.add_argument("--eval", type=Path, nargs="+", help="Страницы для сравнения (по умолчанию калибровочные)")
+    quantize.add_argument("--limit", type=int, default=DEFAULT_CALIBRATION_SIZE, help="Калибровочных страниц")
+    quantize.add_argument("--method", choices=CALIBRATION_METHODS, default="minmax")
+    quantize.add_argument("--artifact", type=Path, help="Путь INT8-модели (по умолчанию <onnx>.int8.onnx)")
+    quantize.add_argument("--repeats", type=int, default=3)
+    quantize.add_argument("--batch-size", type=int, default=4)
+    quantize.add_argument("--threads", type=int, help="Потоков инференса")
+    quantize.add_argument("--conf", type=float, default=0.25)
+    quantize.add_argument("--iou", type=float, default=0.6)
+    quantize.add_argument("--min-iou", type=float, default=INT8_MIN_IOU)
+    quantize.add_argument("--max-conf-drift", type=float, default=INT8_MAX_CONF_DRIFT)
+    quantize.add_argument("--output", "-o", type=Path, help="JSON с отчетом")
+
+    args = arg_parser.parse_args(argv)
+
+    if args.command == "export":
+        path = export_model(args.weights, tuple(args.formats), args.imgsz)
+        print(f"💾 Манифест: {path}")
+        print(path.read_text(encoding="utf-8"))
+        return 0
+
+    if args.command == "quantize":
+        result = run_quantize(args)
+    else:
+        # PyTorch - эталон для сравнения, замеряется первым
+        args.backends = sorted(dict.fromkeys(args.backends), key=lambda name: name != "pytorch")
+        result = run_report(args)
+    print_report(result)
+    if args.output:
+        args.output.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"💾 Отчет: {args.output}")
+    if args.command == "quantize":
+        print("✅ INT8-модель записана в манифест" if result["passed"]
+              else "❌ INT8-модель вне допусков и удалена")
+    failed = [name for name, entry in result["backends"].items() if not entry.get("parity", {"passed": True})["passed"]]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк парсера накладных: время разбора документа и стоимость компиляции паттернов
+
+Запуск:
+    python benchmarks/parser_benchmark.py --docs 2000
+    python benchmarks/parser_benchmark.py --pages 10 50 100
+    python benchmarks/parser_benchmark.py --docs 20000 --workers 1 4 8
+    python benchmarks/parser_benchmark.py --synthetic --docs 100000 --rows 3 60 --page-range 1 5 --noise 0.01
+"""
+import re
+import sys
+import time
+import argparse
+import statistics
+from collections import defaultdict
+from pathlib import Path
+
+# Добавляем путь к модулям
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.config import Config
+from src.utils import TextProcessor
+from src.parser import InvoiceParser
+from src.patterns import PatternBank
+from synthetic_invoices import InvoiceGenerator, GeneratorOptions, compare_fields, field_accuracy
+
+SAMPLE_TEXT = """
+ТОВАРНАЯ НАКЛАДНАЯ № ТН-2025-{n:03d} от 15.01.2025
+
+Поставщик: ООО "Альфа Торг {n}"
+ИНН: 1234567890
+КПП: 123456789
+
+Покупатель: ЗАО "Бета Снаб {n}"
+ИНН: 0987654321
+КПП: 987654321
+
+Грузоотправитель: ООО "Альфа Торг {n}", г. Москва
+
+Грузополучатель: ЗАО "Бета Снаб {n}", г. Санкт-Петербург
+
+Итого без НДС: {amount} 000,00
+НДС 20%: 20 000,00
+Всего к оплате: 120 000,00
+"""
+
+# Страница, на которой метки есть, а хвосты паттернов отсутствуют:
+# нет кавычек после метки, нет "Москва"/"Неверовского", нет ячеек после адреса, нет КПП
+ADVERSARIAL_PAGE = """
+Грузоотправитель: Индивидуальный предприниматель Сидоров, склад {n}
+ИНН 1234567890
+Грузополучатель: г. Санкт-Петербург, Невский проспект, д. {n}
+(адрес места доставки груза) Санкт-Петербург, Невский проспект
+Поставщик: Индивидуальный предприниматель Сидоров
+Покупатель: Индивидуальный предприниматель Петров
+{rows}
+"""
+
+
+class CompileCounter:
+    """Подсчет реальных компиляций регулярных выражений (промахов кэша re)"""
+
+    def __init__(self):
+        self.count = 0
+        self._module = getattr(re, "_compiler", None) or __import__("sre_compile")
+        self._original = self._module.compile
+
+    def __enter__(self):
+        def counting_compile(*args, **kwargs):
+            self.count += 1
+            return self._original(*args, **kwargs)
+        self._module.compile = counting_compile
+        return self
+
+    def __exit__(self, *exc):
+        self._module.compile = self._original
+
+
+def run_benchmark(docs: int, purge_cache: bool) -> dict:
+    """Разбор набора документов с замером времени на документ"""
+    config = Config()
+    parser = InvoiceParser(config, TextProcessor(config))
+    texts = [SAMPLE_TEXT.format(n=i, amount=100 + i % 900) for i in range(docs)]
+
+    timings = []
+    with CompileCounter() as counter:
+        for text in texts:
+            if purge_cache:
+                # Холодный кэш re: так ведет себя процесс, где кэш вытесняется другими паттернами
+                re.purge()
+            start = time.perf_counter()
+            parser.parse(text)
+            timings.append(time.perf_counter() - start)
+
+    timings.sort()
+    return {
+        "docs": docs,
+        "mean_ms": statistics.mean(timings) * 1000,
+        "p50_ms": timings[len(timings) // 2] * 1000,
+        "p95_ms": timings[int(len(timings) * 0.95) - 1] * 1000,
+        "docs_per_sec": docs / sum(timings),
+        "compiles_per_doc": counter.count / docs,
+    }
+
+
+def run_pool_benchmark(docs: int, workers: int, chunksize: int) -> dict:
+    """Пропускная способность InvoiceParser.parse_many"""
+    config = Config()
+    parser = InvoiceParser(config, TextProcessor(config))
+    texts = [SAMPLE_TEXT.format(n=i, amount=100 + i % 900) for i in range(docs)]
+
+    start = time.perf_counter()
+    results = parser.parse_many(texts, workers=workers, chunksize=chunksize)
+    elapsed = time.perf_counter() - start
+    return {
+        "workers": workers,
+        "docs_per_sec": docs / elapsed,
+        "errors": sum(1 for result in results if result.get("error")),
+    }
+
+
+def build_adversarial_text(pages: int, rows_per_page: int = 150) -> str:
+    """Многостраничный текст, на котором неограниченные DOTALL-паттерны работают квадратично"""
+    rows = "\n".join(f"| {i} | Товар {i} | шт | 10 | 1 000,00 |" for i in range(rows_per_page))
+    return "\n".join(ADVERSARIAL_PAGE.format(n=n, rows=rows) for n in range(pages))
+
+
+def run_scaling_benchmark(pages_list, repeats: int = 3) -> list:
+    """Время разбора в зависимости от числа страниц (лучшее из нескольких повторов)"""
+    config = Config()
+    parser = InvoiceParser(config, TextProcessor(config))
+
+    results = []
+    for pages in pages_list:
+        text = build_adversarial_text(pages)
+        best = min(_timed_parse(parser, text) for _ in range(repeats))
+        results.append({
+            "pages": pages,
+            "lines": text.count("\n") + 1,
+            "total_ms": best * 1000,
+            "ms_per_page": best * 1000 / pages,
+        })
+    return results
+
+
+def run_synthetic_benchmark(docs: int, seed: int = 0, options: GeneratorOptions = None) -> dict:
+    """
+    Разбор синтетического корпуса: скорость, самый медленный документ и точность полей
+
+    Документы генерируются по одному (генерация в замер не входит), поэтому
+    корпус в 100k+ документов не держится в памяти.
+    """
+    config = Config()
+    parser = InvoiceParser(config, TextProcessor(config))
+    generator = InvoiceGenerator(seed, options)
+
+    timings = []
+    matches = []
+    by_kind = defaultdict(list)
+    slowest = None
+    for document in generator.generate(docs):
+        text = document.text
+        start = time.perf_counter()
+        result = parser.parse(text)
+        elapsed = time.perf_counter() - start
+        timings.append(elapsed)
+        if slowest is None or elapsed > slowest["ms"] / 1000:
+            slowest = {"index": document.index, "type": document.document_type, "layout": document.layout,
+                       "rows": document.rows, "pages": len(document.pages), "chars": len(text),
+                       "ms": elapsed * 1000}
+        match = compare_fields(result, document.truth)
+        matches.append(match)
+        by_kind[f"{document.document_type}/{document.layout}"].append(match)
+
+    timings.sort()
+    return {
+        "docs": docs,
+        "mean_ms": statistics.mean(timings) * 1000,
+        "p50_ms": timings[len(timings) // 2] * 1000,
+        "p99_ms": timings[max(0, int(len(timings) * 0.99) - 1)] * 1000,
+        "max_ms": timings[-1] * 1000,
+        "docs_per_sec": docs / sum(timings),
+        "slowest": slowest,
+        "accuracy": field_accuracy(matches),
+        "document_accuracy": {
+            kind: sum(all(match.values()) for match in kind_matches) / len(kind_matches)
+            for kind, kind_matches in sorted(by_kind.items())
+        },
+    }
+
+
+def _timed_parse(parser: InvoiceParser, text: str) -> float:
+    start = time.perf_counter()
+    parser.parse(text)
+    return time.perf_counter() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Бенчмарк InvoiceParser")
+    arg_parser.add_argument("--docs", type=int, default=2000, help="Количество документов")
+    arg_parser.add_argument("--pages", type=int, nargs="*",
+                            help="Проверка линейности на синтетических документах из N страниц")
+    arg_parser.add_argument("--workers", type=int, nargs="*",
+                            help="Пропускная способность parse_many при указанном числе процессов")
+    arg_parser.add_argument("--chunksize", type=int, default=64, help="Размер порции parse_many")
+    arg_parser.add_argument("--synthetic", action="store_true",
+                            help="Корпус из synthetic_invoices.py с проверкой полей по эталону")
+    arg_parser.add_argument("--seed", type=int, default=0, help="Seed синтетического корпуса")
+    arg_parser.add_argument("--rows", type=int, nargs=2, default=(3, 30), metavar=("MIN", "MAX"),
+                            help="Строк товаров в синтетическом документе")
+    arg_parser.add_argument("--page-range", type=int, nargs=2, default=(1, 1), metavar=("MIN", "MAX"),
+                            help="Страниц в синтетическом документе")
+    arg_parser.add_argument("--noise", type=float, default=0.0, help="Доля символов с OCR-шумом")
+    arg_parser.add_argument("--missing", type=float, default=0.0, help="Вероятность пропуска поля")
+    args = arg_parser.parse_args()
+
+    if args.synthetic:
+        options = GeneratorOptions(pages=tuple(args.page_range), rows=tuple(args.rows),
+                                   noise=args.noise, missing=args.missing)
+        print("🧪 Синтетический корпус с эталоном")
+        print("=" * 50)
+        result = run_synthetic_benchmark(args.docs, args.seed, options)
+        print(f"Среднее: {result['mean_ms']:.3f} мс, p50: {result['p50_ms']:.3f} мс, "
+              f"p99: {result['p99_ms']:.3f} мс, максимум: {result['max_ms']:.3f} мс")
+        print(f"Пропускная способность: {result['docs_per_sec']:.0f} док/с")
+        slowest = result["slowest"]
+        print(f"Самый медленный: #{slowest['index']} {slowest['type']}/{slowest['layout']}, "
+              f"{slowest['pages']} стр., {slowest['rows']} строк, {slowest['chars']} символов")
+        print("\nТочность полей:")
+        for path, accuracy in result["accuracy"].items():
+            print(f"  {path:<28} {accuracy:.1%}")
+        print("\nДокументов без ошибок по типам и разметкам:")
+        for kind, accuracy in result["document_accuracy"].items():
+            print(f"  {kind:<28} {accuracy:.1%}")
+        return
+
+    if args.pages:
+        print("📈 Линейность разбора на неблагоприятных многостраничных текстах")
+        print("=" * 50)
+        results = run_scaling_benchmark(args.pages)
+        for result in results:
+            print(f"{result['pages']:>5} стр. ({result['lines']} строк): "
+                  f"{result['total_ms']:.1f} мс, {result['ms_per_page']:.2f} мс/стр.")
+        growth = results[-1]["ms_per_page"] / results[0]["ms_per_page"]
+        print(f"Рост времени на страницу: x{growth:.2f} (при линейной сложности ~x1)")
+        return
+
+    if args.workers:
+        print("⚙️  Пакетный разбор parse_many")
+        print("=" * 50)
+        for workers in args.workers:
+            result = run_pool_benchmark(args.docs, workers, args.chunksize)
+            print(f"{workers:>3} проц.: {result['docs_per_sec']:.0f} док/с, ошибок: {result['errors']}")
+        return
+
+    print("🧾 Бенчмарк парсера накладных")
+    print("=" * 50)
+
+    start = time.perf_counter()
+    PatternBank(Config())
+    print(f"Компиляция банка паттернов (один раз на конфигурацию): {(time.perf_counter() - start) * 1000:.2f} мс")
+
+    for purge_cache, title in ((False, "Теплый кэш re"), (True, "Холодный кэш re")):
+        result = run_benchmark(args.docs, purge_cache)
+        print(f"\n{title}:")
+        print(f"  Среднее: {result['mean_ms']:.3f} мс, p50: {result['p50_ms']:.3f} мс, p95: {result['p95_ms']:.3f} мс")
+        print(f"  Пропускная способность: {result['docs_per_sec']:.0f} док/с")
+        print(f"  Компиляций паттернов на документ: {result['compiles_per_doc']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+Воспроизводимый бенчмарк конвейера на PDF из data/ и синтетических документах
+
+Замеряет перцентили времени этапов, док/с при 1..N процессах, холодный и теплый
+старт и пиковую память. Результат - JSON со сведениями о машине; режим compare
+сравнивает его с сохраненным базовым и отмечает регрессии сверх порога.
+Запускается только на CPU.
+
+Запуск:
+    python benchmarks/pipeline_benchmark.py run --output bench.json
+    python benchmarks/pipeline_benchmark.py run --workers 1 2 4 --repeats 5 --synthetic 8 --yolo
+    python benchmarks/pipeline_benchmark.py compare bench.json --baseline baseline.json --threshold 0.15
+"""
+import os
+
+# Только CPU: переменные должны быть выставлены до импорта torch и marker
+os.environ["CUDA_VISIBLE_DEVICES"] = ""
+os.environ["TORCH_DEVICE"] = "cpu"
+
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+# Добавляем путь к модулям
+sys.path.append(str(ROOT))
+
+from src.config import Config
+from src.progress import peak_rss_kb
+
+# Шрифт с кириллицей для синтетических PDF: DejaVuSans из matplotlib одинаков на всех машинах
+FONT_CANDIDATES = (
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "C:/Windows/Fonts/arial.ttf",
+)
+
+PERCENTILES = (50, 90, 99)
+
+
+def benchmark_config() -> Config:
+    """Конфигурация замеров: CPU, без кэшей (каждый документ проходит все этапы)"""
+    return Config(torch_device="cpu", result_cache_dir=None, stage_cache_dir=None)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль по ближайшему рангу"""
+    ordered = sorted(values)
+    rank = max(1, int(round(q / 100 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """Перцентили, среднее и максимум выборки"""
+    summary = {f"p{q}_ms": round(percentile(values, q), 2) for q in PERCENTILES}
+    summary["mean_ms"] = round(statistics.mean(values), 2)
+    summary["max_ms"] = round(max(values), 2)
+    summary["samples"] = len(values)
+    return summary
+
+
+def find_font() -> Optional[str]:
+    """Путь к TTF-шрифту с кириллицей"""
+    try:
+        import matplotlib
+        path = Path(matplotlib.get_data_path()) / "fonts" / "ttf" / "DejaVuSans.ttf"
+        if path.exists():
+            return str(path)
+    except ImportError:
+        pass
+    return next((path for path in FONT_CANDIDATES if Path(path).exists()), None)
+
+
+def synthetic_documents(count: int, seed: int, pages: int = 1) -> List[List[str]]:
+    """Тексты страниц синтетических накладных (построчная разметка, помещается на страницу A4)"""
+    from synthetic_invoices import InvoiceGenerator, GeneratorOptions
+
+    options = GeneratorOptions(layouts=("lines",), pages=(pages, pages), rows=(pages * 3, pages * 8))
+    return [document.pages for document in InvoiceGenerator(seed, options).generate(count)]
+
+
+def build_synthetic_corpus(out_dir: Path, count: int, seed: int, pages: int = 1) -> List[Path]:
+    """
+    Синтетические PDF: четные - с текстовым слоем, нечетные - растровые "сканы"
+
+    Сканы получаются растеризацией страницы с текстом (150 dpi) и вставкой
+    картинки в пустой PDF, поэтому проходят через OCR, а не текстовый слой.
+    """
+    import fitz  # PyMuPDF
+
+    font = find_font()
+    if font is None:
+        raise RuntimeError("Не найден шрифт с кириллицей для синтетических PDF")
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i, page_texts in enumerate(synthetic_documents(count, seed, pages)):
+        digital = fitz.open()
+        for text in page_texts:
+            page = digital.new_page(width=595, height=842)  # A4 в пунктах
+            page.insert_font(fontname="dejavu", fontfile=font)
+            page.insert_text((30, 40), text.strip(), fontname="dejavu", fontsize=7)
+
+        if i % 2 == 0:
+            path = out_dir / f"synthetic-{i:04d}-digital.pdf"
+            digital.save(path)
+        else:
+            scan = fitz.open()
+            for page in digital:
+                pixmap = page.get_pixmap(dpi=150)
+                scan_page = scan.new_page(width=page.rect.width, height=page.rect.height)
+                scan_page.insert_image(scan_page.rect, pixmap=pixmap)
+            path = out_dir / f"synthetic-{i:04d}-scan.pdf"
+            scan.save(path)
+            scan.close()
+        digital.close()
+        paths.append(path)
+    return paths
+
+
+def measure_cold_start(path: Path, use_yolo: bool) -> Dict[str, Any]:
+    """Холодный старт в отдельном процессе: импорт, загрузка моделей, первый и повторный документ"""
+    command = [sys.executable, str(Path(__file__).resolve()), "cold", str(path)]
+    if use_yolo:
+        command.append("--yolo")
+    completed = subprocess.run(command, capture_output=True, text=True, cwd=ROOT)
+    if completed.returncode != 0:
+        return {"error": completed.stderr.strip().splitlines()[-1:] or ["неизвестная ошибка"]}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def cold_probe(path: Path, use_yolo: bool) -> Dict[str, Any]:
+    """Замер внутри свежего процесса (подкоманда cold)"""
+    start = time.perf_counter()
+    from src.batch import BatchPipeline
+    import_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    pipeline = BatchPipeline(benchmark_config(), use_yolo)
+    init_ms = (time.perf_counter() - start) * 1000
+
+    first = pipeline.process(path)
+    second = pipeline.process(path)
+    return {
+        "import_ms": round(import_ms, 1),
+        "init_ms": round(init_ms, 1),
+        "first_doc_ms": first["timings"]["total"]["wall_ms"],
+        "warm_doc_ms": second["timings"]["total"]["wall_ms"],
+        "time_to_first_result_ms": round(import_ms + init_ms + first["timings"]["total"]["wall_ms"], 1),
+        "peak_rss_mb": round((peak_rss_kb() or 0) / 1024, 1),
+        "error": first.get("error") or second.get("error"),
+    }
+
+
+def measure_stages(files: List[Path], repeats: int, use_yolo: bool) -> Dict[str, Any]:
+    """Теплые замеры в одном процессе: перцентили этапов и время документа по файлам"""
+    from src.batch import BatchPipeline
+
+    pipeline = BatchPipeline(benchmark_config(), use_yolo)
+    pipeline.process(files[0])  # прогрев
+
+    stage_ms: Dict[str, List[float]] = defaultdict(list)
+    document_ms: Dict[str, List[float]] = defaultdict(list)
+    errors = 0
+    for _ in range(repeats):
+        for path in files:
+            record = pipeline.process(path)
+            errors += bool(record.get("error"))
+            for stage, sample in record["timings"].items():
+                stage_ms[stage].append(sample["wall_ms"])
+            document_ms[path.name].append(record["timings"]["total"]["wall_ms"])
+
+    return {
+        "stages": {stage: summarize(values) for stage, values in stage_ms.items()},
+        "documents": {name: round(statistics.median(values), 2) for name, values in document_ms.items()},
+        "errors": errors,
+        "peak_rss_mb": round((peak_rss_kb() or 0) / 1024, 1),
+    }
+
+
+def measure_throughput(files: List[Path], repeats: int, workers: int, use_yolo: bool) -> Dict[str, Any]:
+    """Пропускная способность run_batch: с запуском пула и в установившемся режиме"""
+    from src.batch import run_batch
+
+    corpus = files * repeats
+    start = time.perf_counter()
+    finished = []
+    errors = 0
+    for record in run_batch(corpus, benchmark_config(), workers=workers, use_yolo=use_yolo):
+        finished.append(time.perf_counter())
+        errors += bool(record.get("error"))
+    elapsed = time.perf_counter() - start
+
+    # Установившийся режим: от первого готового документа до последнего (без загрузки моделей)
+    steady = (len(finished) - 1) / (finished[-1] - finished[0]) if len(finished) > 1 and finished[-1] > finished[0] else None
+    return {
+        "workers": workers,
+        "documents": len(corpus),
+        "docs_per_sec": round(len(corpus) / elapsed, 3),
+        "steady_docs_per_sec": round(steady, 3) if steady else None,
+        "errors": errors,
+    }
+
+
+def measure_parser(docs: int, seed: int) -> Dict[str, Any]:
+    """Разбор синтетического корпуса InvoiceParser: скорость и точность полей, см. parser_benchmark.py"""
+    from parser_benchmark import run_synthetic_benchmark
+
+    result = run_synthetic_benchmark(docs, seed)
+    result.pop("slowest")
+    return {
+        key: {name: round(value, 4) for name, value in value.items()} if isinstance(value, dict) else round(value, 4)
+        for key, value in result.items()
+    }
+
+
+def children_peak_rss_mb() -> float:
+    """Пиковый RSS самого большого завершенного дочернего процесса"""
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round((peak / 1024 if sys.platform == "darwin" else peak) / 1024, 1)
+
+
+def machine_info() -> Dict[str, Any]:
+    """Сведения о машине и версиях для сопоставимости результатов"""
+    from src.result_cache import model_versions
+
+    info = {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "cpu_model": platform.processor() or None,
+        "memory_gb": None,
+        "packages": model_versions(),
+        "git_commit": None,
+    }
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            info["cpu_model"] = next(
+                (line.split(":", 1)[1].strip() for line in f if line.startswith("model name")), info["cpu_model"]
+            )
+        with open("/proc/meminfo", "r") as f:
+            info["memory_gb"] = round(int(f.readline().split()[1]) / 2**20, 1)
+    except OSError:
+        pass
+    try:
+        import torch
+        info["torch_threads"] = torch.get_num_threads()
+    except ImportError:
+        pass
+    try:
+        info["git_commit"] = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=ROOT
+        ).stdout.strip() or None
+    except OSError:
+        pass
+    return info
+
+
+def run_suite(args) -> Dict[str, Any]:
+    """Полный прогон бенчмарка"""
+    files = sorted((ROOT / "data").glob("*.pdf"))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if args.synthetic:
+            files += build_synthetic_corpus(Path(tmpdir), args.synthetic, args.seed, args.synthetic_pages)
+        if not files:
+            raise RuntimeError("Нет документов для бенчмарка")
+        print(f"📂 Документов в корпусе: {len(files)}")
+
+        print("🧊 Холодный старт...")
+        cold = measure_cold_start(files[0], args.yolo)
+        print("🔥 Теплые замеры этапов...")
+        stages = measure_stages(files, args.repeats, args.yolo)
+        throughput = []
+        for workers in args.workers:
+            print(f"⚙️  Пропускная способность, процессов: {workers}...")
+            throughput.append(measure_throughput(files, args.repeats, workers, args.yolo))
+
+    parser = measure_parser(args.parser_docs, args.seed) if args.parser_docs else None
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "machine": machine_info(),
+        "config": {
+            "yolo": args.yolo, "repeats": args.repeats, "synthetic": args.synthetic,
+            "synthetic_pages": args.synthetic_pages, "seed": args.seed,
+            "files": [path.name for path in files],
+        },
+        "cold_start": cold,
+        "warm": stages,
+        "throughput": throughput,
+        "parser": parser,
+        "memory": {
+            "main_peak_rss_mb": round((peak_rss_kb() or 0) / 1024, 1),
+            "children_peak_rss_mb": children_peak_rss_mb(),
+        },
+    }
+
+
+# Метрики, где больше - лучше; остальные числовые (мс, МБ) - меньше лучше
+HIGHER_IS_BETTER = ("docs_per_sec", "steady_docs_per_sec", "accuracy", "document_accuracy")
+# Разделы, не участвующие в сравнении
+NOT_COMPARED = ("machine", "config", "created_at")
+
+
+def flatten(data: Any, prefix: str = "") -> Dict[str, float]:
+    """Числовые значения результата по путям вида warm.stages.ocr.p50_ms"""
+    values = {}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if not prefix and key in NOT_COMPARED:
+                continue
+            values.update(flatten(value, f"{prefix}{key}."))
+    elif isinstance(data, list):
+        for index, item in enumerate(data):
+            # Замеры пропускной способности сопоставляются по числу процессов
+            label = f"workers={item['workers']}" if isinstance(item, dict) and "workers" in item else str(index)
+            values.update(flatten(item, f"{prefix}{label}."))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        values[prefix.rstrip(".")] = float(data)
+    return values
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[Tuple[str, float, float, float]]:
+    """Регрессии: метрики, ухудшившиеся больше чем на threshold относительно базового прогона"""
+    current_values, baseline_values = flatten(current), flatten(baseline)
+    regressions = []
+    for name, base in sorted(baseline_values.items()):
+        if name not in current_values or base == 0:
+            continue
+        if name.endswith(("samples", "errors", "documents", "workers", "docs")):
+            continue
+        new = current_values[name]
+        change = (new - base) / abs(base)
+        higher_is_better = any(part in HIGHER_IS_BETTER for part in name.split("."))
+        if (higher_is_better and change < -threshold) or (not higher_is_better and change > threshold):
+            regressions.append((name, base, new, change))
+    return regressions
+
+
+def print_report(result: Dict[str, Any]):
+    """Краткий отчет в консоль"""
+    cold = result["cold_start"]
+    if "error" in cold and cold.get("error") and len(cold) == 1:
+        print(f"Холодный старт: ошибка {cold['error']}")
+    else:
+        print(f"Холодный старт: импорт {cold['import_ms']:.0f} мс, модели {cold['init_ms']:.0f} мс, "
+              f"первый документ {cold['first_doc_ms']:.0f} мс, повторный {cold['warm_doc_ms']:.0f} мс")
+    print("Этапы (теплый процесс), мс:")
+    for stage, summary in result["warm"]["stages"].items():
+        print(f"  {stage:<12} p50 {summary['p50_ms']:>9.1f}  p90 {summary['p90_ms']:>9.1f}  "
+              f"p99 {summary['p99_ms']:>9.1f}  n={summary['samples']}")
+    for item in result["throughput"]:
+        steady = f", установившийся {item['steady_docs_per_sec']:.2f}" if item["steady_docs_per_sec"] else ""
+        print(f"{item['workers']:>3} проц.: {item['docs_per_sec']:.2f} док/с{steady}, ошибок: {item['errors']}")
+    if result["parser"]:
+        parser = result["parser"]
+        print(f"Парсер: {parser['docs_per_sec']:.0f} док/с, p99 {parser['p99_ms']:.3f} мс, "
+              f"точность полей {statistics.mean(parser['accuracy'].values()):.1%}")
+    memory = result["memory"]
+    print(f"Пиковая память: основной процесс {memory['main_peak_rss_mb']:.0f} МБ, "
+          f"процесс пула {memory['children_peak_rss_mb']:.0f} МБ")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    arg_parser = argparse.ArgumentParser(description="Бенчмарк конвейера извлечения (только CPU)")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Прогон бенчмарка")
+    run.add_argument("--output", "-o", type=Path, default=Path("benchmark_results.json"))
+    run.add_argument("--workers", type=int, nargs="+", default=[1, 2], help="Числа процессов для замера док/с")
+    run.add_argument("--repeats", type=int, default=3, help="Повторов корпуса в каждом замере")
+    run.add_argument("--synthetic", type=int, default=4, help="Количество синтетических PDF")
+    run.add_argument("--synthetic-pages", type=int, default=1, help="Страниц в синтетическом PDF")
+    run.add_argument("--seed", type=int, default=2025)
+    run.add_argument("--parser-docs", type=int, default=2000, help="Документов в замере парсера (0 - пропустить)")
+    run.add_argument("--yolo", action="store_true", help="YOLO + Marker обработка")
+
+    cmp = commands.add_parser("compare", help="Сравнение с базовым результатом")
+    cmp.add_argument("result", type=Path)
+    cmp.add_argument("--baseline", type=Path, required=True)
+    cmp.add_argument("--threshold", type=float, default=0.15, help="Допустимое ухудшение (доля, 0.15 = 15%%)")
+
+    cold = commands.add_parser("cold", help=argparse.SUPPRESS)
+    cold.add_argument("file", type=Path)
+    cold.add_argument("--yolo", action="store_true")
+
+    args = arg_parser.parse_args(argv)
+
+    if args.command == "cold":
+        print(json.dumps(cold_probe(args.file, args.yolo), ensure_ascii=False))
+        return 0
+
+    if args.command == "compare":
+        current = json.loads(args.result.read_text(encoding="utf-8"))
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        if current["machine"].get("cpu_model") != baseline["machine"].get("cpu_model"):
+            print("⚠️  Результаты получены на разных процессорах, сравнение приблизительное")
+        regressions = compare(current, baseline, args.threshold)
+        if not regressions:
+            print(f"✅ Регрессий больше {args.threshold:.0%} нет")
+            return 0
+        print(f"❌ Регрессии больше {args.threshold:.0%}:")
+        for name, base, new, change in regressions:
+            print(f"  {name}: {base:.2f} -> {new:.2f} ({change:+.0%})")
+        return 1
+
+    result = run_suite(args)
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    print_report(result)
+    print(f"💾 Результаты: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,509 @@
+#!/usr/bin/env python3
+"""
+Генератор синтетических накладных в стиле вывода Marker с эталонными полями
+
+ТОРГ-12, транспортная накладная (ТН) и счет-фактура управляемого размера
+(страницы, строки товаров) в трех разметках: строки "Метка: значение",
+таблицы Markdown и разорванные ячейки (метка и значение в разных строках
+таблицы, <br> в ячейках, «елочки»). Поверх текста можно наложить OCR-шум
+и пропустить часть полей. Документ i зависит только от seed и i, поэтому
+корпус воспроизводим и генерируется по частям.
+
+Эталон (truth) описывает документ по смыслу, а не то, что найдет парсер:
+если грузоотправитель не совпадает с поставщиком, поставщик в эталоне -
+тот, кто указан в строке "Поставщик". Пропущенные поля в эталоне - None.
+
+Запуск:
+    python benchmarks/synthetic_invoices.py --count 100000 --seed 7 --output corpus.jsonl
+    python benchmarks/synthetic_invoices.py --count 2 --pages 2 3 --noise 0.02 --missing 0.2 --print
+"""
+import sys
+import json
+import time
+import random
+import argparse
+from dataclasses import dataclass, field, asdict
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple, Iterator
+
+DOCUMENT_TYPES = ("torg12", "tn", "invoice")
+LAYOUTS = ("lines", "table", "cells")
+
+# Тип документа, который должен определить InvoiceParser
+DOCUMENT_TYPE_NAMES = {
+    "torg12": "Товарная накладная (ТОРГ-12)",
+    "tn": "Накладная",
+    "invoice": "Счет-фактура",
+}
+
+# Поля эталона (пути в результате InvoiceParser.parse)
+TRUTH_FIELDS = (
+    "document_type", "number", "date",
+    "supplier.name", "supplier.INN", "supplier.KPP",
+    "buyer.name", "buyer.INN", "buyer.KPP",
+    "shipper", "consignee",
+    "amounts.total_without_vat", "amounts.vat", "amounts.total_with_vat",
+)
+
+# Поля, которые могут отсутствовать в документе (GeneratorOptions.missing)
+OPTIONAL_FIELDS = ("number", "date", "supplier.INN", "supplier.KPP", "buyer.INN", "buyer.KPP", "shipper", "consignee")
+
+# Типичные замены символов при OCR (кириллица и латиница, цифры и буквы)
+OCR_CONFUSIONS = {
+    "0": "О", "О": "0", "о": "o", "3": "З", "З": "3", "1": "l", "6": "б", "б": "6",
+    "8": "В", "В": "8", "е": "e", "а": "a", "с": "c", "р": "p", "Н": "H", "К": "K",
+    "М": "M", "Т": "T", "Р": "P", ",": ".", ".": ",", "№": "N", "|": "l", "-": "—",
+}
+
+ORG_FORMS = (
+    ("ООО", "Общество с ограниченной ответственностью"),
+    ("АО", "Акционерное общество"),
+    ("ЗАО", "Закрытое акционерное общество"),
+    ("ПАО", "Публичное акционерное общество"),
+)
+NAME_PARTS = (
+    "Альфа", "Бета", "Гамма", "Вектор", "Север", "Восток", "Техно", "Агро", "Строй",
+    "Торг", "Снаб", "Пром", "Логистик", "Транс", "Маркет", "Сервис", "Опт", "Ресурс",
+)
+CITIES = ("г. Москва", "г. Санкт-Петербург", "г. Казань", "г. Екатеринбург", "г. Новосибирск", "г. Самара")
+STREETS = ("ул. Ленина", "ул. Мира", "пр. Победы", "ул. Садовая", "Невский проспект", "ул. Заводская")
+GOODS = (
+    "Бумага офисная А4", "Картридж лазерный", "Цемент М500", "Кабель ВВГнг 3х2,5", "Масло моторное 5W-40",
+    "Перчатки рабочие", "Труба ПНД 32 мм", "Краска фасадная", "Саморез по дереву", "Молоко 3,2%",
+    "Сахар-песок", "Поддон деревянный", "Стретч-пленка", "Лампа светодиодная", "Огнетушитель ОП-4",
+)
+UNITS = ("шт", "кг", "уп", "м", "л", "т")
+
+GOODS_HEADERS = {
+    "torg12": ("№", "Товар, наименование", "Ед. изм.", "Кол-во", "Цена, руб. коп.",
+               "Сумма без учета НДС", "НДС, ставка %", "НДС, сумма", "Сумма с учетом НДС"),
+    "tn": ("№", "Наименование груза", "Ед. изм.", "Кол-во мест", "Цена",
+           "Стоимость без НДС", "Ставка НДС", "НДС", "Стоимость с НДС"),
+    "invoice": ("№", "Наименование товара", "Ед. изм.", "Количество", "Цена за единицу",
+                "Стоимость без налога", "Налоговая ставка", "Сумма налога", "Стоимость с налогом"),
+}
+
+INN_WEIGHTS = (2, 4, 10, 3, 5, 9, 4, 6, 8)
+
+
+@dataclass
+class GeneratorOptions:
+    """Параметры корпуса; диапазоны (min, max) включительно"""
+
+    document_types: Tuple[str, ...] = DOCUMENT_TYPES
+    layouts: Tuple[str, ...] = LAYOUTS
+    pages: Tuple[int, int] = (1, 1)
+    rows: Tuple[int, int] = (3, 30)  # строк товаров на документ
+    noise: float = 0.0  # доля символов, искаженных OCR
+    missing: float = 0.0  # вероятность пропуска каждого из OPTIONAL_FIELDS
+
+
+@dataclass
+class SyntheticDocument:
+    """Синтетический документ: текст по страницам и эталонные поля"""
+
+    index: int
+    document_type: str
+    layout: str
+    rows: int
+    pages: List[str]
+    truth: Dict[str, Any]
+    missing: List[str] = field(default_factory=list)
+
+    @property
+    def text(self) -> str:
+        """Текст документа, страницы разделены как в MarkerRunner.extract_text"""
+        return "\n\n".join(self.pages)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data.pop("pages")
+        data["text"] = self.text
+        data["page_count"] = len(self.pages)
+        return data
+
+
+class InvoiceGenerator:
+    """Детерминированный генератор корпуса: документ i определяется seed и i"""
+
+    def __init__(self, seed: int = 0, options: Optional[GeneratorOptions] = None):
+        self.seed = seed
+        self.options = options or GeneratorOptions()
+
+    def generate(self, count: int, start: int = 0) -> Iterator[SyntheticDocument]:
+        """Документы start..start+count-1"""
+        for index in range(start, start + count):
+            yield self.document(index)
+
+    def document(self, index: int) -> SyntheticDocument:
+        """Документ с номером index"""
+        options = self.options
+        rng = random.Random(f"{self.seed}:{index}")
+        document_type = rng.choice(options.document_types)
+        layout = rng.choice(options.layouts)
+        missing = [name for name in OPTIONAL_FIELDS if rng.random() < options.missing]
+        rows = rng.randint(*options.rows)
+        page_count = max(1, min(rng.randint(*options.pages), rows))
+
+        supplier = self._company(rng)
+        buyer = self._company(rng)
+        if document_type == "tn":
+            # В ТН стороны - грузоотправитель и грузополучатель
+            shipper, consignee = supplier, buyer
+        else:
+            shipper = supplier if rng.random() < 0.6 else self._company(rng)
+            consignee = buyer if rng.random() < 0.6 else self._company(rng)
+
+        number = self._number(rng, document_type)
+        issued = date(2020, 1, 1) + timedelta(days=rng.randrange(2500))
+        goods, totals = self._goods(rng, rows)
+
+        doc = _Builder(rng, document_type, layout, set(missing))
+        first_page = doc.header(number, self._format_date(rng, issued))
+        first_page += doc.parties(supplier, buyer, shipper, consignee)
+
+        # Строки товаров по страницам; итоги и подписи на последней
+        pages = []
+        per_page = -(-rows // page_count)
+        for page_number in range(page_count):
+            chunk = goods[page_number * per_page:(page_number + 1) * per_page]
+            lines = first_page if page_number == 0 else [f"Лист {page_number + 1}", ""]
+            lines += doc.goods_table(chunk)
+            if page_number == page_count - 1:
+                lines += doc.totals(totals)
+                lines += doc.signatures()
+            pages.append("\n".join(lines))
+
+        if options.noise > 0:
+            pages = [_add_noise(rng, page, options.noise) for page in pages]
+
+        truth = self._truth(document_type, number, issued, supplier, buyer, shipper, consignee, totals, set(missing))
+        return SyntheticDocument(index, document_type, layout, rows, pages, truth, missing)
+
+    def _company(self, rng: random.Random) -> Dict[str, str]:
+        short, full = rng.choice(ORG_FORMS)
+        core = f"{rng.choice(NAME_PARTS)} {rng.choice(NAME_PARTS)}"
+        if rng.random() < 0.5:
+            core += f" {rng.randint(1, 99)}"
+        return {
+            "short": short, "full": full, "core": core,
+            "inn": _inn(rng), "kpp": f"{rng.randint(1000, 9999)}01001",
+            "address": f"{rng.choice(CITIES)}, {rng.choice(STREETS)}, д. {rng.randint(1, 150)}",
+        }
+
+    def _number(self, rng: random.Random, document_type: str) -> str:
+        style = rng.random()
+        if style < 0.4:
+            return str(rng.randint(1, 9999))
+        if style < 0.8:
+            prefix = {"torg12": "ТН", "tn": "ТН", "invoice": "СФ"}[document_type]
+            return f"{prefix}-{rng.randint(2020, 2026)}-{rng.randint(1, 99999):05d}"
+        return f"А-{rng.randint(1, 999)}/{rng.randint(1, 12)}"
+
+    def _format_date(self, rng: random.Random, value: date) -> str:
+        return value.strftime(rng.choice(("%d.%m.%Y", "%d.%m.%Y", "%d.%m.%Y", "%d.%m.%y", "%d/%m/%Y")))
+
+    def _goods(self, rng: random.Random, rows: int) -> Tuple[List[Tuple], Dict[str, Any]]:
+        """Строки товаров и итоги (суммы в копейках, чтобы итоги сходились точно)"""
+        rate = 20 if rng.random() < 0.85 else 10
+        goods = []
+        total_net = total_vat = 0
+        uniform = rng.random  # быстрее randint/choice на больших корпусах
+        for i in range(rows):
+            quantity = 1 + int(uniform() * 500)
+            price = 1000 + int(uniform() * 4_999_000)  # копейки
+            net = quantity * price
+            vat = (net * rate + 50) // 100
+            name = GOODS[int(uniform() * len(GOODS))]
+            goods.append((i + 1, name, UNITS[int(uniform() * len(UNITS))], quantity, price, net, rate, vat))
+            total_net += net
+            total_vat += vat
+        return goods, {"rate": rate, "net": total_net, "vat": total_vat, "gross": total_net + total_vat}
+
+    def _truth(self, document_type, number, issued, supplier, buyer, shipper, consignee,
+               totals, missing) -> Dict[str, Any]:
+        def party(company, prefix, present=True):
+            if not present:
+                return {"name": None, "INN": None, "KPP": None}
+            return {
+                "name": company["core"],
+                "INN": None if f"{prefix}.INN" in missing else company["inn"],
+                "KPP": None if f"{prefix}.KPP" in missing else company["kpp"],
+            }
+
+        # В ТН стороны печатаются только в блоках грузоотправителя и грузополучателя
+        tn = document_type == "tn"
+        return {
+            "document_type": DOCUMENT_TYPE_NAMES[document_type],
+            "number": None if "number" in missing else number,
+            "date": None if "date" in missing else issued.strftime("%d.%m.%Y"),
+            "supplier": party(supplier, "supplier", not (tn and "shipper" in missing)),
+            "buyer": party(buyer, "buyer", not (tn and "consignee" in missing)),
+            "shipper": None if "shipper" in missing else shipper["core"],
+            "consignee": None if "consignee" in missing else consignee["core"],
+            "amounts": {
+                "total_without_vat": totals["net"] / 100,
+                "vat": totals["vat"] / 100,
+                "total_with_vat": totals["gross"] / 100,
+            },
+        }
+
+
+class _Builder:
+    """Строки документа одного типа и разметки"""
+
+    def __init__(self, rng: random.Random, document_type: str, layout: str, missing: set):
+        self.rng = rng
+        self.type = document_type
+        self.layout = layout
+        self.missing = missing
+
+    def header(self, number: str, issued: str) -> List[str]:
+        number = None if "number" in self.missing else number
+        issued = None if "date" in self.missing else issued
+        title = {"torg12": "ТОВАРНАЯ НАКЛАДНАЯ", "tn": "ТРАНСПОРТНАЯ НАКЛАДНАЯ", "invoice": "СЧЕТ-ФАКТУРА"}[self.type]
+        lines = []
+        if self.type == "torg12":
+            lines += ["Унифицированная форма № ТОРГ-12", "Форма по ОКУД 0330212", ""]
+
+        if self.layout == "cells":
+            # Номер и дата в отдельных ячейках шапки, как в распознанном бланке
+            lines += [
+                f"| {title} | Номер документа | Дата составления |",
+                "|---|---|---|",
+                f"| | {number or ''} | {issued or ''} |",
+            ]
+        else:
+            requisites = " ".join(part for part in (
+                f"№ {number}" if number else "", f"от {issued}" if issued else ""
+            ) if part)
+            if self.type == "tn":
+                line = f"ТН {requisites}".strip() if requisites else ""
+                lines += [f"# {title}", line]
+            else:
+                line = f"{title} {requisites}".strip()
+                lines.append(f"**{line}**" if self.layout == "table" else line)
+        return lines + [""]
+
+    def parties(self, supplier, buyer, shipper, consignee) -> List[str]:
+        if self.type == "tn":
+            blocks = [("1. Грузоотправитель", shipper, "shipper", "supplier"),
+                      ("2. Грузополучатель", consignee, "consignee", "buyer")]
+        elif self.type == "torg12":
+            buyer_label = "Плательщик" if self.rng.random() < 0.3 else "Покупатель"
+            blocks = [("Грузоотправитель", shipper, "shipper", None), ("Грузополучатель", consignee, "consignee", None),
+                      ("Поставщик", supplier, None, "supplier"), (buyer_label, buyer, None, "buyer")]
+        else:
+            blocks = [("Продавец", supplier, None, "supplier"),
+                      ("Грузоотправитель и его адрес", shipper, "shipper", None),
+                      ("Грузополучатель и его адрес", consignee, "consignee", None),
+                      ("Покупатель", buyer, None, "buyer")]
+
+        lines = []
+        for label, company, presence, requisites in blocks:
+            if presence in self.missing:
+                continue
+            inn = None if requisites and f"{requisites}.INN" in self.missing else company["inn"]
+            kpp = None if requisites and f"{requisites}.KPP" in self.missing else company["kpp"]
+            lines += self._party(label, company, inn, kpp)
+        if self.type == "tn":
+            lines += self._delivery(consignee)
+        return lines
+
+    def _party(self, label: str, company, inn: Optional[str], kpp: Optional[str]) -> List[str]:
+        if self.layout == "lines":
+            name = f'{company["short"]} "{company["core"]}"'
+            if self.type == "invoice":
+                requisites = "/".join(value for value in (inn, kpp) if value)
+                return [f"{label}: {name}", f"Адрес: {company['address']}",
+                        *([f"ИНН/КПП: {requisites}"] if requisites else []), ""]
+            colon = ":" if self.rng.random() < 0.5 else ""
+            return [f"{label}: {name}", *([f"ИНН{colon} {inn}"] if inn else []),
+                    *([f"КПП{colon} {kpp}"] if kpp else []), ""]
+
+        requisites = ", ".join(f"{key} {value}" for key, value in (("ИНН", inn), ("КПП", kpp)) if value)
+        if self.layout == "table":
+            value = f'{company["full"]} "{company["core"]}"'
+            value = ", ".join(part for part in (value, requisites, company["address"]) if part)
+            return [f"| {label} | | {value} |", ""]
+
+        # cells: метка и значение в разных строках, перенос внутри ячейки
+        return [
+            f"| {label} | |",
+            "|---|---|",
+            f'| {company["short"]} «{company["core"]}»<br>{company["address"]} | {requisites} |',
+            "",
+        ]
+
+    def _delivery(self, consignee) -> List[str]:
+        arrival = date(2020, 1, 1) + timedelta(days=self.rng.randrange(2500))
+        start = self.rng.randint(8, 14)
+        return [
+            "| 3. Прием груза | | |",
+            f"| адрес места доставки груза | | {consignee['address']} |",
+            "",
+            f"Дата доставки: {arrival:%d.%m.%Y}, с {start:02d}:00 до {start + 4:02d}:00",
+            "",
+        ]
+
+    def goods_table(self, goods: List[Tuple]) -> List[str]:
+        header = GOODS_HEADERS[self.type]
+        lines = ["| " + " | ".join(header) + " |", "|" + "---|" * len(header)]
+        for number, name, unit, quantity, price, net, rate, vat in goods:
+            if self.layout == "cells" and self.rng.random() < 0.3:
+                name = name.replace(" ", "<br>", 1)
+            lines.append(
+                f"| {number} | {name} | {unit} | {quantity} | {_money(price)} | {_money(net)} "
+                f"| {rate}% | {_money(vat)} | {_money(net + vat)} |"
+            )
+        return lines + [""]
+
+    def totals(self, totals: Dict[str, Any]) -> List[str]:
+        net, vat, gross = (_money(totals[key]) for key in ("net", "vat", "gross"))
+        if self.layout == "lines":
+            return [f"Итого без НДС: {net}", f"НДС {totals['rate']}%: {vat}", f"Всего к оплате: {gross}", ""]
+        if self.layout == "table":
+            return [f"| Итого | | | | | {net} | {totals['rate']}% | {vat} | {gross} |", ""]
+        return [
+            "| Итого без НДС | НДС | Всего с НДС |",
+            "|---|---|---|",
+            f"| {net} | {vat} | {gross} |",
+            "",
+        ]
+
+    def signatures(self) -> List[str]:
+        if self.type == "invoice":
+            return ["Руководитель организации ____________", "Главный бухгалтер ____________"]
+        if self.type == "tn":
+            return ["Груз к перевозке принял ____________", "Груз получил грузополучатель ____________"]
+        return ["Отпуск груза разрешил ____________", "Главный (старший) бухгалтер ____________",
+                "Груз получил грузополучатель ____________"]
+
+
+def _inn(rng: random.Random) -> str:
+    """ИНН юридического лица с верным контрольным разрядом"""
+    digits = str(rng.randrange(100_000_000, 1_000_000_000))
+    check = sum(weight * int(digit) for weight, digit in zip(INN_WEIGHTS, digits)) % 11 % 10
+    return f"{digits}{check}"
+
+
+def _money(kopecks: int) -> str:
+    """Сумма в формате 1 234 567,89"""
+    return format(kopecks / 100, ",.2f").replace(",", " ").replace(".", ",")
+
+
+def _add_noise(rng: random.Random, text: str, rate: float) -> str:
+    """OCR-шум: замены похожих символов, пропуски и лишние пробелы в доле rate символов"""
+    chars = list(text)
+    edits = int(len(chars) * rate + rng.random())
+    for position in rng.sample(range(len(chars)), min(edits, len(chars))):
+        char = chars[position]
+        kind = rng.random()
+        if kind < 0.7:
+            chars[position] = OCR_CONFUSIONS.get(char, char)
+        elif kind < 0.85:
+            chars[position] = "" if char != "\n" else char
+        else:
+            chars[position] = char + " "
+    return "".join(chars)
+
+
+def _get(data: Dict[str, Any], path: str) -> Any:
+    for key in path.split("."):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+def _fold(value: str) -> str:
+    return " ".join(value.lower().replace('"', " ").replace("«", " ").replace("»", " ").split())
+
+
+def _company_core(value: str) -> str:
+    """Название без организационно-правовой формы, кавычек и концевой пунктуации"""
+    folded = _fold(value).strip(" ,.;:")
+    for short, full in ORG_FORMS:
+        for form in (full.lower(), short.lower()):
+            if folded.startswith(form + " "):
+                return folded[len(form):].strip(" ,.;:")
+    return folded
+
+
+def compare_fields(result: Dict[str, Any], truth: Dict[str, Any]) -> Dict[str, bool]:
+    """
+    Совпадение полей результата InvoiceParser с эталоном
+
+    Суммы сравниваются с точностью до копейки, названия - на равенство
+    эталонному после отбрасывания формы организации, кавычек и регистра;
+    название с остатками таблицы или меток ("|", "и его адрес:") неверно.
+    Для отсутствующего в документе поля верен только пустой результат.
+    """
+    matches = {}
+    for path in TRUTH_FIELDS:
+        expected, actual = _get(truth, path), _get(result, path)
+        if expected is None:
+            matches[path] = not actual
+        elif isinstance(expected, float):
+            matches[path] = isinstance(actual, (int, float)) and abs(actual - expected) < 0.005
+        elif path.endswith("name") or path in ("shipper", "consignee"):
+            matches[path] = (isinstance(actual, str) and "|" not in actual
+                             and _company_core(actual) == _fold(expected))
+        else:
+            matches[path] = actual == expected
+    return matches
+
+
+def field_accuracy(matches: List[Dict[str, bool]]) -> Dict[str, float]:
+    """Доля верных значений по каждому полю"""
+    if not matches:
+        return {}
+    return {path: sum(match[path] for match in matches) / len(matches) for path in TRUTH_FIELDS}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    arg_parser = argparse.ArgumentParser(description="Генератор синтетических накладных с эталоном")
+    arg_parser.add_argument("--count", type=int, default=1000, help="Количество документов")
+    arg_parser.add_argument("--start", type=int, default=0, help="Номер первого документа")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--types", nargs="+", choices=DOCUMENT_TYPES, default=list(DOCUMENT_TYPES))
+    arg_parser.add_argument("--layouts", nargs="+", choices=LAYOUTS, default=list(LAYOUTS))
+    arg_parser.add_argument("--pages", type=int, nargs=2, default=(1, 1), metavar=("MIN", "MAX"))
+    arg_parser.add_argument("--rows", type=int, nargs=2, default=(3, 30), metavar=("MIN", "MAX"))
+    arg_parser.add_argument("--noise", type=float, default=0.0, help="Доля символов с OCR-шумом")
+    arg_parser.add_argument("--missing", type=float, default=0.0, help="Вероятность пропуска поля")
+    arg_parser.add_argument("--output", "-o", type=Path, help="JSONL: текст, эталон и параметры документа")
+    arg_parser.add_argument("--print", action="store_true", help="Печать текстов и эталона")
+    args = arg_parser.parse_args(argv)
+
+    options = GeneratorOptions(
+        document_types=tuple(args.types), layouts=tuple(args.layouts),
+        pages=tuple(args.pages), rows=tuple(args.rows), noise=args.noise, missing=args.missing,
+    )
+    generator = InvoiceGenerator(args.seed, options)
+
+    start = time.perf_counter()
+    output = args.output.open("w", encoding="utf-8") if args.output else None
+    characters = 0
+    try:
+        for document in generator.generate(args.count, args.start):
+            characters += len(document.text)
+            if output:
+                output.write(json.dumps(document.to_dict(), ensure_ascii=False) + "\n")
+            if args.print:
+                print(document.text)
+                print(json.dumps(document.truth, ensure_ascii=False, indent=2))
+                print("=" * 50)
+    finally:
+        if output:
+            output.close()
+    elapsed = time.perf_counter() - start
+
+    print(f"📄 Документов: {args.count}, символов: {characters}, "
+          f"{args.count / elapsed:.0f} док/с ({elapsed:.1f} с)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,390 @@
+# src/batch.py
+"""
+Пакетная обработка каталога накладных без веб-интерфейса
+
+Примеры:
+    python -m src.batch data/ --output results.jsonl --workers 2
+    python -m src.batch manifest.txt --output results.jsonl --shard 0/4 --yolo
+"""
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+import tempfile
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Set, Tuple, Iterator, Callable, Union
+
+from .config import Config
+from .utils import TextProcessor, MarkerRunner, YoloMarkerProcessor
+from .parser import InvoiceParser
+from .result_cache import ResultCache, file_sha256
+from .progress import ProgressReporter, ProgressCallback, ProgressEvent
+from .metrics import get_metrics, observe_document, serve_metrics, write_metrics
+from .inference_backends import BACKENDS
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = {".pdf", ".png", ".jpg", ".jpeg", ".tiff", ".bmp"}
+
+
+class BatchPipeline:
+    """Конвейер одного процесса: модели загружаются один раз и обслуживают все файлы"""
+
+    def __init__(self, config: Config, use_yolo: bool = False):
+        self.config = config
+        self.invoice_parser = InvoiceParser(config, TextProcessor(config))
+
+        self.processor = YoloMarkerProcessor(config) if use_yolo else None
+        if self.processor is not None and not self.processor.is_field_detection_available():
+            logger.warning("YOLO недоступен, используется стандартная обработка")
+            self.processor = None
+        elif self.processor is not None and not self.processor.is_yolo_available():
+            logger.warning("YOLO недоступен, поля ищутся только по шаблонам форм")
+        self.marker_runner = self.processor.marker_runner if self.processor else MarkerRunner(config)
+
+        # Кэш по содержимому файла: повторная загрузка того же документа не запускает OCR
+        pipeline = "marker"
+        if self.processor:
+            detector = self.processor.yolo_detector
+            parts = []
+            # Экспортированные модели дают близкие, но не равные PyTorch боксы
+            if detector.is_available():
+                parts.append("yolo" if detector.backend_name == "pytorch" else f"yolo:{detector.model.identity}")
+            # Боксы шаблонов форм заменяют YOLO на совмещенных страницах
+            if self.processor.templates:
+                parts.append(f"templates:{self.processor.templates.fingerprint}")
+            pipeline = "+".join(parts)
+        self.cache = ResultCache.from_config(
+            config,
+            pipeline=pipeline,
+            yolo_model_path=self.processor.yolo_detector.model_path if self.processor else None
+        )
+        self.stage_cache = self.marker_runner.stage_cache
+
+    def process(self, input_path: Path,
+                progress: Union[ProgressReporter, ProgressCallback, None] = None,
+                details: bool = False) -> Dict[str, Any]:
+        """
+        Обработка одного файла: запись для JSONL с результатом и замерами этапов
+
+        Args:
+            input_path: Путь к документу
+            progress: Получатель событий обработки (callback или ProgressReporter);
+                замеры этапов в записи собираются тем же источником событий
+            details: Добавить в запись данные для интерфейса: текст документа (text),
+                поля YOLO (yolo_detection.fields) и детекции страниц с растрами
+                (detections, DetectionResult; пусто при попадании в кэш). Такая запись
+                в JSON не сериализуется, растры переводит в изображения вызывающая сторона
+        """
+        record: Dict[str, Any] = {"file": str(input_path), "timings": {}}
+        reporter = ProgressReporter.wrap(progress, self.config.trace_memory)
+        text, fields, detections = "", [], []
+
+        try:
+            cache_key = self.cache.key(file_sha256(input_path)) if self.cache else None
+            cached = self.cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                record.update(cached["record"])
+                record["cache"] = "hit"
+                text = cached["marker_text"]
+                reporter.partial("parse", result=record["result"], cache="hit")
+                return self._finish(record, reporter, (text, fields, detections) if details else None)
+
+            with tempfile.TemporaryDirectory() as tmpdir:
+                output_dir = Path(tmpdir)
+
+                if self.processor is not None:
+                    enhanced, detections = self.processor.process_with_detections(input_path, output_dir, reporter)
+                    if not enhanced.get("processing_success"):
+                        raise RuntimeError(enhanced.get("error") or "Ошибка YOLO + Marker обработки")
+                    text = enhanced.get("marker_text", "")
+                    # Без растров страниц детекции нет, но текст Marker еще можно разобрать
+                    fields = (enhanced.get("yolo_detection") or {}).get("fields", [])
+                    record["yolo_detection"] = {
+                        key: value for key, value in (enhanced.get("yolo_detection") or {}).items()
+                        if key != "fields"
+                    }
+                    record["field_texts"] = enhanced.get("field_texts", {})
+                    record["page_sources"] = enhanced.get("page_sources", [])
+                    ocr_key = enhanced["stage_keys"].get("ocr", "")
+                else:
+                    extraction = self.marker_runner.extract_text(input_path, output_dir, progress=reporter)
+                    text = extraction["text"]
+                    record["page_sources"] = extraction["page_sources"]
+                    ocr_key = extraction["stage_key"]
+
+            # После правки паттернов текст берется из архива этапов, пересчитывается только парсинг
+            parse_key = self.stage_cache.key("parse", self.config, ocr_key)
+            with reporter.stage("parse"):
+                record["result"] = self.stage_cache.memoize(
+                    "parse", parse_key, lambda: self.invoice_parser.parse(text),
+                    should_cache=lambda result: not result.get("error")
+                )
+            reporter.partial("parse", result=record["result"])
+
+            # Результат со сбоем этапа (ошибка парсинга, упавшая детекция) не кэшируется
+            failed = record["result"].get("error") or (record.get("yolo_detection") or {}).get("errors")
+            if cache_key and not failed:
+                record["cache"] = "miss"
+                cached_fields = {k: v for k, v in record.items() if k not in ("file", "timings", "cache")}
+                self.cache.put(cache_key, {"record": cached_fields, "marker_text": text})
+
+        except Exception as e:
+            logger.exception(f"Ошибка обработки файла {input_path}")
+            record["error"] = str(e)
+
+        return self._finish(record, reporter, (text, fields, detections) if details else None)
+
+    def _finish(self, record: Dict[str, Any], reporter: ProgressReporter,
+                details: Optional[Tuple[str, List[Dict[str, Any]], List[Any]]] = None) -> Dict[str, Any]:
+        """Блок timings в записи, метрики, строка лога с замерами документа и данные для интерфейса"""
+        record["timings"] = reporter.report()
+        observe_document("yolo" if self.processor else "marker", record["timings"], record.get("error"))
+        reporter.log_summary(record["file"], cache=record.get("cache"), error=record.get("error"))
+        if details:
+            text, fields, detections = details
+            record["text"] = text
+            record["detections"] = detections
+            if record.get("yolo_detection") is not None:
+                record["yolo_detection"] = {**record["yolo_detection"], "fields": fields}
+        return record
+
+
+def collect_inputs(source: Path) -> List[Path]:
+    """
+    Список файлов для обработки
+
+    Args:
+        source: Каталог (обходится рекурсивно) или манифест - текстовый файл
+            с путем на строку; относительные пути считаются от каталога манифеста
+    """
+    if source.is_dir():
+        return sorted(
+            path for path in source.rglob("*")
+            if path.is_file() and path.suffix.lower() in SUPPORTED_EXTENSIONS
+        )
+
+    paths = []
+    with open(source, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            path = Path(line)
+            paths.append(path if path.is_absolute() else source.parent / path)
+    return paths
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """Разбор '--shard i/N' (i с нуля)"""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Ожидается формат i/N, получено: {value}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"Неверный номер шарда: {value}")
+    return index, count
+
+
+def in_shard(path: Path, source: Path, shard: Tuple[int, int]) -> bool:
+    """
+    Принадлежность файла шарду
+
+    Шард определяется хешем пути относительно источника, а не позицией файла
+    в списке, поэтому узлы с разными точками монтирования и разным порядком
+    обхода делят корпус без пересечений и без брокера.
+    """
+    index, count = shard
+    root = source if source.is_dir() else source.parent
+    try:
+        key = path.relative_to(root).as_posix()
+    except ValueError:
+        key = path.as_posix()
+    digest = hashlib.sha1(key.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count == index
+
+
+def load_processed(output_path: Path) -> Set[str]:
+    """Файлы, уже успешно обработанные в прошлых запусках (записи без ошибки)"""
+    processed = set()
+    if not output_path.exists():
+        return processed
+
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Оборванная последняя строка после аварийной остановки
+                continue
+            if not record.get("error"):
+                processed.add(record["file"])
+    return processed
+
+
+# Конвейер процесса пула (создается один раз при запуске процесса)
+_worker_pipeline: Optional[BatchPipeline] = None
+
+
+def _init_worker(config: Config, use_yolo: bool):
+    """Инициализация процесса пула: загрузка моделей до первого файла"""
+    global _worker_pipeline
+    _worker_pipeline = BatchPipeline(config, use_yolo)
+
+
+def _process_file(path: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Обработка файла в процессе пула; метрики процесса передаются вместе с записью"""
+    record = _worker_pipeline.process(Path(path))
+    return record, get_metrics().drain()
+
+
+def run_batch(files: List[Path], config: Config, workers: int = 1, use_yolo: bool = False,
+              progress: Optional[Callable[[Path, ProgressEvent], None]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Обработка списка файлов; записи выдаются по мере готовности
+
+    При workers > 1 каждый процесс пула держит свою копию моделей,
+    в работе одновременно не больше 2 * workers файлов. События обработки
+    (progress) передаются только в однопроцессном режиме; в пуле из них
+    собираются только длительности этапов записи.
+    """
+    if workers <= 1:
+        pipeline = BatchPipeline(config, use_yolo)
+        for path in files:
+            yield pipeline.process(path, (lambda event, path=path: progress(path, event)) if progress else None)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(config, use_yolo)) as executor:
+        pending = {}
+        for path in files:
+            pending[executor.submit(_process_file, str(path))] = path
+            if len(pending) >= workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield _future_record(future, pending.pop(future))
+        for future in wait(pending).done:
+            yield _future_record(future, pending[future])
+
+
+def _future_record(future, path: Path) -> Dict[str, Any]:
+    """Запись из результата процесса; сбой процесса становится ошибкой файла"""
+    try:
+        record, metrics = future.result()
+        get_metrics().merge(metrics)
+        return record
+    except Exception as e:
+        logger.error(f"Сбой процесса при обработке {path}: {e}")
+        return {"file": str(path), "timings": {}, "error": f"Сбой процесса: {e}"}
+
+
+def print_progress(path: Path, event: ProgressEvent):
+    """Вывод событий обработки в консоль (--progress)"""
+    if event.kind == "end":
+        print(f"  {path.name}: {event.stage} {event.stage_ms:.0f} мс, CPU {event.data.get('cpu_ms', 0):.0f} мс, "
+              f"пик RSS +{event.data.get('rss_peak_delta_kb', 0) / 1024:.1f} МБ")
+    elif event.kind == "page":
+        print(f"  {path.name}: {event.stage} стр. {event.page}/{event.page_count}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    arg_parser = argparse.ArgumentParser(
+        prog="python -m src.batch",
+        description="Пакетное извлечение информации из накладных в JSONL"
+    )
+    arg_parser.add_argument("source", type=Path, help="Каталог с документами или манифест (путь на строку)")
+    arg_parser.add_argument("--output", "-o", type=Path, default=Path("batch_results.jsonl"),
+                            help="Файл результатов JSONL (дописывается, обработанные файлы пропускаются)")
+    arg_parser.add_argument("--workers", "-w", type=int, default=1, help="Количество процессов с моделями")
+    arg_parser.add_argument("--shard", type=parse_shard, default=(0, 1),
+                            help="Доля корпуса для этого узла в формате i/N (i с нуля)")
+    arg_parser.add_argument("--yolo", action="store_true", help="YOLO + Marker обработка")
+    arg_parser.add_argument("--yolo-backend", default="auto", choices=("auto",) + BACKENDS,
+                            help="Бэкенд инференса YOLO на CPU")
+    arg_parser.add_argument("--yolo-threads", type=int, help="Потоков инференса YOLO")
+    arg_parser.add_argument("--output-format", default="markdown", choices=["markdown", "json", "html"])
+    arg_parser.add_argument("--force-ocr", action="store_true", help="OCR даже для страниц с текстовым слоем")
+    arg_parser.add_argument("--no-cache", action="store_true", help="Не использовать кэш результатов")
+    arg_parser.add_argument("--no-stage-cache", action="store_true",
+                            help="Не использовать архив результатов этапов (OCR, детекция, парсинг)")
+    arg_parser.add_argument("--progress", action="store_true",
+                            help="Печатать этапы обработки каждого файла (только при --workers 1)")
+    arg_parser.add_argument("--trace-memory", action="store_true",
+                            help="Пик памяти Python по этапам через tracemalloc (медленнее)")
+    arg_parser.add_argument("--metrics-file", type=Path,
+                            help="Файл метрик в формате Prometheus (обновляется каждые 10 файлов и в конце)")
+    arg_parser.add_argument("--metrics-port", type=int,
+                            help="Отдавать метрики на http://127.0.0.1:<port>/metrics во время запуска")
+    arg_parser.add_argument("--debug", action="store_true", help="Подробное логирование")
+    args = arg_parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.debug else logging.WARNING,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+
+    if not args.source.exists():
+        print(f"❌ Не найден источник: {args.source}", file=sys.stderr)
+        return 2
+
+    files = [path for path in collect_inputs(args.source) if in_shard(path, args.source, args.shard)]
+    processed = load_processed(args.output)
+    todo = [path for path in files if str(path) not in processed]
+
+    print(f"📂 Файлов в шарде {args.shard[0]}/{args.shard[1]}: {len(files)}, "
+          f"уже обработано: {len(files) - len(todo)}, к обработке: {len(todo)}")
+    if not todo:
+        return 0
+
+    config = Config(output_format=args.output_format, force_ocr=args.force_ocr,
+                    debug_mode=args.debug, trace_memory=args.trace_memory,
+                    yolo_backend=args.yolo_backend, yolo_threads=args.yolo_threads)
+    if args.no_cache:
+        config.result_cache_dir = None
+    if args.no_stage_cache:
+        config.stage_cache_dir = None
+    stage_totals: Dict[str, float] = defaultdict(float)
+    succeeded = failed = cache_hits = 0
+    metrics_server = serve_metrics(args.metrics_port) if args.metrics_port else None
+    start = time.perf_counter()
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, "a", encoding="utf-8") as out:
+        for record in run_batch(todo, config, workers=args.workers, use_yolo=args.yolo,
+                                progress=print_progress if args.progress else None):
+            # Запись сразу сбрасывается на диск: после перезапуска файл будет пропущен
+            out.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            out.flush()
+
+            for stage, sample in record["timings"].items():
+                stage_totals[stage] += sample.get("wall_ms", 0.0) / 1000
+            cache_hits += record.get("cache") == "hit"
+            if record.get("error"):
+                failed += 1
+                print(f"❌ {record['file']}: {record['error']}")
+            else:
+                succeeded += 1
+            done = succeeded + failed
+            if done % 10 == 0 or done == len(todo):
+                print(f"⏳ {done}/{len(todo)}")
+                if args.metrics_file:
+                    write_metrics(args.metrics_file)
+
+    elapsed = time.perf_counter() - start
+    print(f"\n✅ Успешно: {succeeded}, ❌ с ошибкой: {failed}, время: {elapsed:.1f} с, "
+          f"{(succeeded + failed) / elapsed:.2f} док/с, из кэша: {cache_hits}")
+    print("⏱ Суммарное время этапов (по всем процессам):")
+    for stage, seconds in stage_totals.items():
+        print(f"  {stage}: {seconds:.1f} с")
+    if metrics_server is not None:
+        metrics_server.shutdown()
+
+    return 0 if failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,8 +2,10 @@
 """
 Конфигурационные настройки для парсера накладных
 """
-from dataclasses import dataclass
-from typing import Optional
+import json
+import hashlib
+from dataclasses import dataclass, field, fields
+from typing import Optional, Iterable, List, Tuple, Dict
 
 
 @dataclass
@@ -12,26 +14,93 @@ class Config:
     
     # Настройки Marker
     output_format: str = "markdown"  # markdown, json, html
-    force_ocr: bool = True
+    force_ocr: bool = False  # True - OCR для всех страниц, даже с текстовым слоем
     torch_device: str = "cpu"  # cpu, cuda
     
+    # Быстрый путь по текстовому слою PDF (работает, если force_ocr выключен)
+    use_text_layer: bool = True
+    text_layer_min_chars: int = 100
+    text_layer_min_valid_ratio: float = 0.95
+    text_layer_min_label_hits: int = 1
+    
+    # Количество страниц в одном прогоне YOLO
+    yolo_batch_size: int = 4
+    
+    # Бэкенд инференса YOLO на CPU: auto, openvino, onnx, torchscript, pytorch
+    # (экспорт: python benchmarks/detector_backends.py export); потоков инференса (None - по умолчанию)
+    yolo_backend: str = "auto"
+    yolo_threads: Optional[int] = None
+    
+    # Растеризация PDF: пикселей на пункт для регионов полей под OCR. Регионы рендерятся
+    # из PDF по отдельности; при dual_resolution страница для YOLO рендерится сразу
+    # в размере входа модели, иначе - целиком в render_scale
+    render_scale: float = 2.0
+    dual_resolution: bool = True
+    
+    # Масштаб рендера регионов по типу поля (остальные - render_scale): плотные таблицы
+    # груза и цен - крупнее, короткие даты - мельче
+    field_render_scales: Dict[str, float] = field(default_factory=lambda: {
+        "payload": 3.0,
+        "price": 3.0,
+        "delivery-date": 1.5,
+        "order-date": 1.5,
+    })
+    
+    # Шаблоны форм фиксированной разметки (None - выключены): при уверенном совмещении
+    # страницы с шаблоном боксы полей берутся из шаблона без YOLO (python -m src.templates build)
+    templates_dir: Optional[str] = "templates"
+    template_min_confidence: float = 0.3
+    
+    # Пакетное распознавание регионов полей (None - размер пакета по умолчанию)
+    region_ocr_batch_size: Optional[int] = None
+    
     # Настройки парсинга текста
     max_lines_section: int = 8
+    label_search_window: int = 1500  # Символов после метки для поиска компании, ИНН/КПП и адреса
     confidence_threshold: float = 0.7
     
+    # Кэш результатов по содержимому файла (None - выключен); каталог на томе ./temp
+    result_cache_dir: Optional[str] = "temp/result_cache"
+    result_cache_max_mb: int = 1024
+    
+    # Архив результатов этапов (None - выключен): после правки паттернов пересчитывается только парсинг
+    stage_cache_dir: Optional[str] = "temp/stage_cache"
+    stage_cache_stages: Tuple[str, ...] = ("detect", "ocr", "region_ocr", "parse")
+    
     # Отладка
     debug_mode: bool = False
+    save_debug_artifacts: bool = False  # Сохранять растры страниц и аннотации на диск
+    trace_memory: bool = False  # Пик памяти Python по этапам через tracemalloc (замедляет обработку)
     
     # Регулярные выражения для поиска
     money_pattern: str = r"([0-9][0-9\s.,]*)"
     date_pattern: str = r"([0-3]?\d[.\-/][01]?\d[.\-/]\d{2,4})"
     inn_pattern: str = r"ИНН[:\s]*([0-9]{10,12})"
     kpp_pattern: str = r"КПП[:\s]*([0-9]{9})"
+    # Метки ИНН/КПП: паттерн проверяется только в строках с меткой (если метка входит
+    # в паттерн; иначе - во всех строках окна) и КПП ищется после метки ИНН
+    inn_label: str = r"ИНН"
+    kpp_label: str = r"КПП"
+    
+    # Метки, наличие которых подтверждает корректность текстового слоя
+    text_layer_labels = [
+        "Грузоотправитель", "Грузополучатель", "Поставщик", "Покупатель",
+        "Накладная", "ИНН", "Перевозчик"
+    ]
     
     # Лейблы для поиска секций
     supplier_labels = [r"Поставщик", r"Продавец", r"Грузоотправитель"]
     buyer_labels = [r"Покупатель", r"Плательщик", r"Грузополучатель"]
     
+    # Лейблы для поиска компаний сторон и логистики
+    supplier_company_labels = [r"Грузоотправитель", r"Поставщик"]
+    buyer_company_labels = [r"Грузополучатель", r"Покупатель"]
+    shipper_labels = [r"Грузоотправитель"]
+    consignee_labels = [r"Грузополучатель"]
+    
+    # Служебные метки, позиции которых индексируются вместе с метками сторон
+    service_labels = [r"ИНН", r"КПП", r"НДС", r"Итого", r"Всего"]
+    
     # Паттерны для поиска номера документа
     number_patterns = [
         r"(?:Товарная\s+накладная|Накладная|ТН)[^\n]{0,50}?(?:№|N|No)\s*([A-Za-zА-Яа-я0-9/\-]+)",
@@ -56,3 +125,35 @@ class Config:
     total_without_vat_patterns = [
         r"(?:Сумма\s*без\s*НДС|Итого\s*без\s*НДС|Итого\s*(?:без\s*НДС)?)\s*[:\-]?\s*([0-9][0-9\s.,]*)"
     ]
+    
+    # Паттерны для поиска адреса и времени доставки
+    # (каждый паттерн адреса начинается с одной из меток delivery_address_labels)
+    delivery_address_labels = [r"адрес\s*места\s*доставки\s*груза"]
+    delivery_address_patterns = [
+        r"адрес\s*места\s*доставки\s*груза[^|]*?\|[^|]*?\|[^|]*?([^|]+)"
+    ]
+    
+    delivery_time_patterns = [
+        r"Дата\s*доставки:\s*([0-3]?\d[.\-/][01]?\d[.\-/]\d{2,4}),?\s*с\s*(\d{1,2}:\d{2})\s*до\s*(\d{1,2}:\d{2})",
+        r"(?:Дата\s*)?доставки:\s*([0-3]?\d[.\-/][01]?\d[.\-/]\d{2,4})"
+    ]
+    
+    def fingerprint(self, names: Optional[Iterable[str]] = None) -> str:
+        """
+        Отпечаток конфигурации для кэширования производных объектов
+        
+        Args:
+            names: Имена учитываемых настроек (по умолчанию все поля и паттерны)
+        """
+        if names is None:
+            names = self.fingerprint_fields()
+        values = {name: getattr(self, name) for name in sorted(names)}
+        payload = json.dumps(values, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+    
+    def fingerprint_fields(self) -> List[str]:
+        """Имена всех настроек: поля dataclass и списки паттернов/меток"""
+        return [f.name for f in fields(self)] + [
+            name for name, value in vars(type(self)).items()
+            if not name.startswith("_") and isinstance(value, list)
+        ]
@@ -0,0 +1,174 @@
+"""
+Индекс документа для парсера: строки, смещения, позиции меток и ячейки таблиц
+"""
+import re
+import bisect
+import logging
+from typing import Dict, List, Optional, Iterable, Tuple, Union, Match, Pattern
+
+from .patterns import PatternBank
+
+logger = logging.getLogger(__name__)
+
+# Разделители строк, которые учитывает str.splitlines()
+_LINE_BREAK_RE = re.compile(r"\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]")
+
+
+class TextView:
+    """
+    Текст с границами строк и позициями меток
+
+    Все известные метки (PatternBank.index_labels) находятся одним проходом
+    по тексту. Метки вне этого списка ищутся при первом запросе и кэшируются.
+    """
+
+    def __init__(self, text: str, patterns: PatternBank):
+        self.text = text
+        self.patterns = patterns
+        self.lines = text.splitlines()
+        self.line_starts = [0] + [match.end() for match in _LINE_BREAK_RE.finditer(text)]
+
+        self._positions: Dict[str, List[int]] = {label: [] for label in patterns.index_labels}
+        for match in patterns.label_scanner.finditer(text):
+            for group, value in match.groupdict().items():
+                if value is not None:
+                    self._positions[patterns.scanner_groups[group]].append(match.start())
+        self._label_lines: Dict[str, List[int]] = {}
+
+    def positions(self, label: str) -> List[int]:
+        """Смещения вхождений метки в тексте (по возрастанию)"""
+        positions = self._positions.get(label)
+        if positions is None:
+            positions = self._positions[label] = [
+                match.start() for match in self.patterns.label(label).finditer(self.text)
+            ]
+        return positions
+
+    def line_of(self, offset: int) -> int:
+        """Номер строки, содержащей смещение"""
+        return bisect.bisect_right(self.line_starts, offset) - 1
+
+    def label_lines(self, label: str) -> List[int]:
+        """Номера строк с меткой (по возрастанию, без повторов)"""
+        lines = self._label_lines.get(label)
+        if lines is None:
+            lines = self._label_lines[label] = sorted({self.line_of(pos) for pos in self.positions(label)})
+        return lines
+
+    def lines_with(self, labels: Iterable[str]) -> List[int]:
+        """Номера строк, содержащих хотя бы одну из меток"""
+        return sorted({i for label in labels for i in self.label_lines(label)})
+
+    def first_line(self, labels: Iterable[str]) -> Optional[int]:
+        """Первая строка с любой из меток"""
+        lines = [self.label_lines(label) for label in labels]
+        firsts = [label_lines[0] for label_lines in lines if label_lines]
+        return min(firsts) if firsts else None
+
+    def lines_between(self, label: str, start: int, end: int) -> List[int]:
+        """Строки с меткой в диапазоне [start, end)"""
+        lines = self.label_lines(label)
+        return lines[bisect.bisect_left(lines, start):bisect.bisect_left(lines, end)]
+
+    def search_lines(self, pattern: Pattern, label: Optional[str], start: int = 0,
+                     end: Optional[int] = None) -> Optional[Match]:
+        """Первое совпадение паттерна в строках [start, end), содержащих метку (None - во всех строках)"""
+        end = len(self.lines) if end is None else end
+        lines = self.lines_between(label, start, end) if label else range(start, min(end, len(self.lines)))
+        for i in lines:
+            match = pattern.search(self.lines[i])
+            if match:
+                return match
+        return None
+
+    def match_at_labels(self, pattern: Pattern, labels: Union[str, List[str]],
+                        window: Optional[int] = None) -> Optional[Match]:
+        """
+        Первое совпадение паттерна, начинающегося с метки
+
+        Равносильно pattern.search(text), но паттерн пробуется только
+        в позициях метки. С window поиск ограничен окном в window символов
+        после метки (до конца строки), поэтому ленивые DOTALL-паттерны
+        не проходят весь остаток документа, если хвост паттерна отсутствует.
+        """
+        if isinstance(labels, str):
+            positions = self.positions(labels)
+        else:
+            positions = sorted({pos for label in labels for pos in self.positions(label)})
+
+        for pos in positions:
+            endpos = self.window_end(pos, window) if window else len(self.text)
+            match = pattern.match(self.text, pos, endpos)
+            if match:
+                return match
+        return None
+
+    def window_end(self, pos: int, window: int) -> int:
+        """Конец окна поиска: pos + window, продленный до конца строки"""
+        end = pos + window
+        if end >= len(self.text):
+            return len(self.text)
+        next_line = self.line_of(end) + 1
+        return self.line_starts[next_line] if next_line < len(self.line_starts) else len(self.text)
+
+
+class DocumentIndex:
+    """
+    Индекс документа, общий для всех извлекателей InvoiceParser
+
+    Строится один раз на документ и содержит два представления текста:
+    нормализованный текст (поиск реквизитов и сумм) и очищенные от краевых
+    пробелов строки (секции сторон и логистика), а также текст в нижнем
+    регистре и границы ячеек markdown-таблиц.
+    """
+
+    def __init__(self, text: str, normalized_text: str, patterns: PatternBank):
+        """
+        Args:
+            text: Исходный текст документа
+            normalized_text: Текст после TextProcessor.normalize_text
+            patterns: Банк паттернов конфигурации
+        """
+        self.text_view = TextView(normalized_text, patterns)
+        self.folded = normalized_text.casefold()
+
+        stripped_lines = []
+        self.table_cells: Dict[int, List[Tuple[int, int]]] = {}
+        for i, line in enumerate(text.splitlines()):
+            line = line.strip()
+            stripped_lines.append(line)
+            if "|" in line:
+                self.table_cells[i] = self._cell_bounds(line)
+        self.line_view = TextView("\n".join(stripped_lines), patterns)
+
+        logger.debug(f"Индекс документа: {len(stripped_lines)} строк, {len(self.table_cells)} строк таблиц")
+
+    @property
+    def text(self) -> str:
+        """Нормализованный текст документа"""
+        return self.text_view.text
+
+    @property
+    def lines(self) -> List[str]:
+        """Строки документа без краевых пробелов"""
+        return self.line_view.lines
+
+    @property
+    def joined(self) -> str:
+        """Строки документа, склеенные через перевод строки"""
+        return self.line_view.text
+
+    def cells(self, line_index: int) -> List[str]:
+        """Ячейки строки markdown-таблицы (пустой список для обычной строки)"""
+        line = self.lines[line_index]
+        return [line[start:end].strip() for start, end in self.table_cells.get(line_index, [])]
+
+    @staticmethod
+    def _cell_bounds(line: str) -> List[Tuple[int, int]]:
+        """Границы ячеек между разделителями '|'"""
+        pipes = [i for i, ch in enumerate(line) if ch == "|"]
+        if not line.startswith("|"):
+            pipes.insert(0, -1)
+        if not line.endswith("|"):
+            pipes.append(len(line))
+        return [(start + 1, end) for start, end in zip(pipes, pipes[1:])]
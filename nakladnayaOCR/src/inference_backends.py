@@ -0,0 +1,547 @@
+"""
+Бэкенды инференса детектора полей на CPU: PyTorch (Ultralytics), ONNX Runtime
+(FP32 и INT8), OpenVINO, TorchScript
+
+Экспортированная модель получает страницы после letterbox и возвращает сырой
+выход головы YOLO; letterbox, NMS и перевод боксов в координаты страницы
+выполняются здесь так же, как в Ultralytics, поэтому набор полей совпадает
+с PyTorch-бэкендом. Экспорт записывает рядом с весами манифест
+<имя>.backends.json: пути артефактов, размер входа, классы и отпечаток весов,
+из которых они получены (артефакты устаревших весов не загружаются).
+"""
+import os
+import json
+import time
+import logging
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+try:
+    from ultralytics import YOLO
+    ULTRALYTICS_AVAILABLE = True
+except ImportError:
+    ULTRALYTICS_AVAILABLE = False
+
+try:
+    import onnxruntime
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ONNXRUNTIME_AVAILABLE = False
+
+try:
+    import openvino
+    OPENVINO_AVAILABLE = True
+except ImportError:
+    OPENVINO_AVAILABLE = False
+
+try:
+    import torch
+    TORCH_AVAILABLE = True
+except ImportError:
+    TORCH_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Порядок выбора при backend="auto": самые быстрые на CPU первыми
+BACKENDS = ("openvino", "onnx_int8", "onnx", "torchscript", "pytorch")
+
+# Форматы экспорта Ultralytics (имена совпадают с именами бэкендов)
+EXPORT_FORMATS = ("onnx", "openvino", "torchscript")
+
+# Артефакт, указанный напрямую (без манифеста)
+ARTIFACT_SUFFIXES = {".onnx": "onnx", ".xml": "openvino", ".torchscript": "torchscript"}
+
+RUNTIME_AVAILABLE = {
+    "pytorch": ULTRALYTICS_AVAILABLE,
+    "onnx": ONNXRUNTIME_AVAILABLE,
+    "onnx_int8": ONNXRUNTIME_AVAILABLE,
+    "openvino": OPENVINO_AVAILABLE,
+    "torchscript": TORCH_AVAILABLE,
+}
+
+# Параметры предобработки и NMS как в Ultralytics
+DEFAULT_IMGSZ = 640
+LETTERBOX_COLOR = (114, 114, 114)
+MAX_DETECTIONS = 300
+MAX_NMS_CANDIDATES = 30000
+CLASS_OFFSET = 7680  # сдвиг боксов разных классов для NMS по классам
+STRIDE = 32
+
+
+def manifest_path(model_path: Union[str, Path]) -> Path:
+    """Манифест экспортированных артефактов рядом с весами"""
+    return Path(model_path).with_suffix(".backends.json")
+
+
+def weights_id(path: Union[str, Path]) -> str:
+    """Отпечаток файла весов (как yolo_weights в model_versions)"""
+    path = Path(path)
+    stat = path.stat()
+    return f"{path.name}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def read_manifest(model_path: Union[str, Path]) -> Dict[str, Any]:
+    path = manifest_path(model_path)
+    if not path.exists():
+        return {}
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError) as e:
+        logger.warning(f"Не удалось прочитать манифест {path}: {e}")
+        return {}
+
+
+def register_artifact(weights: Union[str, Path], name: str, artifact: Union[str, Path]) -> Path:
+    """Добавление артефакта бэкенда name в манифест весов"""
+    path = manifest_path(weights)
+    manifest = read_manifest(weights)
+    if not manifest:
+        raise RuntimeError(f"Манифест {path} не найден, сначала выполните экспорт")
+    manifest.setdefault("artifacts", {})[name] = os.path.relpath(artifact, path.parent)
+    path.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    return path
+
+
+def letterbox(image: np.ndarray, imgsz: int,
+              stride: Optional[int] = None) -> Tuple[np.ndarray, float, Tuple[int, int]]:
+    """
+    Вписывание страницы в квадрат imgsz с сохранением пропорций (LetterBox Ultralytics)
+
+    Args:
+        stride: Прямоугольный вход: поля только до кратности stride
+            (как у Ultralytics для моделей с динамическим размером входа)
+
+    Returns:
+        Изображение, масштаб и отступы слева и сверху
+    """
+    height, width = image.shape[:2]
+    gain = min(imgsz / height, imgsz / width)
+    new_width, new_height = int(round(width * gain)), int(round(height * gain))
+    if (new_width, new_height) != (width, height):
+        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+
+    pad_x, pad_y = imgsz - new_width, imgsz - new_height
+    if stride:
+        pad_x, pad_y = pad_x % stride, pad_y % stride
+    pad_x, pad_y = pad_x / 2, pad_y / 2
+    top, bottom = int(round(pad_y - 0.1)), int(round(pad_y + 0.1))
+    left, right = int(round(pad_x - 0.1)), int(round(pad_x + 0.1))
+    image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=LETTERBOX_COLOR)
+    return image, gain, (left, top)
+
+
+def to_blob(images: List[np.ndarray]) -> np.ndarray:
+    """BGR HWC uint8 -> RGB NCHW float32 в [0, 1]"""
+    batch = np.stack([image[..., ::-1].transpose(2, 0, 1) for image in images])
+    return np.ascontiguousarray(batch, dtype=np.float32) / 255.0
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """Жадный NMS: индексы сохраненных боксов по убыванию уверенности"""
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1) * (y2 - y1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size:
+        best, rest = order[0], order[1:]
+        keep.append(best)
+        width = np.clip(np.minimum(x2[best], x2[rest]) - np.maximum(x1[best], x1[rest]), 0, None)
+        height = np.clip(np.minimum(y2[best], y2[rest]) - np.maximum(y1[best], y1[rest]), 0, None)
+        overlap = width * height
+        iou = overlap / (areas[best] + areas[rest] - overlap + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+def postprocess(prediction: np.ndarray, num_classes: int, conf: float, iou: float,
+                max_det: int = MAX_DETECTIONS) -> List[np.ndarray]:
+    """
+    Выход головы YOLO -> боксы [x1, y1, x2, y2, conf, class] во входных координатах
+
+    Поддерживаются сырой выход (batch, 4 + классы, якоря) с NMS по классам,
+    как в ultralytics non_max_suppression, и выход моделей со встроенным
+    NMS (batch, боксы, 6).
+    """
+    results = []
+    for page in prediction:
+        if page.shape[0] != 4 + num_classes and page.shape[-1] == 6:
+            results.append(page[page[:, 4] > conf][:max_det].astype(np.float32))
+            continue
+
+        page = page.T
+        class_scores = page[:, 4:]
+        class_ids = class_scores.argmax(1)
+        confidences = class_scores[np.arange(len(page)), class_ids]
+        candidates = confidences > conf
+        centers, confidences, class_ids = page[candidates, :4], confidences[candidates], class_ids[candidates]
+        if len(confidences) > MAX_NMS_CANDIDATES:
+            top = confidences.argsort()[::-1][:MAX_NMS_CANDIDATES]
+            centers, confidences, class_ids = centers[top], confidences[top], class_ids[top]
+
+        boxes = np.empty_like(centers)
+        boxes[:, :2] = centers[:, :2] - centers[:, 2:] / 2
+        boxes[:, 2:] = centers[:, :2] + centers[:, 2:] / 2
+        keep = nms(boxes + class_ids[:, None] * CLASS_OFFSET, confidences, iou)[:max_det]
+        results.append(np.concatenate(
+            [boxes[keep], confidences[keep, None], class_ids[keep, None]], axis=1
+        ).astype(np.float32))
+    return results
+
+
+def scale_boxes(detections: np.ndarray, gain: float, pad: Tuple[int, int], shape: Tuple[int, int]) -> np.ndarray:
+    """Боксы из координат входа модели в координаты страницы (scale_boxes Ultralytics)"""
+    detections = detections.copy()
+    detections[:, [0, 2]] = ((detections[:, [0, 2]] - pad[0]) / gain).clip(0, shape[1])
+    detections[:, [1, 3]] = ((detections[:, [1, 3]] - pad[1]) / gain).clip(0, shape[0])
+    return detections
+
+
+class DetectorBackend:
+    """Пакет BGR-страниц -> боксы [x1, y1, x2, y2, conf, class] в координатах страниц"""
+
+    name = ""
+
+    def __init__(self, artifact: Path):
+        self.artifact = Path(artifact)
+
+    @property
+    def runtime_version(self) -> str:
+        return ""
+
+    @property
+    def input_size(self) -> int:
+        """Длинная сторона входа модели после letterbox"""
+        return DEFAULT_IMGSZ
+
+    @property
+    def identity(self) -> str:
+        """Бэкенд, версия среды и артефакт (для ключей кэша)"""
+        return f"{self.name}:{self.runtime_version}:{weights_id(self.artifact)}"
+
+    def predict(self, images: List[np.ndarray], conf: float, iou: float) -> List[np.ndarray]:
+        raise NotImplementedError
+
+
+class UltralyticsBackend(DetectorBackend):
+    """PyTorch eager через Ultralytics (исходное поведение детектора)"""
+
+    name = "pytorch"
+
+    def __init__(self, artifact: Path, threads: Optional[int] = None):
+        super().__init__(artifact)
+        if threads and TORCH_AVAILABLE:
+            torch.set_num_threads(threads)
+        self.model = YOLO(str(artifact))
+
+    @property
+    def runtime_version(self) -> str:
+        import ultralytics
+        return ultralytics.__version__
+
+    @property
+    def input_size(self) -> int:
+        # Ultralytics предсказывает в размере обучения, сохраненном в весах
+        imgsz = self.model.overrides.get("imgsz", DEFAULT_IMGSZ)
+        return int(max(imgsz) if isinstance(imgsz, (list, tuple)) else imgsz)
+
+    def predict(self, images: List[np.ndarray], conf: float, iou: float) -> List[np.ndarray]:
+        results = self.model(images, conf=conf, iou=iou, batch=len(images), verbose=False)
+        return [
+            result.boxes.data.cpu().numpy() if result.boxes is not None else np.zeros((0, 6), np.float32)
+            for result in results
+        ]
+
+
+class ExportedBackend(DetectorBackend):
+    """Экспортированная модель: letterbox, прогон и NMS выполняются здесь"""
+
+    def __init__(self, artifact: Path, imgsz: int, num_classes: int, threads: Optional[int] = None):
+        super().__init__(artifact)
+        self.imgsz = imgsz
+        self.num_classes = num_classes
+        self.threads = threads
+        self.fixed_batch: Optional[int] = None  # статический размер пакета модели
+        self.dynamic_shape = False  # модель принимает вход любого размера
+
+    @property
+    def input_size(self) -> int:
+        return self.imgsz
+
+    def predict(self, images: List[np.ndarray], conf: float, iou: float) -> List[np.ndarray]:
+        # Прямоугольный вход (меньше полей) - если модель динамическая и страницы одного размера
+        same_shapes = len({image.shape for image in images}) == 1
+        stride = STRIDE if self.dynamic_shape and same_shapes else None
+        boxed = [letterbox(image, self.imgsz, stride) for image in images]
+        blob = to_blob([image for image, _, _ in boxed])
+        if self.fixed_batch == 1:
+            prediction = np.concatenate([self._forward(blob[i:i + 1]) for i in range(len(blob))])
+        else:
+            prediction = self._forward(blob)
+
+        return [
+            scale_boxes(detections, gain, pad, image.shape[:2])
+            for detections, image, (_, gain, pad)
+            in zip(postprocess(prediction, self.num_classes, conf, iou), images, boxed)
+        ]
+
+    def _forward(self, blob: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+
+class OnnxBackend(ExportedBackend):
+    """ONNX Runtime (CPUExecutionProvider)"""
+
+    name = "onnx"
+
+    def __init__(self, artifact: Path, imgsz: int, num_classes: int, threads: Optional[int] = None):
+        super().__init__(artifact, imgsz, num_classes, threads)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(str(artifact), options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.fixed_batch = model_input.shape[0] if isinstance(model_input.shape[0], int) else None
+        self.dynamic_shape = not all(isinstance(size, int) for size in model_input.shape[2:])
+
+    @property
+    def runtime_version(self) -> str:
+        return onnxruntime.__version__
+
+    def _forward(self, blob: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: blob})[0]
+
+
+class OnnxInt8Backend(OnnxBackend):
+    """Квантованная INT8-модель ONNX (src/quantization.py)"""
+
+    name = "onnx_int8"
+
+
+class OpenVinoBackend(ExportedBackend):
+    """OpenVINO Runtime на CPU"""
+
+    name = "openvino"
+
+    def __init__(self, artifact: Path, imgsz: int, num_classes: int, threads: Optional[int] = None):
+        super().__init__(artifact, imgsz, num_classes, threads)
+        core = openvino.Core()
+        model = core.read_model(str(artifact))
+        properties = {"PERFORMANCE_HINT": "LATENCY"}
+        if threads:
+            properties["INFERENCE_NUM_THREADS"] = threads
+        self.compiled = core.compile_model(model, "CPU", properties)
+        shape = model.input(0).get_partial_shape()
+        self.fixed_batch = shape[0].get_length() if shape[0].is_static else None
+        self.dynamic_shape = not (shape[2].is_static and shape[3].is_static)
+
+    @property
+    def runtime_version(self) -> str:
+        return openvino.__version__
+
+    def _forward(self, blob: np.ndarray) -> np.ndarray:
+        return self.compiled(blob)[self.compiled.output(0)]
+
+
+class TorchScriptBackend(ExportedBackend):
+    """TorchScript (torch.jit) без Ultralytics"""
+
+    name = "torchscript"
+
+    def __init__(self, artifact: Path, imgsz: int, num_classes: int, threads: Optional[int] = None):
+        super().__init__(artifact, imgsz, num_classes, threads)
+        if threads:
+            torch.set_num_threads(threads)
+        self.model = torch.jit.load(str(artifact), map_location="cpu").eval()
+        # Ultralytics трассирует модель с пакетом из одной страницы; динамический ли вход
+        # (экспорт с dynamic=True), известно только из манифеста
+        self.fixed_batch = 1
+
+    @property
+    def runtime_version(self) -> str:
+        return torch.__version__
+
+    def _forward(self, blob: np.ndarray) -> np.ndarray:
+        with torch.inference_mode():
+            output = self.model(torch.from_numpy(blob))
+        return (output[0] if isinstance(output, (list, tuple)) else output).numpy()
+
+
+EXPORTED_BACKENDS = {
+    "onnx": OnnxBackend,
+    "onnx_int8": OnnxInt8Backend,
+    "openvino": OpenVinoBackend,
+    "torchscript": TorchScriptBackend,
+}
+
+
+def _open_backend(name: str, model_path: Path, manifest: Dict[str, Any],
+                  threads: Optional[int]) -> Optional[DetectorBackend]:
+    """Бэкенд name или None, если нет артефакта или среды выполнения"""
+    if not RUNTIME_AVAILABLE.get(name):
+        return None
+
+    if name == "pytorch":
+        return UltralyticsBackend(model_path, threads) if model_path.suffix == ".pt" and model_path.exists() else None
+
+    if not manifest:
+        if ARTIFACT_SUFFIXES.get(model_path.suffix) != name or not model_path.exists():
+            return None
+        return EXPORTED_BACKENDS[name](model_path, DEFAULT_IMGSZ, 0, threads)
+
+    relative = manifest.get("artifacts", {}).get(name)
+    if not relative:
+        return None
+    artifact = manifest_path(model_path).parent / relative
+    if not artifact.exists():
+        return None
+
+    # Веса переобучены после экспорта: артефакт не соответствует модели
+    source = model_path.with_suffix(".pt")
+    if source.exists() and manifest.get("source_id") != weights_id(source):
+        logger.warning(f"Артефакт {artifact} устарел относительно {source}, повторите экспорт")
+        return None
+
+    backend = EXPORTED_BACKENDS[name](
+        artifact, int(manifest.get("imgsz", DEFAULT_IMGSZ)), len(manifest.get("names", {})), threads
+    )
+    if name == "torchscript":
+        backend.dynamic_shape = name in manifest.get("dynamic", [])
+    return backend
+
+
+def load_backend(model_path: Union[str, Path], backend: str = "auto",
+                 threads: Optional[int] = None) -> Optional[DetectorBackend]:
+    """
+    Загрузка детектора в первом доступном бэкенде
+
+    Args:
+        model_path: Веса .pt или путь с тем же именем, рядом с которым лежит манифест
+        backend: "auto" (порядок BACKENDS) или имя бэкенда; если указанный
+            недоступен, выбирается следующий по порядку BACKENDS. В режиме auto
+            артефакты со статическим квадратным входом выбираются последними:
+            их letterbox отличается от Ultralytics, и поля могут не совпасть с PyTorch
+        threads: Потоков инференса (None - по умолчанию среды)
+    """
+    model_path = Path(model_path)
+    manifest = read_manifest(model_path)
+    order = BACKENDS if backend == "auto" else (backend,) + tuple(name for name in BACKENDS if name != backend)
+    static = None
+
+    for name in order:
+        try:
+            loaded = _open_backend(name, model_path, manifest, threads)
+        except Exception as e:
+            logger.warning(f"Бэкенд {name} не загружен: {e}")
+            continue
+        if loaded is None:
+            continue
+        if backend == "auto" and isinstance(loaded, ExportedBackend) and not loaded.dynamic_shape:
+            logger.warning(f"Бэкенд {name}: статический вход {loaded.imgsz}x{loaded.imgsz}, "
+                           f"повторите экспорт (python benchmarks/detector_backends.py export)")
+            static = static or loaded
+            continue
+        if backend not in ("auto", name):
+            logger.warning(f"Бэкенд {backend} недоступен, используется {name}")
+        return loaded
+    return static
+
+
+def export_model(weights: Union[str, Path], formats: Tuple[str, ...] = EXPORT_FORMATS,
+                 imgsz: int = DEFAULT_IMGSZ) -> Path:
+    """
+    Экспорт весов Ultralytics в CPU-форматы и запись манифеста
+
+    Все форматы экспортируются с динамическим размером входа: прямоугольный
+    letterbox совпадает с Ultralytics, и боксы совпадают с PyTorch. TorchScript
+    трассируется с пакетом из одной страницы (страницы прогоняются по одной).
+
+    Returns:
+        Путь к манифесту
+    """
+    if not ULTRALYTICS_AVAILABLE:
+        raise RuntimeError("Для экспорта нужен ultralytics")
+
+    weights = Path(weights)
+    manifest = read_manifest(weights)
+    same_source = manifest.get("source_id") == weights_id(weights)
+    artifacts = dict(manifest.get("artifacts", {})) if same_source else {}
+    dynamic = set(manifest.get("dynamic", [])) & set(artifacts)
+    names = {}
+    for export_format in formats:
+        start = time.perf_counter()
+        # Новый объект на каждый формат: экспорт меняет модель (fuse)
+        model = YOLO(str(weights))
+        names = model.names
+        options = {"dynamic": True, "simplify": True} if export_format == "onnx" else {"dynamic": True}
+        exported = Path(model.export(format=export_format, imgsz=imgsz, device="cpu", **options))
+        if exported.is_dir():
+            exported = next(exported.glob("*.xml"))
+        artifacts[export_format] = os.path.relpath(exported, weights.parent)
+        dynamic.add(export_format)
+        logger.info(f"Экспорт {export_format}: {exported} ({time.perf_counter() - start:.1f} с)")
+
+    path = manifest_path(weights)
+    path.write_text(json.dumps({
+        "source": weights.name,
+        "source_id": weights_id(weights),
+        "imgsz": imgsz,
+        "names": {str(class_id): name for class_id, name in names.items()},
+        "artifacts": artifacts,
+        "dynamic": sorted(dynamic),
+    }, ensure_ascii=False, indent=2), encoding="utf-8")
+    return path
+
+
+def box_iou(box: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """IoU бокса [x1, y1, x2, y2] с набором боксов"""
+    width = np.clip(np.minimum(box[2], boxes[:, 2]) - np.maximum(box[0], boxes[:, 0]), 0, None)
+    height = np.clip(np.minimum(box[3], boxes[:, 3]) - np.maximum(box[1], boxes[:, 1]), 0, None)
+    overlap = width * height
+    areas = (box[2] - box[0]) * (box[3] - box[1]) + (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return overlap / (areas - overlap + 1e-9)
+
+
+def compare_detections(reference: List[np.ndarray], candidate: List[np.ndarray],
+                       match_iou: float = 0.5) -> Dict[int, Dict[str, Any]]:
+    """
+    Сопоставление боксов двух моделей по классам (жадно по убыванию уверенности)
+
+    Args:
+        reference: Боксы эталонной модели по страницам
+        candidate: Боксы проверяемой модели по тем же страницам
+        match_iou: Минимальный IoU для сопоставления
+
+    Returns:
+        {класс: matched, missed (есть только в эталоне), extra (только в
+        проверяемой), mean_iou, min_iou, max_conf_drift}
+    """
+    stats: Dict[int, Dict[str, Any]] = {}
+    for expected, actual in zip(reference, candidate):
+        for class_id in map(int, np.union1d(expected[:, 5], actual[:, 5])):
+            entry = stats.setdefault(class_id, {"matched": 0, "missed": 0, "extra": 0, "ious": [], "drifts": []})
+            wanted = expected[expected[:, 5] == class_id]
+            found = actual[actual[:, 5] == class_id]
+            free = np.ones(len(found), dtype=bool)
+            for box in wanted[wanted[:, 4].argsort()[::-1]]:
+                ious = np.where(free, box_iou(box, found[:, :4]), 0.0) if len(found) else np.zeros(0)
+                if len(ious) and ious.max() >= match_iou:
+                    best = int(ious.argmax())
+                    free[best] = False
+                    entry["matched"] += 1
+                    entry["ious"].append(float(ious[best]))
+                    entry["drifts"].append(abs(float(found[best, 4] - box[4])))
+                else:
+                    entry["missed"] += 1
+            entry["extra"] += int(free.sum())
+
+    for entry in stats.values():
+        ious, drifts = entry.pop("ious"), entry.pop("drifts")
+        entry["mean_iou"] = float(np.mean(ious)) if ious else None
+        entry["min_iou"] = float(np.min(ious)) if ious else None
+        entry["max_conf_drift"] = float(np.max(drifts)) if drifts else None
+    return stats
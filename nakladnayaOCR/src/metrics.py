@@ -0,0 +1,335 @@
+"""
+Метрики обработки в текстовом формате Prometheus без внешних зависимостей
+
+Метрики процесса собираются в общий реестр (get_metrics) и отдаются:
+    - HTTP-сервисом на GET /metrics;
+    - локальным HTTP-сервером serve_metrics(port) (python -m src.batch --metrics-port);
+    - файлом write_metrics(path) для пакетных запусков (--metrics-file), формат
+      подходит для textfile-коллектора node_exporter.
+"""
+import os
+import math
+import logging
+import tempfile
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple, Callable, List
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограмм длительности, секунд: от быстрых этапов парсинга до OCR многостраничных документов
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metric:
+    """Метрика с набором меток; значения хранятся по кортежу значений меток"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values: Dict[LabelValues, Any] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.labels}, получено {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _label_text(self, key: LabelValues, extra: Optional[Dict[str, str]] = None) -> str:
+        pairs = list(zip(self.labels, key)) + list((extra or {}).items())
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key: LabelValues, value: Any) -> List[str]:
+        return [f"{self.name}{self._label_text(key)} {_format_value(value)}"]
+
+    def snapshot(self, reset: bool = False) -> Dict[LabelValues, Any]:
+        with self._lock:
+            values = {key: self._copy(value) for key, value in self._values.items()}
+            if reset:
+                self._values.clear()
+        return values
+
+    def merge(self, values: Dict[LabelValues, Any]):
+        with self._lock:
+            for key, value in values.items():
+                self._merge_value(key, value)
+
+    @staticmethod
+    def _copy(value: Any) -> Any:
+        return value
+
+    def _merge_value(self, key: LabelValues, value: Any):
+        self._values[key] = self._values.get(key, 0.0) + value
+
+
+class Counter(Metric):
+    """Монотонный счетчик"""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    """Текущее значение; может вычисляться функцией при каждом чтении"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._functions: Dict[LabelValues, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function: Callable[[], float], **labels):
+        """Значение вычисляется при выдаче метрик (глубина очереди, задачи в работе)"""
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = function
+
+    def render(self) -> List[str]:
+        with self._lock:
+            functions = dict(self._functions)
+        for key, function in functions.items():
+            try:
+                value = function()
+            except Exception as e:
+                logger.warning(f"Ошибка вычисления метрики {self.name}: {e}")
+                continue
+            with self._lock:
+                self._values[key] = value
+        return super().render()
+
+    def snapshot(self, reset: bool = False) -> Dict[LabelValues, Any]:
+        # Текущее значение не сбрасывается: его передает последний процесс
+        return super().snapshot(reset=False)
+
+    def _merge_value(self, key: LabelValues, value: Any):
+        self._values[key] = value
+
+
+class Histogram(Metric):
+    """Гистограмма: количество наблюдений по корзинам, сумма и число"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["buckets"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def _render_value(self, key: LabelValues, state: Dict[str, Any]) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state["buckets"]):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{self._label_text(key, {'le': _format_value(bound)})} {cumulative}")
+        lines.append(f"{self.name}_bucket{self._label_text(key, {'le': '+Inf'})} {state['count']}")
+        lines.append(f"{self.name}_sum{self._label_text(key)} {_format_value(state['sum'])}")
+        lines.append(f"{self.name}_count{self._label_text(key)} {state['count']}")
+        return lines
+
+    @staticmethod
+    def _copy(state: Dict[str, Any]) -> Dict[str, Any]:
+        return {"buckets": list(state["buckets"]), "sum": state["sum"], "count": state["count"]}
+
+    def _merge_value(self, key: LabelValues, value: Dict[str, Any]):
+        state = self._values.get(key)
+        if state is None:
+            self._values[key] = self._copy(value)
+            return
+        state["buckets"] = [a + b for a, b in zip(state["buckets"], value["buckets"])]
+        state["sum"] += value["sum"]
+        state["count"] += value["count"]
+
+
+class MetricsRegistry:
+    """Реестр метрик процесса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Metric] = {}
+
+    def counter(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DURATION_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def _register(self, metric: Metric) -> Any:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def drain(self) -> Dict[str, Dict[LabelValues, Any]]:
+        """
+        Накопленные значения со сбросом счетчиков и гистограмм
+
+        Используется процессами пула (python -m src.batch --workers N): значения
+        передаются родительскому процессу вместе с записью и добавляются в его реестр.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot(reset=True) for metric in metrics}
+
+    def merge(self, snapshot: Dict[str, Dict[LabelValues, Any]]):
+        """Добавление значений, полученных от другого процесса"""
+        with self._lock:
+            metrics = dict(self._metrics)
+        for name, values in snapshot.items():
+            if name in metrics and values:
+                metrics[name].merge(values)
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    """Реестр метрик текущего процесса"""
+    return _registry
+
+
+# Метрики конвейера
+DOCUMENTS = _registry.counter(
+    "nakladnaya_documents_total", "Обработанные документы", ("pipeline", "status"))
+DOCUMENT_SECONDS = _registry.histogram(
+    "nakladnaya_document_duration_seconds", "Время обработки документа от начала до результата", ("pipeline",))
+STAGE_SECONDS = _registry.histogram(
+    "nakladnaya_stage_duration_seconds", "Время этапа обработки", ("stage",))
+STAGE_FAILURES = _registry.counter(
+    "nakladnaya_stage_failures_total", "Этапы, завершившиеся исключением", ("stage",))
+PAGES = _registry.counter(
+    "nakladnaya_pages_total", "Страницы по источнику текста", ("source",))
+DETECTED_FIELDS = _registry.counter(
+    "nakladnaya_detected_fields_total", "Поля, найденные YOLO", ("field_type",))
+PARSED_DOCUMENTS = _registry.counter(
+    "nakladnaya_parsed_documents_total", "Разборы текста InvoiceParser", ("status",))
+DETECTION_PATHS = _registry.counter(
+    "nakladnaya_detection_pages_total", "Страницы по способу поиска полей (template, yolo)", ("path",))
+CACHE_REQUESTS = _registry.counter(
+    "nakladnaya_cache_requests_total", "Обращения к кэшу результатов и архиву этапов", ("cache", "result"))
+MODEL_LOAD_SECONDS = _registry.gauge(
+    "nakladnaya_model_load_seconds", "Время загрузки моделей", ("model",))
+QUEUE_DEPTH = _registry.gauge(
+    "nakladnaya_queue_depth", "Документы, ожидающие обработки")
+IN_FLIGHT = _registry.gauge(
+    "nakladnaya_in_flight_documents", "Документы в обработке")
+
+
+def observe_document(pipeline: str, timings: Dict[str, Dict[str, float]], error: Optional[str] = None):
+    """Итог документа: статус и время по блоку timings (ProgressReporter.report)"""
+    DOCUMENTS.inc(pipeline=pipeline, status="error" if error else "ok")
+    total = timings.get("total", {})
+    if "wall_ms" in total:
+        DOCUMENT_SECONDS.observe(total["wall_ms"] / 1000, pipeline=pipeline)
+
+
+def write_metrics(path: Path, registry: Optional[MetricsRegistry] = None):
+    """Атомарная запись метрик в файл (временный файл и os.replace)"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = (registry or _registry).render().encode("utf-8")
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_name, path)
+    except OSError as e:
+        logger.warning(f"Не удалось записать метрики в {path}: {e}")
+        Path(tmp_name).unlink(missing_ok=True)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """GET /metrics"""
+
+    registry: MetricsRegistry = _registry
+
+    def do_GET(self):
+        if self.path.split("?")[0].rstrip("/") != "/metrics":
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        send_metrics(self, self.registry)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+def send_metrics(handler: BaseHTTPRequestHandler, registry: Optional[MetricsRegistry] = None):
+    """Ответ с метриками для обработчика http.server"""
+    body = (registry or _registry).render().encode("utf-8")
+    handler.send_response(HTTPStatus.OK)
+    handler.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+    handler.send_header("Content-Length", str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
+
+
+def serve_metrics(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Локальный сервер метрик в фоновом потоке"""
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"Метрики доступны на http://{host}:{server.server_port}/metrics")
+    return server
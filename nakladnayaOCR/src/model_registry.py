@@ -0,0 +1,118 @@
+"""
+Общий для процесса реестр моделей Marker
+"""
+import os
+import time
+import logging
+import threading
+from typing import Dict, Any, Optional
+
+from .metrics import MODEL_LOAD_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def _current_rss_bytes() -> Optional[int]:
+    """Текущий резидентный размер процесса в байтах (Linux /proc, иначе None)"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def _model_parameter_bytes(artifact: Any) -> int:
+    """Размер параметров и буферов torch-модели внутри предиктора Marker/Surya"""
+    model = getattr(artifact, "model", artifact)
+    total = 0
+    for attr in ("parameters", "buffers"):
+        tensors = getattr(model, attr, None)
+        if not callable(tensors):
+            continue
+        try:
+            for tensor in tensors():
+                total += tensor.numel() * tensor.element_size()
+        except Exception:
+            continue
+    return total
+
+
+class MarkerModelRegistry:
+    """
+    Реестр моделей Marker (layout, recognition, table и т.д.)
+
+    Словарь артефактов загружается один раз на процесс и переиспользуется
+    всеми экземплярами PdfConverter независимо от формата вывода и force_ocr.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models: Optional[Dict[str, Any]] = None
+        self.load_time: Optional[float] = None
+        self.rss_delta_bytes: Optional[int] = None
+        self.model_bytes: Dict[str, int] = {}
+
+    def is_loaded(self) -> bool:
+        """Проверка, загружены ли модели"""
+        return self._models is not None
+
+    def get_models(self) -> Dict[str, Any]:
+        """Получение словаря артефактов Marker (загрузка при первом обращении)"""
+        if self._models is not None:
+            return self._models
+
+        with self._lock:
+            if self._models is None:
+                self._models = self._load()
+        return self._models
+
+    def _load(self) -> Dict[str, Any]:
+        """Загрузка моделей Marker с замером времени и памяти"""
+        from marker.models import create_model_dict
+
+        logger.info("Загрузка моделей Marker...")
+        rss_before = _current_rss_bytes()
+        start = time.perf_counter()
+
+        models = create_model_dict()
+
+        self.load_time = time.perf_counter() - start
+        MODEL_LOAD_SECONDS.set(self.load_time, model="marker")
+        rss_after = _current_rss_bytes()
+        if rss_before is not None and rss_after is not None:
+            self.rss_delta_bytes = rss_after - rss_before
+        self.model_bytes = {name: _model_parameter_bytes(artifact) for name, artifact in models.items()}
+
+        logger.info(
+            f"Модели Marker загружены за {self.load_time:.2f} с, "
+            f"параметры: {sum(self.model_bytes.values()) / 2**20:.1f} МБ, "
+            f"прирост RSS: {(self.rss_delta_bytes or 0) / 2**20:.1f} МБ"
+        )
+        return models
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика загрузки: время, прирост RSS и размер моделей"""
+        return {
+            "loaded": self.is_loaded(),
+            "load_time_sec": self.load_time,
+            "rss_delta_bytes": self.rss_delta_bytes,
+            "model_bytes": dict(self.model_bytes),
+            "total_model_bytes": sum(self.model_bytes.values()),
+        }
+
+    def clear(self):
+        """Выгрузка моделей (например, для освобождения памяти в тестах)"""
+        with self._lock:
+            self._models = None
+            self.load_time = None
+            self.rss_delta_bytes = None
+            self.model_bytes = {}
+
+
+_registry = MarkerModelRegistry()
+
+
+def get_model_registry() -> MarkerModelRegistry:
+    """Глобальный реестр моделей Marker текущего процесса"""
+    return _registry
@@ -0,0 +1,93 @@
+"""
+Растр страницы документа в памяти
+"""
+import logging
+from pathlib import Path
+from typing import Any, Optional
+
+import cv2
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+class PageImage:
+    """
+    Изображение страницы на основе массива NumPy (RGB, uint8, H x W x 3)
+
+    Проходит через детекцию, вырезку регионов и аннотирование без записи
+    на диск. Для PDF строится без копирования поверх буфера пиксмапа PyMuPDF.
+    """
+
+    def __init__(self, array: np.ndarray, page_index: int = 0, name: Optional[str] = None,
+                 scale: float = 1.0, owner: Any = None):
+        """
+        Args:
+            array: Пиксели страницы в RGB
+            page_index: Номер страницы в документе (с нуля)
+            name: Имя страницы для отладочных файлов
+            scale: Пикселей на пункт PDF (1.0 для обычных изображений)
+            owner: Объект, владеющий буфером array (держим ссылку, пока жива страница)
+        """
+        self.array = array
+        self.page_index = page_index
+        self.name = name or f"page_{page_index + 1}"
+        self.scale = scale
+        self._owner = owner
+
+    @classmethod
+    def from_pixmap(cls, pixmap, page_index: int = 0, scale: float = 1.0) -> "PageImage":
+        """Создание страницы поверх буфера fitz.Pixmap без копирования (pixmap без альфа-канала)"""
+        buffer = getattr(pixmap, "samples_mv", None) or pixmap.samples
+        array = np.ndarray(
+            shape=(pixmap.height, pixmap.width, pixmap.n),
+            dtype=np.uint8,
+            buffer=buffer,
+            strides=(pixmap.stride, pixmap.n, 1)
+        )
+        if pixmap.n == 1:
+            array = np.repeat(array, 3, axis=2)
+        return cls(array, page_index=page_index, scale=scale, owner=pixmap)
+
+    @classmethod
+    def from_pil(cls, image: Image.Image, page_index: int = 0, scale: float = 1.0) -> "PageImage":
+        """Создание страницы из PIL.Image"""
+        return cls(np.asarray(image.convert("RGB")), page_index=page_index, scale=scale)
+
+    @classmethod
+    def from_file(cls, path, page_index: int = 0) -> "PageImage":
+        """Загрузка страницы из файла изображения"""
+        image = cv2.imread(str(path))
+        if image is None:
+            raise ValueError(f"Не удалось загрузить изображение: {path}")
+        return cls(cv2.cvtColor(image, cv2.COLOR_BGR2RGB), page_index=page_index, name=Path(path).stem)
+
+    @property
+    def width(self) -> int:
+        return self.array.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.array.shape[0]
+
+    def to_bgr(self) -> np.ndarray:
+        """Копия в порядке каналов BGR (для OpenCV и Ultralytics)"""
+        return cv2.cvtColor(self.array, cv2.COLOR_RGB2BGR)
+
+    def crop(self, x1: int, y1: int, x2: int, y2: int) -> np.ndarray:
+        """Вырезка региона (представление массива, без копирования)"""
+        x1, y1 = max(0, x1), max(0, y1)
+        x2, y2 = min(self.width, x2), min(self.height, y2)
+        return self.array[y1:y2, x1:x2]
+
+    def to_pil(self) -> Image.Image:
+        """Конвертация в PIL.Image"""
+        return Image.fromarray(self.array)
+
+    def save(self, path) -> Path:
+        """Сохранение страницы на диск (только для отладочных артефактов)"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        cv2.imwrite(str(path), self.to_bgr())
+        return path
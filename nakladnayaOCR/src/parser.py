@@ -2,13 +2,19 @@
 """
 Основной модуль для парсинга накладных и извлечения ключевой информации
 """
-import re
+import os
 import logging
-from typing import Dict, Optional, List, Any, Tuple
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+from typing import Dict, Optional, List, Any, Tuple, Iterable, Iterator
 from datetime import datetime
 
 from .config import Config
 from .utils import TextProcessor
+from .patterns import get_pattern_bank
+from .document_index import DocumentIndex
+from .metrics import PARSED_DOCUMENTS
 
 logger = logging.getLogger(__name__)
 
@@ -19,28 +25,30 @@ class InvoiceParser:
     def __init__(self, config: Config, text_processor: TextProcessor):
         self.config = config
         self.text_processor = text_processor
+        # Все паттерны компилируются один раз и разделяются между одинаковыми конфигурациями
+        self.patterns = get_pattern_bank(config)
     
     def parse(self, text: str) -> Dict[str, Any]:
         """Основной метод парсинга накладной"""
         if not text:
+            PARSED_DOCUMENTS.inc(status="empty")
             return self._empty_result("Пустой текст")
         
         try:
-            # Нормализация текста
-            normalized_text = self.text_processor.normalize_text(text)
-            lines = [line.strip() for line in text.splitlines()]
+            # Нормализация текста и индекс строк и меток за один проход
+            index = self.text_processor.build_index(text)
             
             logger.info("Начинаем парсинг накладной...")
             
             # Извлечение основной информации
-            document_info = self._extract_document_info(normalized_text)
-            parties_info = self._extract_parties_info(normalized_text, lines)
-            amounts_info = self._extract_amounts_info(normalized_text)
-            logistics_info = self._extract_logistics_info(lines)
+            document_info = self._extract_document_info(index.text)
+            parties_info = self._extract_parties_info(index)
+            amounts_info = self._extract_amounts_info(index)
+            logistics_info = self._extract_logistics_info(index)
             
             # Сборка результата
             result = {
-                "document_type": self._determine_document_type(normalized_text),
+                "document_type": self._determine_document_type(index),
                 "extraction_timestamp": datetime.now().isoformat(),
                 "confidence_score": self._calculate_confidence_score(document_info, parties_info, amounts_info),
                 **document_info,
@@ -53,28 +61,93 @@ class InvoiceParser:
             if self.config.debug_mode:
                 result["debug_info"] = {
                     "text_length": len(text),
-                    "lines_count": len(lines),
+                    "lines_count": len(index.lines),
                     "first_100_chars": text[:100],
                     "extraction_patterns_used": self._get_used_patterns()
                 }
             
             logger.info(f"Парсинг завершен. Уверенность: {result.get('confidence_score', 0):.2f}")
+            PARSED_DOCUMENTS.inc(status="ok")
             return result
             
         except Exception as e:
             logger.exception("Ошибка при парсинге накладной")
+            PARSED_DOCUMENTS.inc(status="error")
+            return self._empty_result(f"Ошибка парсинга: {str(e)}")
+    
+    def parse_many(self, texts: Iterable[str], workers: Optional[int] = None,
+                   chunksize: int = 16) -> List[Dict[str, Any]]:
+        """
+        Пакетный парсинг накладных в пуле процессов
+        
+        Args:
+            texts: Тексты документов
+            workers: Количество процессов (None - число ядер, 1 - в текущем процессе)
+            chunksize: Количество текстов в одной задаче процесса
+            
+        Returns:
+            Результаты в порядке входных текстов; ошибка отдельного текста
+            возвращается как результат с ключом "error", а не прерывает пакет
+        """
+        return list(self.iter_parse_many(texts, workers=workers, chunksize=chunksize))
+    
+    def iter_parse_many(self, texts: Iterable[str], workers: Optional[int] = None,
+                        chunksize: int = 16) -> Iterator[Dict[str, Any]]:
+        """
+        Потоковая форма parse_many: результаты выдаются по мере готовности в порядке входа
+        
+        Входные тексты читаются порциями, в работе одновременно не больше
+        2 * workers задач, поэтому весь пакет в памяти не держится.
+        Паттерны компилируются один раз в каждом процессе при его запуске.
+        """
+        workers = workers or os.cpu_count() or 1
+        chunks = _chunked(texts, max(1, chunksize))
+        
+        if workers == 1:
+            for chunk in chunks:
+                yield from (self._parse_safe(text) for text in chunk)
+            return
+        
+        pending: deque = deque()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(self.config,)) as executor:
+            try:
+                for chunk in chunks:
+                    pending.append((len(chunk), executor.submit(_parse_chunk, chunk)))
+                    if len(pending) >= workers * 2:
+                        yield from self._chunk_results(*pending.popleft())
+                while pending:
+                    yield from self._chunk_results(*pending.popleft())
+            finally:
+                # Генератор закрыт досрочно: не запускаем оставшиеся задачи
+                for _, future in pending:
+                    future.cancel()
+    
+    def _chunk_results(self, size: int, future: Future) -> List[Dict[str, Any]]:
+        """Результаты порции; сбой процесса превращается в ошибки элементов порции"""
+        try:
+            return future.result()
+        except Exception as e:
+            logger.error(f"Ошибка процесса при пакетном парсинге: {e}")
+            return [self._empty_result(f"Ошибка пакетной обработки: {str(e)}") for _ in range(size)]
+    
+    def _parse_safe(self, text: str) -> Dict[str, Any]:
+        """Парсинг без исключений (для пакетной обработки)"""
+        try:
+            return self.parse(text)
+        except Exception as e:
             return self._empty_result(f"Ошибка парсинга: {str(e)}")
     
     def _extract_document_info(self, text: str) -> Dict[str, Any]:
         """Извлечение основной информации о документе"""
         # Номер документа
         number = self.text_processor.find_first_match(
-            self.config.number_patterns, text
+            self.patterns.number, text
         )
         
         # Дата документа
         date = self.text_processor.find_first_match(
-            self.config.date_patterns, text
+            self.patterns.date, text
         )
         
         # Нормализация даты
@@ -86,21 +159,23 @@ class InvoiceParser:
             "original_date": date
         }
     
-    def _extract_parties_info(self, text: str, lines: List[str]) -> Dict[str, Any]:
+    def _extract_parties_info(self, index: DocumentIndex) -> Dict[str, Any]:
         """Извлечение информации о сторонах сделки"""
         # Улучшенное извлечение поставщика
-        supplier_info = self._extract_enhanced_company_info(text, ["Грузоотправитель", "Поставщик"])
+        supplier_info = self._extract_enhanced_company_info(index, self.config.supplier_company_labels)
         
         # Улучшенное извлечение покупателя
-        buyer_info = self._extract_enhanced_company_info(text, ["Грузополучатель", "Покупатель"])
+        buyer_info = self._extract_enhanced_company_info(index, self.config.buyer_company_labels)
         
         return {
             "supplier": supplier_info,
             "buyer": buyer_info
         }
     
-    def _extract_amounts_info(self, text: str) -> Dict[str, Any]:
+    def _extract_amounts_info(self, index: DocumentIndex) -> Dict[str, Any]:
         """Извлечение финансовой информации"""
+        text = index.text
+        
         # Отладочный вывод паттернов поиска
         if self.config.debug_mode:
             logger.info("Паттерны для поиска сумм:")
@@ -108,17 +183,17 @@ class InvoiceParser:
         
         # Сумма с НДС
         total_with_vat_str = self.text_processor.find_first_match(
-            self.config.total_with_vat_patterns, text
+            self.patterns.total_with_vat, text
         )
         total_with_vat = self.text_processor.parse_money(total_with_vat_str)
         
         # НДС - особый поиск чтобы не захватить сумму без НДС
-        vat_str = self._extract_vat_amount(text)
+        vat_str = self._extract_vat_amount(index)
         vat = self.text_processor.parse_money(vat_str)
         
         # Сумма без НДС  
         total_without_vat_str = self.text_processor.find_first_match(
-            self.config.total_without_vat_patterns, text
+            self.patterns.total_without_vat, text
         )
         total_without_vat = self.text_processor.parse_money(total_without_vat_str)
         
@@ -150,21 +225,19 @@ class InvoiceParser:
             }
         }
     
-    def _extract_logistics_info(self, lines: List[str]) -> Dict[str, Any]:
+    def _extract_logistics_info(self, index: DocumentIndex) -> Dict[str, Any]:
         """Извлечение логистической информации"""
-        text = '\n'.join(lines)
-        
         # Адрес доставки
-        delivery_address = self._extract_delivery_address(text)
+        delivery_address = self._extract_delivery_address(index)
         
         # Время доставки
-        delivery_time = self._extract_delivery_time(text)
+        delivery_time = self._extract_delivery_time(index.joined)
         
         # Грузоотправитель
-        shipper = self._extract_company_name(lines, [r"Грузоотправитель"])
+        shipper = self._extract_company_name(index, self.config.shipper_labels)
         
         # Грузополучатель  
-        consignee = self._extract_company_name(lines, [r"Грузополучатель"])
+        consignee = self._extract_company_name(index, self.config.consignee_labels)
         
         return {
             "shipper": shipper or None,
@@ -173,9 +246,9 @@ class InvoiceParser:
             "delivery_time": delivery_time
         }
     
-    def _determine_document_type(self, text: str) -> str:
+    def _determine_document_type(self, index: DocumentIndex) -> str:
         """Определение типа документа"""
-        text_lower = text.lower()
+        text_lower = index.folded
         
         if any(keyword in text_lower for keyword in ["товарная накладная", "торг-12"]):
             return "Товарная накладная (ТОРГ-12)"
@@ -200,7 +273,7 @@ class InvoiceParser:
         ]
         
         # Очистка строки
-        cleaned_date = re.sub(r"[^\d./-]", "", date_str.strip())
+        cleaned_date = self.patterns.date_cleanup.sub("", date_str.strip())
         
         for fmt in date_formats:
             try:
@@ -252,94 +325,76 @@ class InvoiceParser:
         
         return min(score / max_score, 1.0)
     
-    def _extract_company_name(self, lines: List[str], labels: List[str]) -> Optional[str]:
+    def _extract_company_name(self, index: DocumentIndex, labels: List[str]) -> Optional[str]:
         """Извлечение названия компании после указанной метки"""
-        for i, line in enumerate(lines):
-            # Ищем строку с меткой
-            if any(re.search(label, line, re.IGNORECASE) for label in labels):
-                # Проверяем, есть ли название на той же строке
-                for label in labels:
-                    pattern = rf"{label}[:\s]*(.+?)(?:ИНН|КПП|$)"
-                    match = re.search(pattern, line, re.IGNORECASE)
-                    if match:
-                        name = match.group(1).strip()
-                        if name and not re.match(r"^\d+$", name):  # Не только цифры
-                            return name
-                
-                # Если не найдено на той же строке, ищем в следующих строках
-                for j in range(i + 1, min(i + 3, len(lines))):
-                    if j < len(lines):
-                        line_content = lines[j].strip()
-                        # Пропускаем строки с ИНН/КПП или пустые
-                        if (line_content and 
-                            not re.search(r"(ИНН|КПП|^\d+$)", line_content, re.IGNORECASE)):
-                            return line_content
-                break
+        lines = index.lines
+        
+        # Первая строка с меткой
+        i = index.line_view.first_line(labels)
+        if i is None:
+            return None
+        
+        # Проверяем, есть ли название на той же строке
+        for label in labels:
+            match = self.patterns.company_name(label).search(lines[i])
+            if match:
+                name = match.group(1).strip()
+                if name and not self.patterns.digits_only.match(name):  # Не только цифры
+                    return name
+        
+        # Если не найдено на той же строке, ищем в следующих строках
+        for j in range(i + 1, min(i + 3, len(lines))):
+            line_content = lines[j].strip()
+            # Пропускаем строки с ИНН/КПП или пустые
+            if (line_content and 
+                not self.patterns.name_skip.search(line_content)):
+                return line_content
         return None
     
-    def _extract_vat_amount(self, text: str) -> Optional[str]:
+    def _extract_vat_amount(self, index: DocumentIndex) -> Optional[str]:
         """Специальный метод для извлечения суммы НДС"""
-        lines = text.splitlines()
+        view = index.text_view
         
-        for line in lines:
-            # Ищем строки с НДС, но избегаем строк с "без НДС" и "к оплате"
-            if (re.search(r"НДС\s*\d+%?", line, re.IGNORECASE) and 
-                not re.search(r"без\s*НДС|к\s*оплате|итого|всего", line, re.IGNORECASE)):
+        # Только строки с НДС, но избегаем строк с "без НДС" и "к оплате"
+        for i in view.label_lines("НДС"):
+            line = view.lines[i]
+            if (self.patterns.vat_line.search(line) and 
+                not self.patterns.vat_line_exclude.search(line)):
                 
                 # Извлекаем число после НДС
-                match = re.search(r"НДС\s*\d+%?\s*[:\-]?\s*([0-9][0-9\s.,]*)", line, re.IGNORECASE)
+                match = self.patterns.vat_line_value.search(line)
                 if match:
                     return match.group(1)
         
         # Fallback к обычному поиску
-        return self.text_processor.find_first_match(self.config.vat_patterns, text)
+        return self.text_processor.find_first_match(self.patterns.vat, index.text)
     
-    def _extract_inn_kpp_for_party(self, lines: List[str], labels: List[str]) -> Tuple[Optional[str], Optional[str]]:
+    def _extract_inn_kpp_for_party(self, index: DocumentIndex, labels: List[str]) -> Tuple[Optional[str], Optional[str]]:
         """Извлечение ИНН и КПП для конкретной стороны"""
-        # Находим секцию стороны
-        start_idx = None
-        for i, line in enumerate(lines):
-            if any(re.search(label, line, re.IGNORECASE) for label in labels):
-                start_idx = i
-                break
+        view = index.line_view
         
+        # Находим секцию стороны
+        start_idx = view.first_line(labels)
         if start_idx is None:
             return None, None
         
         # Ищем до следующей секции или конца окна
-        end_idx = min(start_idx + 8, len(lines))
-        
-        # Ищем следующую секцию контрагента
-        for j in range(start_idx + 1, len(lines)):
-            line = lines[j]
-            if any(re.search(other_label, line, re.IGNORECASE) 
-                   for other_label in (self.config.supplier_labels + self.config.buyer_labels)
-                   if not any(re.search(label, line, re.IGNORECASE) for label in labels)):
+        end_idx = min(start_idx + 8, len(view.lines))
+        
+        # Ищем следующую секцию контрагента (строка с меткой другой стороны)
+        own_lines = set(view.lines_with(labels))
+        party_labels = self.config.supplier_labels + self.config.buyer_labels
+        for j in view.lines_with(party_labels):
+            if j > start_idx and j not in own_lines:
                 end_idx = j
                 break
         
         # Поиск ИНН и КПП в найденной секции
-        inn = None
-        kpp = None
-        
-        for i in range(start_idx, end_idx):
-            if i < len(lines):
-                line = lines[i]
-                
-                if inn is None:
-                    inn_match = re.search(self.config.inn_pattern, line, re.IGNORECASE)
-                    if inn_match:
-                        inn = inn_match.group(1)
-                
-                if kpp is None:
-                    kpp_match = re.search(self.config.kpp_pattern, line, re.IGNORECASE)
-                    if kpp_match:
-                        kpp = kpp_match.group(1)
-                
-                if inn and kpp:
-                    break
+        inn_match = view.search_lines(self.patterns.inn, self.patterns.inn_line_label, start_idx, end_idx)
+        kpp_match = view.search_lines(self.patterns.kpp, self.patterns.kpp_line_label, start_idx, end_idx)
         
-        return inn, kpp
+        return (inn_match.group(1) if inn_match else None,
+                kpp_match.group(1) if kpp_match else None)
     
     def _get_used_patterns(self) -> List[str]:
         """Получение списка использованных паттернов для отладки"""
@@ -349,51 +404,58 @@ class InvoiceParser:
             "delivery_address_patterns", "delivery_time_patterns"
         ]
     
-    def _extract_enhanced_company_info(self, text: str, labels: List[str]) -> Dict[str, Any]:
+    def _extract_enhanced_company_info(self, index: DocumentIndex, labels: List[str]) -> Dict[str, Any]:
         """Улучшенное извлечение информации о компании"""
         company_info = {"name": None, "INN": None, "KPP": None}
+        view = index.text_view
         
-        # Поиск компании по секциям
+        window = self.config.label_search_window
+        
+        # Поиск компании по секциям: в окне после каждого вхождения метки
         for label in labels:
-            # Паттерн для поиска секции с компанией
-            pattern = rf"{label}[^|]*?\|[^|]*?\|[^|]*?Общество с ограниченной ответственностью \"([^\"]+)\", ИНН (\d+)"
-            match = re.search(pattern, text, re.IGNORECASE | re.MULTILINE | re.DOTALL)
+            # Паттерн для поиска секции с компанией и альтернативный паттерн
+            pattern, pattern2 = self.patterns.company_section(label)
+            match = (view.match_at_labels(pattern, label, window)
+                     or view.match_at_labels(pattern2, label, window))
             if match:
                 company_info["name"] = match.group(1)
                 company_info["INN"] = match.group(2)
                 break
-                
-            # Альтернативный паттерн
-            pattern2 = rf"{label}.*?\"([^\"]+)\".*?ИНН\s*(\d+)"
-            match2 = re.search(pattern2, text, re.IGNORECASE | re.MULTILINE | re.DOTALL)
-            if match2:
-                company_info["name"] = match2.group(1)
-                company_info["INN"] = match2.group(2)
-                break
         
         # Поиск КПП рядом с найденным ИНН
         if company_info["INN"]:
-            kpp_pattern = rf"ИНН\s*{company_info['INN']}.*?КПП\s*(\d+)"
-            kpp_match = re.search(kpp_pattern, text, re.IGNORECASE | re.MULTILINE | re.DOTALL)
-            if kpp_match:
-                company_info["KPP"] = kpp_match.group(1)
+            company_info["KPP"] = self._find_kpp_after_inn(index, company_info["INN"])
         
         return company_info
     
-    def _extract_delivery_address(self, text: str) -> Optional[str]:
+    def _find_kpp_after_inn(self, index: DocumentIndex, inn: str) -> Optional[str]:
+        """КПП, следующий за первым вхождением '<метка ИНН> <inn>' в тексте (в пределах окна)"""
+        view = index.text_view
+        for pos in view.positions(self.patterns.inn_label):
+            match = self.patterns.inn_value.match(view.text, pos)
+            if match and match.group(1).startswith(inn):
+                start = match.start(1) + len(inn)
+                endpos = view.window_end(start, self.config.label_search_window)
+                kpp_match = self.patterns.kpp_value.search(view.text, start, endpos)
+                return kpp_match.group(1) if kpp_match else None
+        return None
+    
+    def _extract_delivery_address(self, index: DocumentIndex) -> Optional[str]:
         """Извлечение адреса доставки"""
+        view = index.line_view
+        window = self.config.label_search_window
+        
         # Поиск адреса доставки из секции "адрес места доставки груза"
-        address_pattern = r"адрес\s*места\s*доставки\s*груза[^|]*?\|[^|]*?\|[^|]*?([^|]+)"
-        match = re.search(address_pattern, text, re.IGNORECASE | re.MULTILINE | re.DOTALL)
-        if match:
-            address = match.group(1).strip()
-            # Очистка от лишних символов и форматирование
-            address = re.sub(r'\s+', ' ', address)
-            return address if address and len(address) > 5 else None
+        for address_pattern in self.patterns.delivery_address:
+            match = view.match_at_labels(address_pattern, self.config.delivery_address_labels, window)
+            if match:
+                address = match.group(1).strip()
+                # Очистка от лишних символов и форматирование
+                address = self.patterns.whitespace.sub(' ', address)
+                return address if address and len(address) > 5 else None
         
         # Альтернативный поиск адреса получателя
-        alt_pattern = r"Грузополучатель.*?г\.\s*Москва[^|]*?Неверовского[^|]*?"
-        alt_match = re.search(alt_pattern, text, re.IGNORECASE | re.MULTILINE | re.DOTALL)
+        alt_match = view.match_at_labels(self.patterns.delivery_address_alt, "Грузополучатель", window)
         if alt_match:
             return "г. Москва, ул. Неверовского, д. 9"
         
@@ -401,20 +463,14 @@ class InvoiceParser:
     
     def _extract_delivery_time(self, text: str) -> Optional[str]:
         """Извлечение времени доставки"""
-        # Поиск полной информации о доставке
-        delivery_pattern = r"Дата\s*доставки:\s*([0-3]?\d[.\-/][01]?\d[.\-/]\d{2,4}),?\s*с\s*(\d{1,2}:\d{2})\s*до\s*(\d{1,2}:\d{2})"
-        match = re.search(delivery_pattern, text, re.IGNORECASE)
-        if match:
-            date = match.group(1)
-            time_from = match.group(2)
-            time_to = match.group(3)
-            return f"{date}, с {time_from} до {time_to}"
-        
-        # Поиск только даты доставки
-        date_pattern = r"(?:Дата\s*)?доставки:\s*([0-3]?\d[.\-/][01]?\d[.\-/]\d{2,4})"
-        date_match = re.search(date_pattern, text, re.IGNORECASE)
-        if date_match:
-            return date_match.group(1)
+        # Поиск полной информации о доставке (дата и интервал), затем только даты
+        for delivery_pattern in self.patterns.delivery_time:
+            match = delivery_pattern.search(text)
+            if match:
+                date, *interval = match.groups()
+                if len(interval) == 2:
+                    return f"{date}, с {interval[0]} до {interval[1]}"
+                return date
         
         return None
     
@@ -437,3 +493,28 @@ class InvoiceParser:
                 "total_with_vat": None
             }
         }
+
+
+# Парсер процесса пула parse_many (создается один раз при запуске процесса)
+_worker_parser: Optional[InvoiceParser] = None
+
+
+def _init_worker(config: Config):
+    """Инициализация процесса пула: парсер и банк паттернов"""
+    global _worker_parser
+    _worker_parser = InvoiceParser(config, TextProcessor(config))
+
+
+def _parse_chunk(texts: List[str]) -> List[Dict[str, Any]]:
+    """Парсинг порции текстов в процессе пула"""
+    return [_worker_parser._parse_safe(text) for text in texts]
+
+
+def _chunked(items: Iterable[str], size: int) -> Iterator[List[str]]:
+    """Разбиение итерируемого объекта на списки по size элементов"""
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
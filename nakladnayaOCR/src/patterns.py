@@ -0,0 +1,173 @@
+"""
+Банк скомпилированных регулярных выражений парсера накладных
+"""
+import re
+import logging
+import threading
+from typing import Dict, List, Optional, Pattern, Tuple
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+# Флаги поиска по всему документу (как в TextProcessor.find_first_match)
+DOCUMENT_FLAGS = re.IGNORECASE | re.MULTILINE | re.DOTALL
+
+# Поля Config, от которых зависит содержимое банка
+PATTERN_FIELDS = (
+    "money_pattern", "date_pattern", "inn_pattern", "kpp_pattern", "inn_label", "kpp_label",
+    "supplier_labels", "buyer_labels",
+    "supplier_company_labels", "buyer_company_labels", "shipper_labels", "consignee_labels",
+    "service_labels",
+    "number_patterns", "date_patterns",
+    "total_with_vat_patterns", "vat_patterns", "total_without_vat_patterns",
+    "delivery_address_labels", "delivery_address_patterns", "delivery_time_patterns",
+)
+
+
+def _compile_all(patterns: List[str], flags: int) -> List[Pattern]:
+    return [re.compile(pattern, flags) for pattern in patterns]
+
+
+def _label_in_pattern(label: str, pattern: str) -> Optional[str]:
+    """Метка для префильтра строк или None, если паттерн может совпасть без нее"""
+    return label if label and label.lower() in pattern.lower() else None
+
+
+def _compile_scanner(labels: List[str]) -> Tuple[Pattern, Dict[str, str]]:
+    """
+    Один паттерн, находящий все метки за проход по тексту
+
+    Каждая метка проверяется опережающей проверкой в своей группе, поэтому
+    в одной позиции фиксируются все подходящие метки (например, "Итого"
+    и "Итого с НДС"), а не только первая из альтернатив.
+    """
+    groups = {f"l{i}": label for i, label in enumerate(labels)}
+    any_label = "|".join(f"(?:{label})" for label in labels)
+    each_label = "".join(f"(?:(?=(?P<{name}>{label}))|)" for name, label in groups.items())
+    return re.compile(f"(?=(?:{any_label})){each_label}", re.IGNORECASE), groups
+
+
+class PatternBank:
+    """
+    Все регулярные выражения парсера, скомпилированные один раз из Config
+
+    Включает паттерны номеров, дат, сумм, ИНН/КПП и меток, а также паттерны,
+    которые раньше собирались f-строками на каждый вызов (поиск названия
+    компании после метки, поиск компании в секции стороны).
+    """
+
+    def __init__(self, config: Config):
+        self.fingerprint = config.fingerprint(PATTERN_FIELDS)
+
+        # Значения
+        self.money = re.compile(config.money_pattern)
+        self.date_value = re.compile(config.date_pattern)
+        self.inn = re.compile(config.inn_pattern, re.IGNORECASE)
+        self.kpp = re.compile(config.kpp_pattern, re.IGNORECASE)
+        self.inn_label = config.inn_label
+        self.kpp_label = config.kpp_label
+        # Префильтр строк по метке безопасен, только если метка входит в сам паттерн
+        self.inn_line_label = _label_in_pattern(config.inn_label, config.inn_pattern)
+        self.kpp_line_label = _label_in_pattern(config.kpp_label, config.kpp_pattern)
+
+        # Реквизиты документа и суммы (поиск по всему документу)
+        self.number = _compile_all(config.number_patterns, DOCUMENT_FLAGS)
+        self.date = _compile_all(config.date_patterns, DOCUMENT_FLAGS)
+        self.total_with_vat = _compile_all(config.total_with_vat_patterns, DOCUMENT_FLAGS)
+        self.vat = _compile_all(config.vat_patterns, DOCUMENT_FLAGS)
+        self.total_without_vat = _compile_all(config.total_without_vat_patterns, DOCUMENT_FLAGS)
+
+        # Строка НДС без "без НДС"/"к оплате"/"итого"
+        self.vat_line = re.compile(r"НДС\s*\d+%?", re.IGNORECASE)
+        self.vat_line_exclude = re.compile(r"без\s*НДС|к\s*оплате|итого|всего", re.IGNORECASE)
+        self.vat_line_value = re.compile(r"НДС\s*\d+%?\s*[:\-]?\s*([0-9][0-9\s.,]*)", re.IGNORECASE)
+
+        # Метки сторон
+        self.supplier_labels = _compile_all(config.supplier_labels, re.IGNORECASE)
+        self.buyer_labels = _compile_all(config.buyer_labels, re.IGNORECASE)
+        self.party_labels = self.supplier_labels + self.buyer_labels
+
+        # Название компании на строке после метки
+        self.company_name_labels = config.shipper_labels + config.consignee_labels
+        self._label_cache: Dict[str, Pattern] = {}
+        self._company_name_cache: Dict[str, Pattern] = {}
+        for label in self.company_name_labels:
+            self.label(label)
+            self.company_name(label)
+        self.digits_only = re.compile(r"^\d+$")
+        self.name_skip = re.compile(r"(ИНН|КПП|^\d+$)", re.IGNORECASE)
+
+        # Компания в секции стороны: табличный и альтернативный вариант
+        self._company_section_cache: Dict[str, Tuple[Pattern, Pattern]] = {}
+        for label in config.supplier_company_labels + config.buyer_company_labels:
+            self.company_section(label)
+        self.inn_value = re.compile(rf"(?:{config.inn_label})\s*(\d+)", re.IGNORECASE)
+        self.kpp_value = re.compile(rf"(?:{config.kpp_label})\s*(\d+)", re.IGNORECASE)
+        
+        # Все метки для DocumentIndex: стороны, логистика и служебные
+        self.index_labels = list(dict.fromkeys(
+            config.supplier_labels + config.buyer_labels
+            + config.supplier_company_labels + config.buyer_company_labels
+            + config.shipper_labels + config.consignee_labels
+            + config.service_labels + config.delivery_address_labels
+            + [config.inn_label, config.kpp_label]
+        ))
+        self.label_scanner, self.scanner_groups = _compile_scanner(self.index_labels)
+
+        # Логистика
+        self.delivery_address = _compile_all(config.delivery_address_patterns, DOCUMENT_FLAGS)
+        self.delivery_time = _compile_all(config.delivery_time_patterns, re.IGNORECASE)
+        self.delivery_address_alt = re.compile(
+            r"Грузополучатель.*?г\.\s*Москва[^|]*?Неверовского[^|]*?", DOCUMENT_FLAGS
+        )
+
+        # Служебные
+        self.whitespace = re.compile(r"\s+")
+        self.date_cleanup = re.compile(r"[^\d./-]")
+
+    def label(self, label: str) -> Pattern:
+        """Скомпилированная метка (без учета регистра)"""
+        pattern = self._label_cache.get(label)
+        if pattern is None:
+            pattern = self._label_cache[label] = re.compile(label, re.IGNORECASE)
+        return pattern
+
+    def company_name(self, label: str) -> Pattern:
+        """Название компании на той же строке после метки"""
+        pattern = self._company_name_cache.get(label)
+        if pattern is None:
+            pattern = self._company_name_cache[label] = re.compile(
+                rf"{label}[:\s]*(.+?)(?:ИНН|КПП|$)", re.IGNORECASE
+            )
+        return pattern
+
+    def company_section(self, label: str) -> Tuple[Pattern, Pattern]:
+        """Паттерны компании в секции стороны: табличный и альтернативный"""
+        patterns = self._company_section_cache.get(label)
+        if patterns is None:
+            patterns = self._company_section_cache[label] = (
+                re.compile(
+                    rf"{label}[^|]*?\|[^|]*?\|[^|]*?Общество с ограниченной ответственностью \"([^\"]+)\", ИНН (\d+)",
+                    DOCUMENT_FLAGS
+                ),
+                re.compile(rf"{label}.*?\"([^\"]+)\".*?ИНН\s*(\d+)", DOCUMENT_FLAGS),
+            )
+        return patterns
+
+
+_banks: Dict[str, PatternBank] = {}
+_banks_lock = threading.Lock()
+
+
+def get_pattern_bank(config: Config) -> PatternBank:
+    """Общий банк паттернов для конфигураций с одинаковым отпечатком"""
+    key = config.fingerprint(PATTERN_FIELDS)
+    bank = _banks.get(key)
+    if bank is None:
+        with _banks_lock:
+            bank = _banks.get(key)
+            if bank is None:
+                bank = _banks[key] = PatternBank(config)
+                logger.debug(f"Скомпилирован банк паттернов {key}")
+    return bank
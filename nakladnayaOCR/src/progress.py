@@ -0,0 +1,192 @@
+"""
+События хода обработки документа: начало и конец этапов, страницы, промежуточные результаты
+
+Для каждого этапа измеряются время (wall), процессорное время и прирост пикового
+RSS процесса; при trace_memory дополнительно пик памяти Python (tracemalloc).
+"""
+import sys
+import json
+import time
+import logging
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from typing import Dict, Any, Optional, Callable, Union, Iterator, List
+
+from .metrics import STAGE_SECONDS, STAGE_FAILURES
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:  # Windows
+    RESOURCE_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Этапы конвейера в порядке выполнения (имена как в src/stage_cache.py)
+STAGES = ("rasterize", "detect", "ocr", "region_ocr", "parse")
+
+# Вложенные этапы: сохранение загрузки, текстовый слой, прогон Marker, отрисовка аннотаций
+SUBSTAGES = ("save", "text_layer", "marker", "annotate")
+
+
+def peak_rss_kb() -> Optional[int]:
+    """Пиковый RSS процесса в КБ (None, если недоступно)"""
+    if not RESOURCE_AVAILABLE:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # На macOS ru_maxrss в байтах, на Linux - в КБ
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+@dataclass
+class ProgressEvent:
+    """Событие обработки документа"""
+
+    stage: str
+    kind: str  # start, end, page, partial
+    elapsed_ms: float  # от начала обработки документа
+    stage_ms: Optional[float] = None  # длительность этапа (для end)
+    page: Optional[int] = None  # обработано страниц (для page)
+    page_count: Optional[int] = None
+    data: Dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {key: value for key, value in asdict(self).items() if value is not None and value != {}}
+
+
+ProgressCallback = Callable[[ProgressEvent], None]
+
+
+class ProgressReporter:
+    """
+    Источник событий и замеров одного документа
+
+    Передает события в callback и накапливает замеры этапов в timings:
+    wall_ms, cpu_ms (процессорное время всех потоков процесса) и
+    rss_peak_delta_kb (на сколько вырос пиковый RSS). Замеры стоят несколько
+    системных вызовов на этап, поэтому включены всегда. Ошибка в callback
+    (например, в UI) записывается в лог и не прерывает обработку.
+
+    CPU и память измеряются для всего процесса: при нескольких документах
+    одновременно (сервис с concurrency > 1) это оценка сверху.
+    """
+
+    def __init__(self, callback: Optional[ProgressCallback] = None, trace_memory: bool = False):
+        """
+        Args:
+            callback: Получатель событий
+            trace_memory: Пик памяти Python по этапам через tracemalloc
+                (py_peak_kb; заметно замедляет обработку, для диагностики)
+        """
+        self.callback = callback
+        self.trace_memory = trace_memory
+        self.timings: Dict[str, Dict[str, float]] = {}
+        self._start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        self._rss_start = peak_rss_kb()
+        # Открытые этапы: пик tracemalloc общий, поэтому вложенные этапы
+        # передают наблюдаемый пик всем внешним перед его сбросом
+        self._traced: List[Dict[str, int]] = []
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @classmethod
+    def wrap(cls, progress: Union["ProgressReporter", ProgressCallback, None],
+             trace_memory: bool = False) -> "ProgressReporter":
+        """Источник событий из callback; уже созданный источник возвращается как есть"""
+        return progress if isinstance(progress, ProgressReporter) else cls(progress, trace_memory)
+
+    @property
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._start) * 1000
+
+    @contextmanager
+    def stage(self, name: str, page_count: Optional[int] = None) -> Iterator["ProgressReporter"]:
+        """Этап: событие start при входе, end с длительностью и замерами при выходе"""
+        self._emit(name, "start", page_count=page_count)
+        traced = self._trace_start()
+        rss_start = peak_rss_kb()
+        cpu_start = time.process_time()
+        stage_start = time.perf_counter()
+        try:
+            yield self
+        except BaseException:
+            STAGE_FAILURES.inc(stage=name)
+            raise
+        finally:
+            sample = {
+                "wall_ms": (time.perf_counter() - stage_start) * 1000,
+                "cpu_ms": (time.process_time() - cpu_start) * 1000,
+            }
+            if rss_start is not None:
+                sample["rss_peak_delta_kb"] = peak_rss_kb() - rss_start
+            if traced is not None:
+                sample["py_peak_kb"] = self._trace_end(traced)
+            self._add(name, sample)
+            STAGE_SECONDS.observe(sample["wall_ms"] / 1000, stage=name)
+            self._emit(name, "end", stage_ms=round(sample["wall_ms"], 1), page_count=page_count,
+                       data={key: round(value, 1) for key, value in sample.items() if key != "wall_ms"})
+
+    def page(self, stage: str, page: int, page_count: int):
+        """Обработано page страниц из page_count"""
+        self._emit(stage, "page", page=page, page_count=page_count)
+
+    def partial(self, stage: str, **data):
+        """Промежуточный результат этапа"""
+        self._emit(stage, "partial", data=data)
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        """Блок timings для результата: замеры этапов и итог по документу"""
+        total = {
+            "wall_ms": self.elapsed_ms,
+            "cpu_ms": (time.process_time() - self._cpu_start) * 1000,
+        }
+        if self._rss_start is not None:
+            total["rss_peak_delta_kb"] = peak_rss_kb() - self._rss_start
+        return {
+            name: {key: round(value, 1) for key, value in sample.items()}
+            for name, sample in {**self.timings, "total": total}.items()
+        }
+
+    def log_summary(self, file_name: str, **extra):
+        """Одна структурированная строка лога с замерами документа"""
+        logger.info(json.dumps(
+            {"event": "document_timings", "file": file_name, **extra, "timings": self.report()},
+            ensure_ascii=False, default=str
+        ))
+
+    def _add(self, name: str, sample: Dict[str, float]):
+        """Накопление замеров (этап может выполняться несколько раз)"""
+        current = self.timings.setdefault(name, {})
+        for key, value in sample.items():
+            if key.endswith("_kb"):
+                current[key] = max(current.get(key, 0), value)
+            else:
+                current[key] = current.get(key, 0.0) + value
+
+    def _trace_start(self) -> Optional[Dict[str, int]]:
+        if not (self.trace_memory and tracemalloc.is_tracing()):
+            return None
+        current, peak = tracemalloc.get_traced_memory()
+        for outer in self._traced:
+            outer["peak"] = max(outer["peak"], peak)
+        tracemalloc.reset_peak()
+        traced = {"start": current, "peak": current}
+        self._traced.append(traced)
+        return traced
+
+    def _trace_end(self, traced: Dict[str, int]) -> float:
+        _, peak = tracemalloc.get_traced_memory()
+        for open_stage in self._traced:
+            open_stage["peak"] = max(open_stage["peak"], peak)
+        self._traced.remove(traced)
+        return (traced["peak"] - traced["start"]) / 1024
+
+    def _emit(self, stage: str, kind: str, **kwargs):
+        if self.callback is None:
+            return
+        try:
+            self.callback(ProgressEvent(stage=stage, kind=kind, elapsed_ms=round(self.elapsed_ms, 1), **kwargs))
+        except Exception as e:
+            logger.warning(f"Ошибка обработчика событий ({stage}/{kind}): {e}")
@@ -0,0 +1,150 @@
+"""
+Квантование детектора полей в INT8 (post-training, ONNX Runtime)
+
+Исходная FP32-модель ONNX (артефакт "onnx" из манифеста) квантуется
+статически в формате QDQ: веса - INT8 по каналам, активации - UINT8 по
+диапазонам, собранным на калибровочных страницах (например, аугментированный
+набор DataAugmentator из yolo_training/). Декодирование боксов в голове
+Detect (DFL, сетка, объединение координат и вероятностей классов) остается
+в FP32: координаты в пикселях и вероятности в [0, 1] в одном тензоре
+теряют точность при общей шкале.
+"""
+import random
+import logging
+import tempfile
+from pathlib import Path
+from typing import List, Optional, Union, Iterator
+
+from .page_image import PageImage
+from .inference_backends import DEFAULT_IMGSZ, letterbox, read_manifest, manifest_path, to_blob
+
+try:
+    import onnx
+    from onnxruntime.quantization import (
+        CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType, quant_pre_process, quantize_static,
+    )
+    QUANTIZATION_AVAILABLE = True
+except ImportError:
+    CalibrationDataReader = object
+    QUANTIZATION_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".tiff", ".bmp"}
+
+# Калибровки на сотне страниц фиксированной разметки достаточно
+DEFAULT_CALIBRATION_SIZE = 100
+
+CALIBRATION_METHODS = ("minmax", "entropy", "percentile")
+
+
+def calibration_images(sources: List[Union[str, Path]], limit: int = DEFAULT_CALIBRATION_SIZE,
+                       seed: int = 0) -> List[Path]:
+    """Изображения для калибровки (каталоги просматриваются рекурсивно, выборка детерминирована)"""
+    paths = []
+    for source in map(Path, sources):
+        candidates = source.rglob("*") if source.is_dir() else [source]
+        paths += sorted(p for p in candidates if p.suffix.lower() in IMAGE_EXTENSIONS)
+    if len(paths) > limit:
+        paths = sorted(random.Random(seed).sample(paths, limit))
+    return paths
+
+
+class LetterboxCalibrationReader(CalibrationDataReader):
+    """Калибровочные страницы с той же предобработкой, что в ExportedBackend"""
+
+    def __init__(self, images: List[Path], input_name: str, imgsz: int):
+        self.images = images
+        self.input_name = input_name
+        self.imgsz = imgsz
+        self._iterator: Optional[Iterator[Path]] = None
+
+    def get_next(self):
+        if self._iterator is None:
+            self._iterator = iter(self.images)
+        path = next(self._iterator, None)
+        if path is None:
+            return None
+        image, _, _ = letterbox(PageImage.from_file(path).to_bgr(), self.imgsz)
+        return {self.input_name: to_blob([image])}
+
+    def rewind(self):
+        self._iterator = None
+
+
+def head_decode_nodes(model: "onnx.ModelProto") -> List[str]:
+    """
+    Узлы декодирования головы Detect, исключаемые из квантования
+
+    Ultralytics именует узлы по модулям (/model.22/...); последний модуль -
+    голова. Свертки ветвей cv2/cv3 квантуются, остальное (DFL, сетка
+    якорей, объединение выходов) остается в FP32.
+    """
+    def module(node) -> Optional[str]:
+        parts = node.name.split("/")
+        return parts[1] if len(parts) > 2 and parts[1].startswith("model.") else None
+
+    modules = {module(node) for node in model.graph.node} - {None}
+    if not modules:
+        return []
+    head = max(modules, key=lambda name: int(name.split(".")[1]))
+    return [
+        node.name for node in model.graph.node
+        if module(node) == head and not node.name.startswith((f"/{head}/cv2", f"/{head}/cv3"))
+    ]
+
+
+def quantize_detector(weights: Union[str, Path], images: List[Path], output: Optional[Path] = None,
+                      method: str = "minmax", per_channel: bool = True) -> Path:
+    """
+    INT8-модель из FP32 ONNX, экспортированной из весов weights
+
+    Args:
+        weights: Веса .pt, рядом с которыми лежит манифест с артефактом "onnx"
+        images: Калибровочные изображения страниц
+        output: Путь INT8-модели (по умолчанию <onnx>.int8.onnx)
+        method: Калибровка диапазонов активаций (minmax, entropy, percentile)
+        per_channel: Шкала весов по выходным каналам свертки
+
+    Returns:
+        Путь к INT8-модели (в манифест не записывается, см. register_artifact)
+    """
+    if not QUANTIZATION_AVAILABLE:
+        raise RuntimeError("Для квантования нужны onnx и onnxruntime")
+    if not images:
+        raise RuntimeError("Нет калибровочных изображений")
+
+    manifest = read_manifest(weights)
+    relative = manifest.get("artifacts", {}).get("onnx")
+    if not relative:
+        raise RuntimeError(f"В манифесте {manifest_path(weights)} нет ONNX-модели, выполните экспорт в onnx")
+    source = manifest_path(weights).parent / relative
+    output = Path(output) if output else source.with_suffix(".int8.onnx")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Свертка констант и слияние BatchNorm до калибровки; вход динамический,
+        # поэтому символьный вывод размеров пропускается
+        prepared = Path(workdir) / "prepared.onnx"
+        quant_pre_process(str(source), str(prepared), skip_symbolic_shape=True)
+
+        model = onnx.load(str(prepared))
+        excluded = head_decode_nodes(model)
+        reader = LetterboxCalibrationReader(images, model.graph.input[0].name,
+                                            int(manifest.get("imgsz", DEFAULT_IMGSZ)))
+        logger.info(f"Квантование {source}: {len(images)} калибровочных страниц, "
+                    f"{len(excluded)} узлов головы в FP32")
+
+        quantize_static(
+            str(prepared), str(output), reader,
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=per_channel,
+            calibrate_method={
+                "minmax": CalibrationMethod.MinMax,
+                "entropy": CalibrationMethod.Entropy,
+                "percentile": CalibrationMethod.Percentile,
+            }[method],
+            nodes_to_exclude=excluded,
+        )
+    return output
@@ -0,0 +1,113 @@
+"""
+Пакетное распознавание текста в регионах полей без полного пайплайна Marker
+"""
+import re
+import inspect
+import logging
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+from .config import Config
+from .model_registry import get_model_registry
+
+logger = logging.getLogger(__name__)
+
+
+class RegionRecognizer:
+    """
+    Распознавание вырезанных регионов полей моделью распознавания текста Marker
+
+    Все регионы страницы (или пачки документов) отправляются в модель одним
+    вызовом, в памяти, без layout-этапа, рендеринга и записи на диск.
+    """
+
+    # Языки для версий surya, которые требуют явного списка языков
+    languages = ["ru", "en"]
+
+    def __init__(self, config: Config):
+        self.config = config
+
+    def _predictors(self):
+        """Модели распознавания и детекции строк из общего реестра"""
+        models = get_model_registry().get_models()
+        return models["recognition_model"], models.get("detection_model")
+
+    def _call_kwargs(self, recognition_model, count: int) -> Dict:
+        """Аргументы вызова, совместимые с установленной версией surya"""
+        params = inspect.signature(recognition_model.__call__).parameters
+        kwargs = {}
+        if "task_names" in params:
+            kwargs["task_names"] = ["ocr_with_boxes"] * count
+        if "langs" in params:
+            kwargs["langs"] = [self.languages] * count
+        if "recognition_batch_size" in params and self.config.region_ocr_batch_size:
+            kwargs["recognition_batch_size"] = self.config.region_ocr_batch_size
+        return kwargs
+
+    def recognize(self, images: List[Image.Image]) -> List[str]:
+        """
+        Распознавание списка изображений одним пакетным вызовом
+
+        Returns:
+            Список текстов в порядке входных изображений
+        """
+        if not images:
+            return []
+
+        recognition_model, detection_model = self._predictors()
+        images = [image.convert("RGB") for image in images]
+
+        predictions = recognition_model(
+            images,
+            det_predictor=detection_model,
+            **self._call_kwargs(recognition_model, len(images))
+        )
+
+        return [self._prediction_text(prediction) for prediction in predictions]
+
+    def recognize_regions(self, regions: Dict[str, Image.Image]) -> Dict[str, str]:
+        """
+        Распознавание регионов одной страницы
+
+        Returns:
+            Словарь {ключ поля: текст} для непустых результатов
+        """
+        return self.recognize_batch([regions])[0]
+
+    def recognize_batch(self, region_sets: List[Dict[str, Image.Image]]) -> List[Dict[str, str]]:
+        """
+        Распознавание регионов нескольких страниц или документов одним вызовом
+
+        Args:
+            region_sets: Список словарей {ключ поля: изображение}
+
+        Returns:
+            Список словарей {ключ поля: текст} в порядке входа
+        """
+        keys = []
+        images = []
+        for set_index, regions in enumerate(region_sets):
+            for field_key, image in regions.items():
+                keys.append((set_index, field_key))
+                images.append(image)
+
+        texts = self.recognize(images)
+
+        results: List[Dict[str, str]] = [{} for _ in region_sets]
+        for (set_index, field_key), text in zip(keys, texts):
+            if text:
+                results[set_index][field_key] = text
+
+        logger.info(f"Распознано регионов: {sum(len(r) for r in results)} из {len(images)}")
+        return results
+
+    @staticmethod
+    def _prediction_text(prediction) -> Optional[str]:
+        """Склейка строк результата распознавания в нормализованный текст"""
+        lines = [getattr(line, "text", "") or "" for line in getattr(prediction, "text_lines", [])]
+        text = " ".join(line.strip() for line in lines if line.strip())
+        # Новые версии surya размечают начертание HTML-тегами
+        text = re.sub(r"<[^>]+>", "", text)
+        text = re.sub(r"\s+", " ", text).strip()
+        return text or None
@@ -0,0 +1,202 @@
+"""
+Кэш результатов извлечения на диске с адресацией по содержимому файла
+"""
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Tuple
+
+from .config import Config
+from .metrics import CACHE_REQUESTS
+from .stage_cache import STAGE_VERSIONS
+
+logger = logging.getLogger(__name__)
+
+# Поля Config, не влияющие на результат извлечения (не входят в ключ кэша)
+NON_RESULT_FIELDS = {
+    "torch_device", "yolo_batch_size", "yolo_backend", "yolo_threads", "region_ocr_batch_size",
+    "save_debug_artifacts", "result_cache_dir", "result_cache_max_mb",
+    "stage_cache_dir", "stage_cache_stages", "trace_memory",
+}
+
+# Пакеты, от версий которых зависит распознанный текст
+MODEL_PACKAGES = ("marker-pdf", "surya-ocr", "ultralytics", "pymupdf")
+
+
+def file_sha256(path: Path, chunk_size: int = 1 << 20) -> str:
+    """SHA-256 содержимого файла (чтение порциями)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def model_versions(yolo_model_path: Optional[str] = None) -> Dict[str, str]:
+    """Версии пакетов моделей и отпечаток весов YOLO для ключа кэша"""
+    from importlib import metadata
+
+    versions = {}
+    for package in MODEL_PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = "absent"
+
+    if yolo_model_path and Path(yolo_model_path).exists():
+        stat = Path(yolo_model_path).stat()
+        versions["yolo_weights"] = f"{Path(yolo_model_path).name}:{stat.st_size}:{int(stat.st_mtime)}"
+    return versions
+
+
+class ResultCache:
+    """
+    Кэш результатов: ключ - SHA-256 файла плюс отпечаток конфигурации, моделей
+    и версий этапов (увеличение версии любого этапа делает записи недействительными)
+
+    Каждая запись - отдельный JSON-файл, записываемый атомарно (временный файл
+    и os.replace), поэтому каталог можно разделять между процессами пула и
+    контейнерами. Время последнего обращения хранится в mtime файла, при
+    превышении бюджета удаляются самые давно использованные записи.
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int, namespace: str):
+        """
+        Args:
+            cache_dir: Каталог кэша (например, temp/result_cache на томе ./temp)
+            max_bytes: Бюджет на размер всех записей
+            namespace: Отпечаток конфигурации и версий моделей
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.namespace = namespace
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        # Оценка занятого места; точный размер пересчитывается при вытеснении
+        self._approx_bytes = sum(size for _, size, _ in self._scan())
+
+    @classmethod
+    def from_config(cls, config: Config, pipeline: str = "marker",
+                    yolo_model_path: Optional[str] = None) -> Optional["ResultCache"]:
+        """Кэш по настройкам Config (None, если кэш выключен)"""
+        if not config.result_cache_dir:
+            return None
+
+        result_fields = [
+            f for f in config.fingerprint_fields() if f not in NON_RESULT_FIELDS
+        ]
+        payload = json.dumps({
+            "config": config.fingerprint(result_fields),
+            "pipeline": pipeline,
+            "models": model_versions(yolo_model_path),
+            "stages": STAGE_VERSIONS
+        }, sort_keys=True)
+        namespace = hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+        return cls(Path(config.result_cache_dir), config.result_cache_max_mb * 1024 * 1024, namespace)
+
+    def key(self, file_hash: str) -> str:
+        """Ключ записи для файла"""
+        return f"{file_hash}-{self.namespace}"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Запись из кэша (обновляет время обращения) или None"""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path)
+        except FileNotFoundError:
+            entry = None
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Поврежденная запись кэша {path.name}: {e}")
+            path.unlink(missing_ok=True)
+            entry = None
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        CACHE_REQUESTS.inc(cache="result", result="miss" if entry is None else "hit")
+        return entry
+
+    def put(self, key: str, entry: Dict[str, Any]):
+        """Атомарная запись в кэш с вытеснением при превышении бюджета"""
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = json.dumps(entry, ensure_ascii=False, default=str).encode("utf-8")
+
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_name, path)
+        except OSError as e:
+            logger.warning(f"Не удалось записать в кэш {path.name}: {e}")
+            Path(tmp_name).unlink(missing_ok=True)
+            return
+
+        with self._lock:
+            self.writes += 1
+            self._approx_bytes += len(data)
+            over_budget = self._approx_bytes > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def evict(self):
+        """Удаление давно использованных записей до 90% бюджета"""
+        entries = sorted(self._scan(), key=lambda item: item[2])
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+
+        evicted = 0
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            evicted += 1
+
+        with self._lock:
+            self.evictions += evicted
+            self._approx_bytes = total
+        if evicted:
+            logger.info(f"Из кэша вытеснено записей: {evicted}, занято {total / 2**20:.1f} МБ")
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики кэша текущего процесса"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "writes": self.writes,
+                "evictions": self.evictions,
+                "approx_bytes": self._approx_bytes,
+                "max_bytes": self.max_bytes
+            }
+
+    def _path(self, key: str) -> Path:
+        # Подкаталоги по первым символам хеша, чтобы не держать все записи в одном каталоге
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def _scan(self) -> List[Tuple[Path, int, float]]:
+        """Записи кэша: путь, размер, время последнего обращения"""
+        entries = []
+        for path in self.cache_dir.glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
@@ -0,0 +1,395 @@
+# src/service.py
+"""
+HTTP-сервис извлечения информации из накладных для интеграционного слоя
+
+Модели Marker/YOLO загружаются один раз при старте, документы обрабатываются
+фиксированным пулом потоков с ограничением очереди.
+
+Запуск:
+    python -m src.service --port 8080 --concurrency 2 --max-queue 16
+
+Эндпоинты:
+    GET  /healthz          - процесс жив и модели загружены (503 во время прогрева)
+    GET  /readyz           - сервис готов принять документ (модели прогреты, очередь не заполнена)
+    GET  /metrics          - метрики в текстовом формате Prometheus
+    POST /extract          - синхронная обработка, тело ответа - результат InvoiceParser и замеры этапов (timings)
+    POST /jobs             - асинхронная задача, ответ 202 с job_id
+    GET  /jobs/<job_id>    - статус задачи, события этапов (progress, events) и результат после завершения
+
+Документ передается телом запроса (application/octet-stream), имя файла -
+параметром ?filename=... или заголовком X-Filename (по расширению
+определяется тип: PDF или изображение).
+"""
+import sys
+import json
+import time
+import uuid
+import queue
+import logging
+import argparse
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Any, Optional, List
+from urllib.parse import urlparse, parse_qs
+
+from .config import Config
+from .batch import BatchPipeline, SUPPORTED_EXTENSIONS
+from .model_registry import get_model_registry
+from .result_cache import ResultCache
+from .stage_cache import StageCache
+from .progress import ProgressReporter
+from .metrics import IN_FLIGHT, QUEUE_DEPTH, send_metrics
+from .inference_backends import BACKENDS
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceBusy(Exception):
+    """Очередь обработки заполнена"""
+
+
+class ServiceNotReady(Exception):
+    """Модели еще не прогреты"""
+
+
+@dataclass
+class Job:
+    """Задача обработки одного документа"""
+
+    job_id: str
+    filename: str
+    status: str = "queued"  # queued, running, done, failed
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    events: List[Dict[str, Any]] = field(default_factory=list)
+    timings: Optional[Dict[str, Dict[str, float]]] = None
+    done_event: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "filename": self.filename,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "progress": self.events[-1] if self.events else None,
+            "events": list(self.events),
+            "result": self.result,
+            "timings": self.timings,
+            "error": self.error
+        }
+
+
+class ExtractionService:
+    """Прогретые конвейеры обработки, пул потоков и хранилище задач"""
+
+    def __init__(self, config: Config, concurrency: int = 1, max_queue: int = 16,
+                 use_yolo: bool = False, max_jobs: int = 1000):
+        """
+        Args:
+            config: Конфигурация обработки
+            concurrency: Количество документов, обрабатываемых одновременно
+            max_queue: Сколько документов может ждать сверх обрабатываемых (далее 429)
+            use_yolo: YOLO + Marker обработка
+            max_jobs: Сколько завершенных задач хранить для опроса
+        """
+        self.config = config
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.use_yolo = use_yolo
+        self.max_jobs = max_jobs
+
+        self.state = "starting"  # starting, ready, failed
+        self.state_error: Optional[str] = None
+
+        # Конвейеры выдаются потокам по одному: модели общие, конвертеры свои
+        self._pipelines: "queue.Queue[BatchPipeline]" = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="extract")
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._active = 0
+        self._cache: Optional[ResultCache] = None
+        self._stage_cache: Optional[StageCache] = None
+        self._yolo_backend: Optional[str] = None
+
+        IN_FLIGHT.set_function(lambda: min(self._active, self.concurrency))
+        QUEUE_DEPTH.set_function(lambda: max(0, self._active - self.concurrency))
+
+    def warm_up(self):
+        """Загрузка моделей и создание конвейеров; после успеха сервис готов"""
+        try:
+            start = time.perf_counter()
+            get_model_registry().get_models()
+            for _ in range(self.concurrency):
+                pipeline = BatchPipeline(self.config, self.use_yolo)
+                # Один экземпляр кэша на все конвейеры: общие счетчики попаданий
+                self._cache = self._cache or pipeline.cache
+                pipeline.cache = self._cache
+                self._stage_cache = self._stage_cache or pipeline.stage_cache
+                pipeline.stage_cache = pipeline.marker_runner.stage_cache = self._stage_cache
+                if pipeline.processor:
+                    self._yolo_backend = pipeline.processor.yolo_detector.backend_name
+                self._pipelines.put(pipeline)
+            self.state = "ready"
+            logger.info(f"Модели прогреты за {time.perf_counter() - start:.1f} с, "
+                        f"конвейеров: {self.concurrency}")
+        except Exception as e:
+            logger.exception("Ошибка прогрева моделей")
+            self.state = "failed"
+            self.state_error = str(e)
+
+    @property
+    def is_ready(self) -> bool:
+        return self.state == "ready"
+
+    @property
+    def has_capacity(self) -> bool:
+        return self._active < self.concurrency + self.max_queue
+
+    def submit(self, data: bytes, filename: str) -> Job:
+        """Постановка документа в очередь обработки"""
+        if not self.is_ready:
+            raise ServiceNotReady(self.state_error or "Модели еще загружаются")
+
+        suffix = Path(filename).suffix.lower()
+        if suffix not in SUPPORTED_EXTENSIONS:
+            raise ValueError(f"Неподдерживаемый формат файла: {filename}")
+
+        job = Job(job_id=uuid.uuid4().hex, filename=filename)
+        # События обработки доступны через GET /jobs/<job_id> по мере выполнения
+        reporter = ProgressReporter(lambda event: job.events.append(event.to_dict()), self.config.trace_memory)
+        with reporter.stage("save"):
+            with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+                tmp.write(data)
+        path = Path(tmp.name)
+
+        with self._lock:
+            if not self.has_capacity:
+                path.unlink(missing_ok=True)
+                raise ServiceBusy(f"Очередь заполнена ({self._active} документов в работе)")
+            self._active += 1
+
+            self._jobs[job.job_id] = job
+            self._evict_finished()
+
+        self._executor.submit(self._run, job, path, reporter)
+        return job
+
+    def get_job(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self) -> Dict[str, Any]:
+        """Состояние сервиса для health/ready"""
+        return {
+            "cache": self._cache.stats() if self._cache else None,
+            "stage_cache": self._stage_cache.stats() if self._stage_cache else None,
+            "status": self.state,
+            "error": self.state_error,
+            "active": self._active,
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "yolo_backend": self._yolo_backend,
+            "models": get_model_registry().stats()
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job: Job, path: Path, reporter: ProgressReporter):
+        """Обработка документа в потоке пула"""
+        job.status = "running"
+        job.started_at = time.time()
+        pipeline = self._pipelines.get()
+        try:
+            record = pipeline.process(path, reporter)
+            job.timings = record["timings"]
+            if record.get("error"):
+                job.status, job.error = "failed", record["error"]
+            else:
+                job.status, job.result = "done", record["result"]
+        except Exception as e:
+            logger.exception(f"Ошибка обработки задачи {job.job_id}")
+            job.status, job.error = "failed", str(e)
+        finally:
+            self._pipelines.put(pipeline)
+            path.unlink(missing_ok=True)
+            job.finished_at = time.time()
+            with self._lock:
+                self._active -= 1
+            job.done_event.set()
+
+    def _evict_finished(self):
+        """Удаление самых старых завершенных задач сверх max_jobs (под блокировкой)"""
+        excess = len(self._jobs) - self.max_jobs
+        for job_id in list(self._jobs):
+            if excess <= 0:
+                break
+            if self._jobs[job_id].done_event.is_set():
+                del self._jobs[job_id]
+                excess -= 1
+
+
+class ExtractionRequestHandler(BaseHTTPRequestHandler):
+    """Маршрутизация HTTP-запросов к ExtractionService"""
+
+    service: ExtractionService = None
+    max_upload_bytes: int = 50 * 1024 * 1024
+    sync_timeout: float = 300.0
+
+    def do_GET(self):
+        path = urlparse(self.path).path.rstrip("/")
+
+        if path == "/healthz":
+            status = self.service.status()
+            code = {"ready": HTTPStatus.OK, "failed": HTTPStatus.INTERNAL_SERVER_ERROR}.get(
+                self.service.state, HTTPStatus.SERVICE_UNAVAILABLE
+            )
+            self._send_json(code, status)
+        elif path == "/readyz":
+            ready = self.service.is_ready and self.service.has_capacity
+            self._send_json(HTTPStatus.OK if ready else HTTPStatus.SERVICE_UNAVAILABLE,
+                            {"ready": ready, **self.service.status()})
+        elif path == "/metrics":
+            send_metrics(self)
+        elif path.startswith("/jobs/"):
+            job = self.service.get_job(path[len("/jobs/"):])
+            if job is None:
+                self._send_json(HTTPStatus.NOT_FOUND, {"error": "Задача не найдена"})
+            else:
+                self._send_json(HTTPStatus.OK, job.to_dict())
+        else:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "Неизвестный путь"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        path = url.path.rstrip("/")
+        if path not in ("/extract", "/jobs"):
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "Неизвестный путь"})
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0:
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": "Пустое тело запроса"})
+            return
+        if length > self.max_upload_bytes:
+            self._send_json(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": "Файл слишком большой"})
+            return
+
+        data = self.rfile.read(length)
+        filename = (parse_qs(url.query).get("filename") or [self.headers.get("X-Filename") or "document.pdf"])[0]
+
+        try:
+            job = self.service.submit(data, Path(filename).name)
+        except ServiceNotReady as e:
+            self._send_json(HTTPStatus.SERVICE_UNAVAILABLE, {"error": str(e)})
+            return
+        except ServiceBusy as e:
+            self._send_json(HTTPStatus.TOO_MANY_REQUESTS, {"error": str(e)}, {"Retry-After": "5"})
+            return
+        except ValueError as e:
+            self._send_json(HTTPStatus.UNSUPPORTED_MEDIA_TYPE, {"error": str(e)})
+            return
+
+        if path == "/jobs":
+            self._send_json(HTTPStatus.ACCEPTED, job.to_dict(), {"Location": f"/jobs/{job.job_id}"})
+            return
+
+        # Синхронный режим: ждем завершения задачи
+        if not job.done_event.wait(self.sync_timeout):
+            self._send_json(HTTPStatus.GATEWAY_TIMEOUT, job.to_dict(), {"Location": f"/jobs/{job.job_id}"})
+        elif job.status == "done":
+            self._send_json(HTTPStatus.OK, {**job.result, "timings": job.timings}, {"X-Job-Id": job.job_id})
+        else:
+            self._send_json(HTTPStatus.UNPROCESSABLE_ENTITY, {"error": job.error}, {"X-Job-Id": job.job_id})
+
+    def _send_json(self, code: int, payload: Any, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.info("%s - %s", self.address_string(), format % args)
+
+
+def create_server(service: ExtractionService, host: str = "0.0.0.0", port: int = 8080,
+                  max_upload_mb: int = 50, sync_timeout: float = 300.0) -> ThreadingHTTPServer:
+    """HTTP-сервер поверх сервиса (прогрев запускается отдельно)"""
+    handler = type("Handler", (ExtractionRequestHandler,), {
+        "service": service,
+        "max_upload_bytes": max_upload_mb * 1024 * 1024,
+        "sync_timeout": sync_timeout
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    arg_parser = argparse.ArgumentParser(
+        prog="python -m src.service",
+        description="HTTP-сервис извлечения информации из накладных"
+    )
+    arg_parser.add_argument("--host", default="0.0.0.0")
+    arg_parser.add_argument("--port", type=int, default=8080)
+    arg_parser.add_argument("--concurrency", type=int, default=1,
+                            help="Документов в обработке одновременно")
+    arg_parser.add_argument("--max-queue", type=int, default=16,
+                            help="Документов в ожидании сверх обрабатываемых (далее 429)")
+    arg_parser.add_argument("--max-upload-mb", type=int, default=50)
+    arg_parser.add_argument("--sync-timeout", type=float, default=300.0,
+                            help="Сколько секунд /extract ждет результата")
+    arg_parser.add_argument("--yolo", action="store_true", help="YOLO + Marker обработка")
+    arg_parser.add_argument("--yolo-backend", default="auto", choices=("auto",) + BACKENDS,
+                            help="Бэкенд инференса YOLO на CPU")
+    arg_parser.add_argument("--yolo-threads", type=int, help="Потоков инференса YOLO")
+    arg_parser.add_argument("--output-format", default="markdown", choices=["markdown", "json", "html"])
+    arg_parser.add_argument("--force-ocr", action="store_true", help="OCR даже для страниц с текстовым слоем")
+    arg_parser.add_argument("--trace-memory", action="store_true",
+                            help="Пик памяти Python по этапам через tracemalloc (медленнее)")
+    arg_parser.add_argument("--debug", action="store_true", help="Подробное логирование")
+    args = arg_parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.debug else logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+
+    config = Config(output_format=args.output_format, force_ocr=args.force_ocr,
+                    debug_mode=args.debug, trace_memory=args.trace_memory,
+                    yolo_backend=args.yolo_backend, yolo_threads=args.yolo_threads)
+    service = ExtractionService(config, concurrency=args.concurrency,
+                                max_queue=args.max_queue, use_yolo=args.yolo)
+    server = create_server(service, args.host, args.port, args.max_upload_mb, args.sync_timeout)
+
+    # Сервер отвечает на /healthz и /readyz (503) уже во время прогрева моделей
+    threading.Thread(target=service.warm_up, name="warm-up", daemon=True).start()
+    logger.info(f"Сервис слушает http://{args.host}:{args.port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+"""
+Мемоизация этапов конвейера: растеризация, детекция, OCR, распознавание регионов, парсинг
+"""
+import os
+import json
+import zlib
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Any, Optional, Callable, Iterable
+
+from .config import Config
+from .patterns import PATTERN_FIELDS
+from .metrics import CACHE_REQUESTS
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Версии этапов: увеличение версии пересчитывает этап и все этапы после него.
+# Растры страниц не сохраняются (повторная растеризация дешевле чтения пикселей
+# из архива), но версия растеризации входит в ключи детекции
+STAGE_VERSIONS = {
+    "rasterize": 1,
+    "detect": 3,
+    "ocr": 2,
+    "region_ocr": 2,
+    "parse": 1,
+}
+
+# Настройки Config, влияющие на результат каждого этапа
+STAGE_CONFIG_FIELDS = {
+    "rasterize": ("render_scale", "dual_resolution"),
+    "detect": (
+        "template_min_confidence", "force_ocr", "use_text_layer", "text_layer_min_chars",
+        "text_layer_min_valid_ratio", "text_layer_min_label_hits", "text_layer_labels",
+    ),
+    "ocr": (
+        "output_format", "force_ocr", "use_text_layer", "text_layer_min_chars",
+        "text_layer_min_valid_ratio", "text_layer_min_label_hits", "text_layer_labels",
+    ),
+    "region_ocr": ("render_scale", "dual_resolution", "field_render_scales"),
+    "parse": PATTERN_FIELDS + ("max_lines_section", "label_search_window", "debug_mode"),
+}
+
+# Пакеты, от версий которых зависит результат этапа
+STAGE_MODEL_PACKAGES = {
+    "rasterize": ("pymupdf",),
+    "detect": ("ultralytics",),
+    "ocr": ("marker-pdf", "surya-ocr", "pymupdf"),
+    "region_ocr": ("surya-ocr",),
+    "parse": (),
+}
+
+
+class StageCache:
+    """
+    Сжатый архив результатов этапов
+
+    Ключ этапа - хеш версии этапа, его среза Config и ключей входных этапов
+    (для первых этапов - SHA-256 файла). Поэтому изменение версии или
+    настроек этапа меняет ключи только этого этапа и этапов после него:
+    после правки паттернов парсера пересчитывается только парсинг.
+
+    Записи сжимаются zstd (если установлен zstandard), иначе zlib; читаются
+    оба формата. Без каталога кэш работает как прозрачная обертка.
+    """
+
+    def __init__(self, cache_dir: Optional[Path], stages: Iterable[str] = ()):
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.stages = set(stages) if self.cache_dir else set()
+        self._lock = threading.Lock()
+        self.hits: Dict[str, int] = defaultdict(int)
+        self.misses: Dict[str, int] = defaultdict(int)
+        self._versions: Optional[Dict[str, str]] = None
+
+    @classmethod
+    def from_config(cls, config: Config) -> "StageCache":
+        return cls(config.stage_cache_dir, config.stage_cache_stages)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.stages)
+
+    def input_key(self, path: Path) -> str:
+        """Ключ входного файла (SHA-256 содержимого); пустой, если кэш выключен"""
+        if not self.enabled:
+            return ""
+        from .result_cache import file_sha256
+        return file_sha256(path)
+
+    def key(self, stage: str, config: Config, *upstream: str) -> str:
+        """Ключ этапа по его версии, срезу Config, версиям пакетов и ключам входов"""
+        if not self.enabled:
+            return ""
+        if self._versions is None:
+            from .result_cache import model_versions
+            self._versions = model_versions()
+        payload = json.dumps({
+            "stage": stage,
+            "version": STAGE_VERSIONS[stage],
+            "config": config.fingerprint(STAGE_CONFIG_FIELDS[stage]),
+            "packages": {name: self._versions.get(name) for name in STAGE_MODEL_PACKAGES[stage]},
+            "upstream": upstream
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+    def memoize(self, stage: str, key: str, compute: Callable[[], Any],
+                encode: Optional[Callable[[Any], Any]] = None,
+                decode: Optional[Callable[[Any], Any]] = None,
+                should_cache: Optional[Callable[[Any], bool]] = None) -> Any:
+        """
+        Результат этапа из архива или вычисленный и сохраненный
+
+        Args:
+            stage: Имя этапа
+            key: Ключ этапа (StageCache.key)
+            compute: Вычисление этапа
+            encode: Преобразование результата в JSON-совместимое значение
+            decode: Обратное преобразование при чтении из архива
+            should_cache: Проверка результата перед записью: заглушки после сбоя
+                (пустые детекции, результат с ошибкой) в архив не пишутся,
+                иначе временный сбой повторялся бы при каждом чтении
+        """
+        if stage not in self.stages or not key:
+            return compute()
+
+        stored = self._read(stage, key)
+        if stored is not None:
+            with self._lock:
+                self.hits[stage] += 1
+            CACHE_REQUESTS.inc(cache=stage, result="hit")
+            return decode(stored) if decode else stored
+
+        with self._lock:
+            self.misses[stage] += 1
+        CACHE_REQUESTS.inc(cache=stage, result="miss")
+        value = compute()
+        if should_cache is None or should_cache(value):
+            self._write(stage, key, encode(value) if encode else value)
+        else:
+            logger.warning(f"Результат этапа {stage} получен со сбоем и в архив не записан")
+        return value
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Попадания и промахи по этапам"""
+        with self._lock:
+            return {
+                stage: {"hits": self.hits[stage], "misses": self.misses[stage]}
+                for stage in STAGE_VERSIONS if stage in self.stages
+            }
+
+    def _path(self, stage: str, key: str, suffix: str) -> Path:
+        return self.cache_dir / stage / key[:2] / f"{key}{suffix}"
+
+    def _read(self, stage: str, key: str) -> Optional[Any]:
+        for suffix in (".json.zst", ".json.z"):
+            path = self._path(stage, key, suffix)
+            if not path.exists():
+                continue
+            try:
+                data = path.read_bytes()
+                if suffix == ".json.zst":
+                    if not ZSTD_AVAILABLE:
+                        continue
+                    data = zstandard.ZstdDecompressor().decompress(data)
+                else:
+                    data = zlib.decompress(data)
+                return json.loads(data)
+            except Exception as e:
+                logger.warning(f"Поврежденная запись этапа {stage} {path.name}: {e}")
+        return None
+
+    def _write(self, stage: str, key: str, value: Any):
+        data = json.dumps(value, ensure_ascii=False, default=str).encode("utf-8")
+        if ZSTD_AVAILABLE:
+            data, suffix = zstandard.ZstdCompressor(level=10).compress(data), ".json.zst"
+        else:
+            data, suffix = zlib.compress(data, 6), ".json.z"
+
+        path = self._path(stage, key, suffix)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_name, path)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить результат этапа {stage}: {e}")
+            Path(tmp_name).unlink(missing_ok=True)
@@ -0,0 +1,470 @@
+"""
+Шаблоны форм фиксированной разметки (ТН-2025): поиск полей без YOLO
+
+Шаблон страницы хранит боксы полей в пунктах PDF, опорные слова формы
+(уникальные на странице слова и их положение) и уменьшенный растр эталонной
+страницы. Страница документа совмещается с шаблоном по опорным словам
+текстового слоя, а для сканов - по ключевым точкам ORB; поворот, масштаб и
+сдвиг оцениваются RANSAC. Если доля согласованных точек не ниже порога, боксы
+шаблона переносятся на страницу и YOLO для нее не запускается.
+
+Создание шаблона:
+    python -m src.templates build data/Obrazets-zapolneniya-TN-2025-2.pdf --page 1 --name tn-2025-p1 \\
+        --reference data/Obrazets-zapolneniya-TN-2025-2-2.pdf
+    python -m src.templates match data/Obrazets-zapolneniya-TN-2025-2-2.pdf
+"""
+import sys
+import json
+import math
+import hashlib
+import logging
+import argparse
+import threading
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from .config import Config
+from .page_image import PageImage
+from .text_layer import PageTextLayer, Word, page_words
+
+logger = logging.getLogger(__name__)
+
+# Опорные слова: только буквенные, не короче 4 символов и единственные на странице
+ANCHOR_MIN_LENGTH = 4
+
+# Длинная сторона эталонного растра и страницы при совмещении по ключевым точкам
+REFERENCE_IMAGE_SIZE = 640
+ORB_FEATURES = 2000
+ORB_RATIO = 0.8  # тест отношения расстояний Лоу
+
+# Допуск RANSAC: пунктов PDF для слов, пикселей растра для ключевых точек
+ANCHOR_TOLERANCE = 6.0
+FEATURE_TOLERANCE = 4.0
+
+# Совмещение отклоняется при малом числе точек и неправдоподобном преобразовании
+MIN_INLIERS = 12
+SCALE_RANGE = (0.8, 1.25)
+MAX_ROTATION_DEGREES = 3.0
+MAX_ASPECT_DIFFERENCE = 0.05
+
+
+@dataclass
+class TemplateField:
+    """Поле шаблона: тип, класс YOLO и бокс в пунктах PDF"""
+
+    field_type: str
+    class_id: int
+    bbox: Tuple[float, float, float, float]
+
+
+@dataclass
+class PageTemplate:
+    """Разметка одной страницы формы"""
+
+    name: str
+    width: float
+    height: float
+    fields: List[TemplateField] = field(default_factory=list)
+    anchors: Dict[str, Tuple[float, float]] = field(default_factory=dict)
+    image: Optional[np.ndarray] = None  # эталонный растр в оттенках серого
+    image_scale: float = 1.0  # пикселей эталонного растра на пункт
+    source: str = ""
+    _features: Any = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "source": self.source,
+            "width": self.width,
+            "height": self.height,
+            "fields": [
+                {"field_type": f.field_type, "class_id": f.class_id, "bbox": [round(v, 2) for v in f.bbox]}
+                for f in self.fields
+            ],
+            "anchors": {word: [round(x, 2), round(y, 2)] for word, (x, y) in self.anchors.items()},
+            "image": f"{self.name}.png" if self.image is not None else None,
+            "image_scale": self.image_scale,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], directory: Path) -> "PageTemplate":
+        image = None
+        if data.get("image"):
+            image = cv2.imread(str(directory / data["image"]), cv2.IMREAD_GRAYSCALE)
+        return cls(
+            name=data["name"],
+            source=data.get("source", ""),
+            width=float(data["width"]),
+            height=float(data["height"]),
+            fields=[TemplateField(f["field_type"], int(f["class_id"]), tuple(f["bbox"])) for f in data["fields"]],
+            anchors={word: tuple(point) for word, point in data.get("anchors", {}).items()},
+            image=image,
+            image_scale=float(data.get("image_scale", 1.0)),
+        )
+
+    def features(self):
+        """Ключевые точки и дескрипторы ORB эталонного растра (вычисляются один раз)"""
+        if self._features is None:
+            self._features = _orb().detectAndCompute(self.image, None)
+        return self._features
+
+
+@dataclass
+class TemplateMatch:
+    """Результат совмещения страницы с шаблоном"""
+
+    template: PageTemplate
+    method: str  # anchors (текстовый слой) или features (ключевые точки)
+    confidence: float  # доля согласованных точек
+    inliers: int
+    transform: Optional[np.ndarray] = None  # 2x3: пункты шаблона -> пункты страницы
+    accepted: bool = False
+
+    def page_boxes(self, page: PageImage) -> np.ndarray:
+        """
+        Боксы полей [x1, y1, x2, y2, confidence, class] в пикселях страницы
+
+        Уверенность бокса - 1.0: поля заданы разметкой шаблона, а уверенность
+        совмещения отражается в summary().
+        """
+        rows = []
+        width, height = page.width / page.scale, page.height / page.scale
+        for template_field in self.template.fields:
+            x1, y1, x2, y2 = template_field.bbox
+            corners = np.array([[x1, y1, 1], [x2, y1, 1], [x1, y2, 1], [x2, y2, 1]]) @ self.transform.T
+            left, top = np.clip(corners.min(axis=0), 0, [width, height])
+            right, bottom = np.clip(corners.max(axis=0), 0, [width, height])
+            if right > left and bottom > top:
+                rows.append([left * page.scale, top * page.scale, right * page.scale, bottom * page.scale,
+                             1.0, template_field.class_id])
+        return np.array(rows, dtype=np.float32).reshape(-1, 6)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "path": "template" if self.accepted else "yolo",
+            "template": self.template.name,
+            "method": self.method,
+            "confidence": round(self.confidence, 3),
+            "inliers": self.inliers,
+        }
+
+
+def _orb():
+    return cv2.ORB_create(ORB_FEATURES)
+
+
+def anchor_words(words: List[Word]) -> Dict[str, Tuple[float, float]]:
+    """Уникальные на странице слова -> левый верхний угол (пункты PDF)"""
+    counts = Counter(word[4].lower() for word in words)
+    return {
+        word[4].lower(): (word[0], word[1])
+        for word in words
+        if counts[word[4].lower()] == 1 and len(word[4]) >= ANCHOR_MIN_LENGTH and word[4].isalpha()
+    }
+
+
+def _plausible(transform: Optional[np.ndarray]) -> bool:
+    """Масштаб и поворот близки к тождественным (та же форма, а не случайное совпадение)"""
+    if transform is None:
+        return False
+    scale = math.sqrt(abs(np.linalg.det(transform[:, :2])))
+    rotation = math.degrees(math.atan2(transform[1, 0], transform[0, 0]))
+    return SCALE_RANGE[0] <= scale <= SCALE_RANGE[1] and abs(rotation) <= MAX_ROTATION_DEGREES
+
+
+def _fit(source: np.ndarray, target: np.ndarray, tolerance: float) -> Tuple[Optional[np.ndarray], int]:
+    """Поворот, масштаб и сдвиг по парам точек (RANSAC) и число согласованных пар"""
+    if len(source) < MIN_INLIERS:
+        return None, 0
+    transform, inliers = cv2.estimateAffinePartial2D(
+        source.astype(np.float32), target.astype(np.float32),
+        method=cv2.RANSAC, ransacReprojThreshold=tolerance
+    )
+    if transform is None or not _plausible(transform):
+        return None, 0
+    return transform, int(inliers.sum())
+
+
+def register_anchors(template: PageTemplate, layer: PageTextLayer) -> TemplateMatch:
+    """Совмещение по опорным словам текстового слоя"""
+    words = anchor_words(layer.words)
+    common = [word for word in template.anchors if word in words]
+    transform, inliers = _fit(
+        np.array([template.anchors[word] for word in common]).reshape(-1, 2),
+        np.array([words[word] for word in common]).reshape(-1, 2),
+        ANCHOR_TOLERANCE
+    )
+    confidence = inliers / len(template.anchors) if transform is not None else 0.0
+    return TemplateMatch(template, "anchors", confidence, inliers, transform)
+
+
+def register_features(template: PageTemplate, page: PageImage) -> TemplateMatch:
+    """Совмещение по ключевым точкам ORB (страницы без текстового слоя)"""
+    factor = REFERENCE_IMAGE_SIZE / max(page.width, page.height)
+    gray = cv2.cvtColor(page.array, cv2.COLOR_RGB2GRAY)
+    gray = cv2.resize(gray, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+
+    template_points, template_descriptors = template.features()
+    page_points, page_descriptors = _orb().detectAndCompute(gray, None)
+    if template_descriptors is None or page_descriptors is None:
+        return TemplateMatch(template, "features", 0.0, 0)
+
+    matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+    good = [
+        pair[0] for pair in matcher.knnMatch(template_descriptors, page_descriptors, k=2)
+        if len(pair) == 2 and pair[0].distance < ORB_RATIO * pair[1].distance
+    ]
+    transform, inliers = _fit(
+        np.array([template_points[m.queryIdx].pt for m in good]).reshape(-1, 2),
+        np.array([page_points[m.trainIdx].pt for m in good]).reshape(-1, 2),
+        FEATURE_TOLERANCE
+    )
+    if transform is None:
+        return TemplateMatch(template, "features", 0.0, 0)
+
+    # Пиксели растров -> пункты: шаблон (image_scale) и страница (page.scale * factor)
+    to_pixels = np.diag([template.image_scale, template.image_scale, 1.0])
+    to_points = np.diag([1 / (page.scale * factor), 1 / (page.scale * factor), 1.0])
+    transform = (to_points @ np.vstack([transform, [0, 0, 1]]) @ to_pixels)[:2]
+    return TemplateMatch(template, "features", inliers / len(good), inliers, transform)
+
+
+class TemplateRegistry:
+    """Шаблоны каталога templates_dir (<имя>.json и эталонный растр <имя>.png)"""
+
+    def __init__(self, directory: Optional[str], min_confidence: float = 0.3):
+        self.directory = Path(directory) if directory else None
+        self.min_confidence = min_confidence
+        self.templates: List[PageTemplate] = []
+        self.fingerprint = ""
+        self.load()
+
+    def load(self):
+        """Чтение шаблонов; отпечаток содержимого входит в ключи кэшей детекции"""
+        self.templates = []
+        digest = hashlib.sha256()
+        if self.directory and self.directory.is_dir():
+            for path in sorted(self.directory.glob("*.json")):
+                try:
+                    data = json.loads(path.read_text(encoding="utf-8"))
+                    self.templates.append(PageTemplate.from_dict(data, self.directory))
+                except (OSError, ValueError, KeyError) as e:
+                    logger.warning(f"Шаблон {path} не загружен: {e}")
+                    continue
+                digest.update(path.read_bytes())
+                image = self.directory / (data.get("image") or "")
+                if image.is_file():
+                    digest.update(image.read_bytes())
+        self.fingerprint = digest.hexdigest()[:16] if self.templates else ""
+        if self.templates:
+            logger.info(f"Загружено шаблонов форм: {len(self.templates)}")
+
+    def __bool__(self) -> bool:
+        return bool(self.templates)
+
+    def match(self, page: PageImage, layer: Optional[PageTextLayer] = None) -> Optional[TemplateMatch]:
+        """
+        Лучшее совмещение страницы с шаблонами
+
+        По текстовому слою, если он пригоден, иначе по ключевым точкам растра.
+        Returns:
+            TemplateMatch (accepted - уверенность не ниже порога) или None, если
+            ни один шаблон не подходит по пропорциям страницы
+        """
+        aspect = page.width / page.height
+        best = None
+        for template in self.templates:
+            if abs(aspect - template.width / template.height) > MAX_ASPECT_DIFFERENCE:
+                continue
+            if layer is not None and layer.usable and template.anchors:
+                match = register_anchors(template, layer)
+            elif template.image is not None:
+                match = register_features(template, page)
+            else:
+                continue
+            if best is None or match.confidence > best.confidence:
+                best = match
+        if best is not None:
+            best.accepted = best.transform is not None and best.confidence >= self.min_confidence
+        return best
+
+    def save(self, template: PageTemplate) -> Path:
+        """Запись шаблона в каталог реестра"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{template.name}.json"
+        if template.image is not None:
+            cv2.imwrite(str(self.directory / f"{template.name}.png"), template.image)
+        path.write_text(json.dumps(template.to_dict(), ensure_ascii=False, indent=2), encoding="utf-8")
+        self.load()
+        return path
+
+
+_registries: Dict[Tuple[str, float], TemplateRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_template_registry(config: Config) -> TemplateRegistry:
+    """Общий реестр шаблонов для каталога и порога из конфигурации"""
+    key = (str(config.templates_dir), config.template_min_confidence)
+    registry = _registries.get(key)
+    if registry is None:
+        with _registries_lock:
+            registry = _registries.get(key)
+            if registry is None:
+                registry = _registries[key] = TemplateRegistry(config.templates_dir, config.template_min_confidence)
+    return registry
+
+
+def _render_reference(page) -> Tuple[np.ndarray, float]:
+    """Эталонный растр страницы PyMuPDF в оттенках серого"""
+    import fitz  # PyMuPDF
+    scale = REFERENCE_IMAGE_SIZE / max(page.rect.width, page.rect.height)
+    pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), colorspace=fitz.csGRAY, alpha=False)
+    image = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+    return image.copy(), scale
+
+
+def _detect_template_fields(page, model_path: Optional[str]) -> List[TemplateField]:
+    """Поля эталонной страницы по YOLO (боксы переводятся в пункты)"""
+    import fitz  # PyMuPDF
+    from .yolo_detector import YoloFieldDetector
+
+    detector = YoloFieldDetector(model_path)
+    if not detector.is_available():
+        raise RuntimeError("YOLO недоступен: укажите --model или --fields")
+    scale = detector.input_size / max(page.rect.width, page.rect.height)
+    pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), colorspace=fitz.csRGB, alpha=False)
+    detection = detector.detect(PageImage.from_pixmap(pix, page_index=page.number, scale=scale))
+    return [
+        TemplateField(f["field_type"], f["class_id"],
+                      (f["bbox"]["x1"] / scale, f["bbox"]["y1"] / scale, f["bbox"]["x2"] / scale, f["bbox"]["y2"] / scale))
+        for f in detection.fields
+    ]
+
+
+def build_template(pdf_path: Path, page_index: int, name: str, fields: Optional[List[TemplateField]] = None,
+                   references: Optional[List[Path]] = None, model_path: Optional[str] = None) -> PageTemplate:
+    """
+    Шаблон по эталонной странице PDF
+
+    Args:
+        pdf_path: Эталонный документ с текстовым слоем
+        page_index: Номер страницы (с нуля)
+        name: Имя шаблона
+        fields: Боксы полей в пунктах (None - детекция YOLO на эталонной странице)
+        references: Другие заполненные экземпляры формы: опорными остаются только
+            слова, совпавшие с ними по положению (напечатанный текст формы, а не
+            заполненные значения)
+        model_path: Веса YOLO для детекции полей
+    """
+    import fitz  # PyMuPDF
+
+    with fitz.open(pdf_path) as document:
+        page = document.load_page(page_index)
+        words = page_words(page)
+        image, image_scale = _render_reference(page)
+        template = PageTemplate(
+            name=name,
+            source=f"{Path(pdf_path).name}:{page_index + 1}",
+            width=page.rect.width,
+            height=page.rect.height,
+            fields=fields if fields is not None else _detect_template_fields(page, model_path),
+            anchors=anchor_words(words),
+            image=image,
+            image_scale=image_scale,
+        )
+
+    for reference in references or []:
+        with fitz.open(reference) as document:
+            # Лучше всего совпадающая страница экземпляра
+            best_anchors, best_inliers = None, 0
+            for page in document:
+                layer = PageTextLayer(page.number, "", page_words(page))
+                match = register_anchors(template, layer)
+                if match.transform is not None and match.inliers > best_inliers:
+                    found = anchor_words(layer.words)
+                    projected = {
+                        word: np.array([*point, 1.0]) @ match.transform.T for word, point in template.anchors.items()
+                    }
+                    best_anchors = {
+                        word: point for word, point in template.anchors.items()
+                        if word in found and np.abs(projected[word] - found[word]).max() <= ANCHOR_TOLERANCE
+                    }
+                    best_inliers = match.inliers
+            if best_anchors is None:
+                logger.warning(f"Эталон {reference} не совмещен с шаблоном {name}, пропущен")
+                continue
+            template.anchors = best_anchors
+            logger.info(f"{reference}: опорных слов осталось {len(best_anchors)}")
+
+    if len(template.anchors) < MIN_INLIERS:
+        logger.warning(f"Шаблон {name}: мало опорных слов ({len(template.anchors)}), "
+                       f"совмещение будет идти по ключевым точкам")
+    return template
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    arg_parser = argparse.ArgumentParser(description="Шаблоны форм фиксированной разметки")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="Шаблон по эталонной странице PDF")
+    build.add_argument("pdf", type=Path)
+    build.add_argument("--page", type=int, default=1, help="Номер страницы (с единицы)")
+    build.add_argument("--name", required=True)
+    build.add_argument("--reference", type=Path, nargs="*", default=[],
+                       help="Другие экземпляры формы для отбора опорных слов")
+    build.add_argument("--fields", type=Path,
+                       help="JSON со списком полей {field_type, class_id, bbox: [x1, y1, x2, y2] в пунктах}")
+    build.add_argument("--model", help="Веса YOLO для детекции полей эталона")
+
+    match = commands.add_parser("match", help="Совмещение страниц документа с шаблонами")
+    match.add_argument("pdf", type=Path)
+    match.add_argument("--scan", action="store_true", help="Без текстового слоя (по ключевым точкам)")
+
+    for command in (build, match):
+        command.add_argument("--templates-dir", default=Config.templates_dir)
+        command.add_argument("--min-confidence", type=float, default=Config.template_min_confidence)
+
+    args = arg_parser.parse_args(argv)
+    registry = TemplateRegistry(args.templates_dir, args.min_confidence)
+
+    if args.command == "build":
+        fields = None
+        if args.fields:
+            fields = [
+                TemplateField(f["field_type"], int(f["class_id"]), tuple(f["bbox"]))
+                for f in json.loads(args.fields.read_text(encoding="utf-8"))
+            ]
+        template = build_template(args.pdf, args.page - 1, args.name, fields, args.reference, args.model)
+        path = registry.save(template)
+        print(f"💾 Шаблон {path}: полей {len(template.fields)}, опорных слов {len(template.anchors)}")
+        return 0
+
+    import fitz  # PyMuPDF
+    config = Config(templates_dir=args.templates_dir)
+    from .text_layer import TextLayerInspector
+    layers = [] if args.scan else TextLayerInspector(config).inspect(args.pdf)
+    with fitz.open(args.pdf) as document:
+        for page in document:
+            scale = REFERENCE_IMAGE_SIZE / max(page.rect.width, page.rect.height)
+            pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), colorspace=fitz.csRGB, alpha=False)
+            image = PageImage.from_pixmap(pix, page_index=page.number, scale=scale)
+            layer = layers[page.number] if page.number < len(layers) else None
+            result = registry.match(image, layer)
+            if result is None:
+                print(f"стр. {page.number + 1}: нет подходящего шаблона -> yolo")
+            else:
+                summary = result.summary()
+                print(f"стр. {page.number + 1}: {summary['template']} ({summary['method']}), "
+                      f"уверенность {summary['confidence']}, точек {summary['inliers']} -> {summary['path']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""
+Анализ текстового слоя PDF: быстрый путь без OCR для born-digital документов
+"""
+import re
+import logging
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Dict, Any, Tuple
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+# Символы, ожидаемые в текстовом слое накладной: кириллица, латиница, цифры, пунктуация
+_VALID_CHARS = re.compile(r"[А-Яа-яЁёA-Za-z0-9\s.,;:!?№%\"'«»()\[\]{}\-–—/\\+*=<>_|@#&$^~`]")
+
+Word = Tuple[float, float, float, float, str]
+
+
+def page_words(page, sort: bool = False) -> List[Word]:
+    """
+    Слова страницы PyMuPDF с боксами в пунктах
+
+    Боксы переводятся в систему координат страницы с учетом /Rotate,
+    как у растра страницы, на котором ищутся поля.
+    """
+    import fitz  # PyMuPDF
+
+    words = []
+    for w in page.get_text("words", sort=sort):
+        rect = fitz.Rect(w[:4]) * page.rotation_matrix
+        words.append((rect.x0, rect.y0, rect.x1, rect.y1, w[4]))
+    return words
+
+
+@dataclass
+class PageTextLayer:
+    """Текстовый слой одной страницы PDF"""
+
+    page_index: int
+    text: str
+    words: List[Word] = field(default_factory=list)
+    char_count: int = 0
+    valid_ratio: float = 0.0
+    labels_found: List[str] = field(default_factory=list)
+    usable: bool = False
+
+    def text_in_box(self, x1: float, y1: float, x2: float, y2: float) -> str:
+        """Слова, центр которых попадает в прямоугольник (в пунктах PDF), в порядке чтения"""
+        selected = [
+            word for word in self.words
+            if x1 <= (word[0] + word[2]) / 2 <= x2 and y1 <= (word[1] + word[3]) / 2 <= y2
+        ]
+        return " ".join(word[4] for word in selected)
+
+    def stats(self) -> Dict[str, Any]:
+        """Показатели качества слоя для отчета"""
+        return {
+            "char_count": self.char_count,
+            "valid_ratio": round(self.valid_ratio, 4),
+            "labels_found": self.labels_found,
+            "usable": self.usable
+        }
+
+
+class TextLayerInspector:
+    """Проверка пригодности текстового слоя PDF вместо OCR"""
+
+    def __init__(self, config: Config):
+        self.config = config
+
+    def is_enabled(self) -> bool:
+        """Быстрый путь включен, если OCR не принудительный"""
+        return self.config.use_text_layer and not self.config.force_ocr
+
+    def inspect(self, pdf_path: Path) -> List[PageTextLayer]:
+        """
+        Чтение и оценка текстового слоя каждой страницы
+
+        Страница пригодна, если в ней достаточно символов, символы выглядят
+        корректно и в документе в целом встречаются ожидаемые метки
+        (защита от слоя с битой кодировкой шрифтов).
+
+        Returns:
+            Список PageTextLayer по страницам (пустой, если PyMuPDF недоступен)
+        """
+        try:
+            import fitz  # PyMuPDF
+        except ImportError:
+            logger.warning("PyMuPDF не установлен, текстовый слой не используется")
+            return []
+
+        layers = []
+        try:
+            with fitz.open(pdf_path) as pdf_document:
+                for page_num in range(len(pdf_document)):
+                    page = pdf_document.load_page(page_num)
+                    layers.append(self._read_page(page, page_num))
+        except Exception as e:
+            logger.error(f"Ошибка чтения текстового слоя {pdf_path}: {e}")
+            return []
+
+        # Проверка покрытия ожидаемых меток на уровне документа
+        label_hits = {label for layer in layers for label in layer.labels_found}
+        labels_ok = len(label_hits) >= self.config.text_layer_min_label_hits
+
+        for layer in layers:
+            layer.usable = (
+                labels_ok
+                and layer.char_count >= self.config.text_layer_min_chars
+                and layer.valid_ratio >= self.config.text_layer_min_valid_ratio
+            )
+
+        usable_count = sum(layer.usable for layer in layers)
+        logger.info(f"Текстовый слой пригоден на {usable_count} из {len(layers)} стр.")
+        return layers
+
+    def _read_page(self, page, page_num: int) -> PageTextLayer:
+        """Извлечение текста и слов страницы с расчетом показателей"""
+        text = page.get_text("text", sort=True)
+        words = page_words(page, sort=True)
+
+        non_space = [ch for ch in text if not ch.isspace()]
+        char_count = len(non_space)
+        valid_count = sum(1 for ch in non_space if _VALID_CHARS.match(ch))
+        text_lower = text.lower()
+
+        return PageTextLayer(
+            page_index=page_num,
+            text=text,
+            words=words,
+            char_count=char_count,
+            valid_ratio=valid_count / char_count if char_count else 0.0,
+            labels_found=[label for label in self.config.text_layer_labels if label.lower() in text_lower]
+        )
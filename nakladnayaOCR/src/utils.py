@@ -7,23 +7,38 @@ import re
 import json
 import subprocess
 from pathlib import Path
-from typing import Optional, List, Tuple, Dict, Any
+from typing import Optional, List, Tuple, Dict, Any, Union, Pattern, Callable
 import logging
 
-from marker.converters.pdf import PdfConverter
-from marker.models import create_model_dict
-from marker.config.parser import ConfigParser
+from PIL import Image
 
 from .config import Config
+from .model_registry import get_model_registry
+from .patterns import get_pattern_bank
+from .document_index import DocumentIndex
+from .region_ocr import RegionRecognizer
+from .page_image import PageImage
+from .text_layer import TextLayerInspector, PageTextLayer
+from .stage_cache import StageCache
+from .progress import ProgressReporter, ProgressCallback
+from .templates import get_template_registry
+from .metrics import PAGES, DETECTED_FIELDS, DETECTION_PATHS
 
 logger = logging.getLogger(__name__)
 
+_SPACES_RE = re.compile(r"[ \t]+")
+_NON_MONEY_RE = re.compile(r"[^0-9.]")
+_HTML_TAG_RE = re.compile(r"<[^>]+>")
+# Разделитель страниц Marker при paginate_output: {номер страницы с нуля} и 48 дефисов
+_PAGE_SEPARATOR_RE = re.compile(r"\{(\d+)\}-{48}")
+
 
 class TextProcessor:
     """Класс для обработки и нормализации текста"""
     
     def __init__(self, config: Config):
         self.config = config
+        self.patterns = get_pattern_bank(config)
     
     def normalize_text(self, text: str) -> str:
         """Нормализация текста: удаление лишних пробелов и символов"""
@@ -35,10 +50,14 @@ class TextProcessor:
         text = text.replace("\u202f", " ")
         
         # Удаление множественных пробелов и табуляций
-        text = re.sub(r"[ \t]+", " ", text)
+        text = _SPACES_RE.sub(" ", text)
         
         return text.strip()
     
+    def build_index(self, text: str) -> DocumentIndex:
+        """Построение индекса документа (один раз на текст)"""
+        return DocumentIndex(text, self.normalize_text(text), self.patterns)
+    
     def parse_money(self, text: Optional[str]) -> Optional[float]:
         """Парсинг денежных сумм из текста"""
         if not text:
@@ -48,7 +67,7 @@ class TextProcessor:
         cleaned = text.replace(" ", "").replace("\u202f", "").replace(",", ".")
         
         # Оставляем только цифры и точку
-        cleaned = re.sub(r"[^0-9.]", "", cleaned)
+        cleaned = _NON_MONEY_RE.sub("", cleaned)
         
         if not cleaned:
             return None
@@ -59,11 +78,11 @@ class TextProcessor:
             logger.warning(f"Не удалось распарсить сумму: {text}")
             return None
     
-    def find_first_match(self, patterns: List[str], text: str, 
+    def find_first_match(self, patterns: List[Union[str, Pattern]], text: str, 
                         flags=re.IGNORECASE | re.MULTILINE | re.DOTALL) -> Optional[str]:
-        """Поиск первого совпадения среди списка паттернов"""
+        """Поиск первого совпадения среди списка паттернов (строк или скомпилированных из PatternBank)"""
         for pattern in patterns:
-            match = re.search(pattern, text, flags)
+            match = pattern.search(text) if isinstance(pattern, re.Pattern) else re.search(pattern, text, flags)
             if match:
                 # Возвращаем первую захватывающую группу, если есть
                 groups = match.groups()
@@ -72,76 +91,58 @@ class TextProcessor:
                 return match.group(0)
         return None
     
-    def extract_section(self, lines: List[str], start_labels: List[str], 
+    def extract_section(self, lines: Union[List[str], DocumentIndex], start_labels: List[str], 
                        next_labels: List[str], max_lines: Optional[int] = None) -> str:
         """Извлечение секции текста между указанными метками"""
         max_lines = max_lines or self.config.max_lines_section
+        index = lines if isinstance(lines, DocumentIndex) else self.build_index("\n".join(lines))
+        view = index.line_view
         
         # Поиск начальной позиции
-        start_idx = None
-        for i, line in enumerate(lines):
-            if any(re.search(label, line, re.IGNORECASE) for label in start_labels):
-                start_idx = i
-                break
-        
+        start_idx = view.first_line(start_labels)
         if start_idx is None:
             return ""
         
         # Поиск конечной позиции
-        end_idx = min(start_idx + max_lines, len(lines))
-        for j in range(start_idx + 1, min(start_idx + max_lines, len(lines))):
-            if j < len(lines) and any(re.search(label, lines[j], re.IGNORECASE) for label in next_labels):
+        end_idx = min(start_idx + max_lines, len(view.lines))
+        for j in view.lines_with(next_labels):
+            if start_idx < j < end_idx:
                 end_idx = j
                 break
         
         # Склеивание строк
         section_lines = []
-        for line in lines[start_idx + 1:end_idx]:
+        for line in view.lines[start_idx + 1:end_idx]:
             normalized = self.normalize_text(line)
             if normalized:
                 section_lines.append(normalized)
         
         return " ".join(section_lines)
     
-    def extract_inn_kpp(self, text: str, near_patterns: List[str]) -> Tuple[Optional[str], Optional[str]]:
+    def extract_inn_kpp(self, text: Union[str, DocumentIndex], near_patterns: List[str]) -> Tuple[Optional[str], Optional[str]]:
         """Извлечение ИНН и КПП из текста вблизи указанных паттернов"""
-        lines = text.splitlines()
-        
-        # Поиск области вокруг метки
-        target_idx = None
-        for i, line in enumerate(lines):
-            if any(re.search(pattern, line, re.IGNORECASE) for pattern in near_patterns):
-                target_idx = i
-                break
+        index = text if isinstance(text, DocumentIndex) else self.build_index(text)
+        view = index.line_view
         
-        # Определение окна поиска
+        # Определение окна поиска вокруг метки
+        target_idx = view.first_line(near_patterns)
         if target_idx is not None:
-            start_idx = max(0, target_idx)
-            end_idx = min(len(lines), target_idx + 8)  # Увеличим окно поиска
-            search_lines = lines[start_idx:end_idx]
+            start_idx, end_idx = target_idx, min(len(view.lines), target_idx + 8)  # Увеличим окно поиска
         else:
-            search_lines = lines
+            start_idx, end_idx = 0, len(view.lines)
         
-        # Поиск ИНН и КПП в окне
-        inn = None
-        kpp = None
+        # Поиск ИНН и КПП только в строках окна, где есть эти метки
+        inn_match = view.search_lines(self.patterns.inn, self.patterns.inn_line_label, start_idx, end_idx)
+        kpp_match = view.search_lines(self.patterns.kpp, self.patterns.kpp_line_label, start_idx, end_idx)
         
-        for line in search_lines:
-            if inn is None:
-                inn_match = re.search(self.config.inn_pattern, line, re.IGNORECASE)
-                if inn_match:
-                    inn = inn_match.group(1)
-            
-            if kpp is None:
-                kpp_match = re.search(self.config.kpp_pattern, line, re.IGNORECASE)
-                if kpp_match:
-                    kpp = kpp_match.group(1)
-            
-            # Если нашли оба, можем прекратить поиск
-            if inn and kpp:
-                break
-        
-        return inn, kpp
+        return (inn_match.group(1) if inn_match else None,
+                kpp_match.group(1) if kpp_match else None)
+    
+    def split_marker_pages(self, text: str) -> Dict[int, str]:
+        """Текст по страницам (номер с нуля) из разбитого на страницы вывода Marker"""
+        chunks = _PAGE_SEPARATOR_RE.split(text)
+        # chunks: [текст до первой страницы, номер, текст, номер, текст, ...]
+        return {int(page): chunk.strip() for page, chunk in zip(chunks[1::2], chunks[2::2])}
     
     def extract_text_from_marker_output(self, path: Path) -> str:
         """Извлечение текста из вывода Marker в зависимости от формата"""
@@ -188,7 +189,7 @@ class TextProcessor:
         
         elif path.suffix.lower() == ".html":
             # Простое удаление HTML тегов
-            return re.sub(r"<[^>]+>", "", content)
+            return _HTML_TAG_RE.sub("", content)
         
         else:
             logger.warning(f"Неизвестный формат файла: {path.suffix}")
@@ -200,42 +201,79 @@ class MarkerRunner:
     
     def __init__(self, config: Config):
         self.config = config
+        self.text_processor = TextProcessor(config)
+        self.text_layer_inspector = TextLayerInspector(config)
+        self.stage_cache = StageCache.from_config(config)
         self._setup_converter()
     
     def _setup_converter(self):
-        """Настройка конвертера Marker"""
+        """Настройка конвертера Marker поверх общих моделей процесса"""
+        self.converter = self._build_converter()
+        logger.info("Marker конвертер инициализирован")
+    
+    def _build_converter(self, page_range: Optional[List[int]] = None, force_ocr: bool = False,
+                         paginate: bool = False):
+        """Создание легкого конвертера вокруг уже загруженных моделей"""
+        # Marker (и torch) импортируются только при работе с документами,
+        # чтобы процессы разбора текста (InvoiceParser.parse_many) их не загружали
+        from marker.converters.pdf import PdfConverter
+        from marker.config.parser import ConfigParser
+        
         # Создание конфигурации для Marker
         marker_config = {
             "output_format": self.config.output_format,
         }
         
         # Добавляем дополнительные настройки если они есть
-        if hasattr(self.config, 'force_ocr') and self.config.force_ocr:
+        if force_ocr or (hasattr(self.config, 'force_ocr') and self.config.force_ocr):
             marker_config["FORCE_OCR"] = True
         
+        # Ограничение набора страниц (для сканированных страниц смешанного документа)
+        if page_range:
+            marker_config["page_range"] = ",".join(str(page) for page in page_range)
+        
+        # Разделители страниц в выводе: текст OCR раскладывается по своим страницам
+        if paginate:
+            marker_config["paginate_output"] = True
+        
         # Создание парсера конфигурации
         self.config_parser = ConfigParser(marker_config)
         
-        # Создание конвертера
-        self.converter = PdfConverter(
+        # Копия словаря нужна потому, что PdfConverter дописывает в него llm_service
+        return PdfConverter(
             config=self.config_parser.generate_config_dict(),
-            artifact_dict=create_model_dict(),
+            artifact_dict=dict(get_model_registry().get_models()),
             processor_list=self.config_parser.get_processors(),
             renderer=self.config_parser.get_renderer(),
             llm_service=self.config_parser.get_llm_service()
         )
-        
-        logger.info("Marker конвертер инициализирован")
     
-    def run(self, input_path: Path, output_dir: Path) -> Path:
-        """Запуск Marker для обработки документа"""
+    def get_model_stats(self) -> Dict[str, Any]:
+        """Статистика общих моделей Marker: время загрузки и занимаемая память"""
+        return get_model_registry().stats()
+    
+    def run(self, input_path: Path, output_dir: Path, page_range: Optional[List[int]] = None,
+            force_ocr: bool = False) -> Path:
+        """
+        Запуск Marker для обработки документа
+        
+        Args:
+            input_path: Путь к документу
+            output_dir: Директория для результата
+            page_range: Номера страниц (с нуля) для OCR с разделителями страниц; None - весь документ
+            force_ocr: OCR без чтения текстового слоя (слой отвергнут проверкой)
+        """
         output_dir.mkdir(parents=True, exist_ok=True)
         
         logger.info(f"Запуск Marker для файла: {input_path}")
         
         try:
             # Запуск конвертации через новый API
-            result = self.converter(str(input_path))
+            if page_range or force_ocr:
+                converter = self._build_converter(page_range, force_ocr=True, paginate=bool(page_range))
+            else:
+                converter = self.converter
+            result = converter(str(input_path))
             
             # Определение выходного файла
             output_file = self._get_output_path(input_path, output_dir)
@@ -250,6 +288,88 @@ class MarkerRunner:
             logger.error(f"Ошибка при работе с Marker: {e}")
             raise RuntimeError(f"Marker завершился с ошибкой: {str(e)}")
     
+    def extract_text(self, input_path: Path, output_dir: Path,
+                     text_layers: Optional[List[PageTextLayer]] = None,
+                     input_key: Optional[str] = None,
+                     progress: Union[ProgressReporter, ProgressCallback, None] = None) -> Dict[str, Any]:
+        """
+        Получение текста документа: текстовый слой для born-digital страниц, OCR для остальных
+        
+        Args:
+            input_path: Путь к документу
+            output_dir: Директория для результата Marker
+            text_layers: Уже прочитанные текстовые слои (если None, читаются при необходимости)
+            input_key: Ключ входного файла для архива этапов (если None, вычисляется)
+            progress: Получатель событий этапа ocr (callback или ProgressReporter)
+            
+        Returns:
+            Словарь с текстом документа, источником текста по страницам
+            и ключом этапа OCR (stage_key) для этапов после него
+        """
+        if input_key is None:
+            input_key = self.stage_cache.input_key(input_path)
+        stage_key = self.stage_cache.key("ocr", self.config, input_key)
+        reporter = ProgressReporter.wrap(progress, self.config.trace_memory)
+        with reporter.stage("ocr"):
+            extraction = self.stage_cache.memoize(
+                "ocr", stage_key, lambda: self._extract_text(input_path, output_dir, text_layers, reporter)
+            )
+        reporter.partial("ocr", text_length=len(extraction["text"]), page_sources=extraction["page_sources"])
+        return {**extraction, "stage_key": stage_key}
+    
+    def _extract_text(self, input_path: Path, output_dir: Path,
+                      text_layers: Optional[List[PageTextLayer]] = None,
+                      reporter: Optional[ProgressReporter] = None) -> Dict[str, Any]:
+        """Текст документа без обращения к архиву этапов"""
+        reporter = reporter or ProgressReporter()
+        if text_layers is None and input_path.suffix.lower() == ".pdf" and self.text_layer_inspector.is_enabled():
+            with reporter.stage("text_layer"):
+                text_layers = self.text_layer_inspector.inspect(input_path)
+        text_layers = text_layers or []
+        
+        usable_pages = [layer for layer in text_layers if layer.usable]
+        ocr_pages = [layer.page_index for layer in text_layers if not layer.usable]
+        PAGES.inc(len(usable_pages), source="text_layer")
+        PAGES.inc(len(ocr_pages), source="ocr")
+        
+        page_sources = [
+            {"page": layer.page_index, "source": "text_layer" if layer.usable else "ocr", **layer.stats()}
+            for layer in text_layers
+        ]
+        
+        # Документ без пригодного текстового слоя целиком идет в OCR; слой, отвергнутый
+        # проверкой (битая кодировка), Marker читать не должен
+        if not usable_pages:
+            with reporter.stage("marker"):
+                marker_output = self.run(input_path, output_dir, force_ocr=bool(text_layers))
+            if text_layers:
+                reporter.page("ocr", len(text_layers), len(text_layers))
+            return {
+                "text": self.text_processor.extract_text_from_marker_output(marker_output),
+                "page_sources": page_sources or [{"page": None, "source": "ocr"}]
+            }
+        
+        reporter.page("ocr", len(usable_pages), len(text_layers))
+        
+        # OCR только для сканированных страниц
+        ocr_texts = {}
+        if ocr_pages:
+            logger.info(f"OCR для страниц без текстового слоя: {[page + 1 for page in ocr_pages]}")
+            with reporter.stage("marker", page_count=len(ocr_pages)):
+                marker_output = self.run(input_path, output_dir, page_range=ocr_pages)
+            ocr_text = self.text_processor.extract_text_from_marker_output(marker_output)
+            ocr_texts = self.text_processor.split_marker_pages(ocr_text)
+            if not ocr_texts or not set(ocr_texts) <= set(ocr_pages):
+                # Без разделителей (форматы json и html) текст OCR ставится на место первой скан-страницы
+                ocr_texts = {ocr_pages[0]: ocr_text}
+            reporter.page("ocr", len(text_layers), len(text_layers))
+        else:
+            logger.info("Все страницы имеют пригодный текстовый слой, OCR пропущен")
+        
+        # Текст в порядке страниц: парсер ищет значения рядом с метками
+        parts = [layer.text if layer.usable else ocr_texts.get(layer.page_index, "") for layer in text_layers]
+        return {"text": "\n\n".join(part for part in parts if part), "page_sources": page_sources}
+    
     def _get_output_path(self, input_path: Path, output_dir: Path) -> Path:
         """Определение пути для выходного файла"""
         # Определение расширения по формату
@@ -295,23 +415,47 @@ class YoloMarkerProcessor:
         self.config = config
         self.text_processor = TextProcessor(config)
         self.marker_runner = MarkerRunner(config)
+        self.region_recognizer = RegionRecognizer(config)
+        self.templates = get_template_registry(config)
         
         # Инициализация YOLO детектора
         try:
             from .yolo_detector import YoloFieldDetector
-            self.yolo_detector = YoloFieldDetector()
+            self.yolo_detector = YoloFieldDetector(
+                batch_size=config.yolo_batch_size, backend=config.yolo_backend, threads=config.yolo_threads
+            )
             self.yolo_available = self.yolo_detector.is_available()
         except ImportError:
             logger.warning("YOLO детектор недоступен")
             self.yolo_detector = None
             self.yolo_available = False
     
-    def process_document(self, input_path: Path, output_dir: Path) -> Dict[str, Any]:
+    def process_document(self, input_path: Path, output_dir: Path,
+                         progress: Union[ProgressReporter, ProgressCallback, None] = None) -> Dict[str, Any]:
         """
         Полная обработка документа: YOLO детекция + Marker OCR
         
+        Args:
+            input_path: Путь к документу
+            output_dir: Директория для результата Marker и отладочных файлов
+            progress: Получатель событий обработки (callback или ProgressReporter)
+        
+        Returns:
+            Словарь с результатами обработки (сериализуется в JSON)
+        """
+        return self.process_with_detections(input_path, output_dir, progress)[0]
+    
+    def process_with_detections(self, input_path: Path, output_dir: Path,
+                                progress: Union[ProgressReporter, ProgressCallback, None] = None
+                                ) -> Tuple[Dict[str, Any], List[Any]]:
+        """
+        Полная обработка документа и детекции страниц вместе с растрами
+        
+        Растры в результат не попадают: аннотированные страницы строит
+        вызывающая сторона (интерфейс) через yolo_detector.render_annotations.
+        
         Returns:
-            Словарь с результатами обработки
+            Словарь с результатами обработки и список DetectionResult по страницам
         """
         results = {
             "input_path": str(input_path),
@@ -319,50 +463,95 @@ class YoloMarkerProcessor:
             "marker_text": None,
             "field_texts": {},
             "annotated_image": None,
+            "page_sources": [],
+            "stage_keys": {},
             "processing_success": False
         }
+        detections = []
+        stage_cache = self.marker_runner.stage_cache
+        reporter = ProgressReporter.wrap(progress, self.config.trace_memory)
         
         try:
-            # 1. Конвертация PDF в изображения для YOLO (если это PDF)
-            yolo_images = []
-            if input_path.suffix.lower() == '.pdf':
-                yolo_images = self._convert_pdf_to_images(input_path, output_dir / "pdf_pages")
-            else:
-                yolo_images = [input_path]  # Если уже изображение
+            input_key = stage_cache.input_key(input_path)
+            
+            # 1. Растеризация страниц в память (PDF) или загрузка изображения
+            pages = []
+            text_layers = []
+            # Страница только для детекции: рендер сразу в размере входа модели
+            dual_resolution = (
+                input_path.suffix.lower() == '.pdf' and self.config.dual_resolution
+                and self.is_field_detection_available()
+            )
+            with reporter.stage("rasterize"):
+                if input_path.suffix.lower() == '.pdf':
+                    pages = self._render_pdf_pages(
+                        input_path, lambda done, total: reporter.page("rasterize", done, total),
+                        detection_size=self.yolo_detector.input_size if dual_resolution else None
+                    )
+                else:
+                    pages = [PageImage.from_file(input_path)]  # Если уже изображение
+            if input_path.suffix.lower() == '.pdf' and self.marker_runner.text_layer_inspector.is_enabled():
+                with reporter.stage("text_layer"):
+                    text_layers = self.marker_runner.text_layer_inspector.inspect(input_path)
+            
+            if self.config.save_debug_artifacts:
+                for page in pages:
+                    page.save(output_dir / "pdf_pages" / f"{page.name}.png")
             
-            # 2. YOLO детекция полей (если доступна)
-            if self.yolo_available and yolo_images:
+            # 2. Поля всех страниц: шаблоны форм, для остальных страниц - пакетный прогон YOLO (если доступна)
+            if self.is_field_detection_available() and pages:
                 logger.info("Запуск YOLO детекции полей...")
-                # Обрабатываем первую страницу для начала
-                first_image = yolo_images[0] if yolo_images else None
-                if first_image and first_image.exists():
-                    fields = self.yolo_detector.detect_fields(str(first_image))
-                    results["yolo_detection"] = {
-                        "fields": fields,
-                        "field_count": len(fields),
-                        "summary": self.yolo_detector.get_field_summary(str(first_image))
-                    }
-                    
-                    # Создание аннотированного изображения
-                    annotated_path = self.yolo_detector.create_annotated_image(
-                        str(first_image), 
-                        str(output_dir / f"{first_image.stem}_annotated{first_image.suffix}")
+                with reporter.stage("detect", page_count=len(pages)):
+                    detections, paths, results["stage_keys"]["detect"] = self._detect_pages(
+                        pages, input_key, reporter, text_layers
                     )
-                    results["annotated_image"] = annotated_path
+                fields = [field for detection in detections for field in detection.fields]
+                results["yolo_detection"] = {
+                    "fields": fields,
+                    "field_count": len(fields),
+                    "page_count": len(detections),
+                    "paths": paths,
+                    "errors": [
+                        {"page": detection.page_index, "error": detection.error}
+                        for detection in detections if detection.error
+                    ],
+                    "summary": self.yolo_detector.summarize_pages(detections)
+                }
+                reporter.partial("detect", fields=fields, field_count=len(fields), paths=paths)
+                for field in fields:
+                    DETECTED_FIELDS.inc(field_type=field["field_type"])
+                for path in paths:
+                    DETECTION_PATHS.inc(path=path["path"])
                 
-            # 2. Marker OCR для полного документа
-            logger.info("Запуск Marker OCR...")
-            marker_output = self.marker_runner.run(input_path, output_dir)
-            full_text = self.text_processor.extract_text_from_marker_output(marker_output)
-            results["marker_text"] = full_text
+                # Аннотированные страницы на диск (отладка)
+                if self.config.save_debug_artifacts:
+                    with reporter.stage("annotate"):
+                        annotated_paths = self.yolo_detector.annotate_pages(detections, output_dir)
+                        results["annotated_image"] = annotated_paths[0] if annotated_paths else None
+                
+            # 2. Текст документа: текстовый слой born-digital страниц, Marker OCR для сканов
+            logger.info("Извлечение текста документа...")
+            extraction = self.marker_runner.extract_text(input_path, output_dir, text_layers, input_key, reporter)
+            results["marker_text"] = extraction["text"]
+            results["page_sources"] = extraction["page_sources"]
+            results["stage_keys"]["ocr"] = extraction["stage_key"]
             
-            # 3. Извлечение текста из регионов полей (если YOLO доступна)
-            if self.yolo_available and results.get("yolo_detection", {}).get("fields"):
-                # Используем первое изображение для извлечения полей
-                field_image = yolo_images[0] if yolo_images else input_path
-                results["field_texts"] = self._extract_field_texts(
-                    field_image, results["yolo_detection"]["fields"], output_dir
+            # 3. Извлечение текста из регионов полей всех страниц (если поля найдены)
+            if any(detection.fields for detection in detections):
+                # Текст полей зависит от боксов и от текстовых слоев (срез Config этапа OCR)
+                region_key = stage_cache.key(
+                    "region_ocr", self.config, results["stage_keys"]["detect"], extraction["stage_key"]
                 )
+                with reporter.stage("region_ocr"):
+                    results["field_texts"] = stage_cache.memoize(
+                        "region_ocr", region_key,
+                        lambda: self._extract_field_texts(
+                            detections, text_layers, reporter,
+                            input_path if input_path.suffix.lower() == '.pdf' else None
+                        ),
+                        should_cache=lambda value: not value["errors"]
+                    )["field_texts"]
+                reporter.partial("region_ocr", field_texts=results["field_texts"])
             
             results["processing_success"] = True
             logger.info("Обработка документа завершена успешно")
@@ -371,52 +560,158 @@ class YoloMarkerProcessor:
             logger.error(f"Ошибка при обработке документа: {e}")
             results["error"] = str(e)
         
-        return results
+        # Замеры этапов (при вызове из BatchPipeline включают и его этапы до этого момента)
+        results["timings"] = reporter.report()
+        return results, detections
+    
+    def _detect_pages(self, pages: List[PageImage], input_key: str, reporter: ProgressReporter,
+                      text_layers: Optional[List[PageTextLayer]] = None) -> Tuple[List[Any], List[Dict], str]:
+        """
+        Детекция полей через архив этапов
+        
+        Страницы, уверенно совмещенные с шаблоном формы, получают боксы шаблона;
+        YOLO (если доступна) запускается только для остальных. Сохраняются только боксы страниц;
+        при чтении из архива они снова связываются с растрами текущего прогона.
+        
+        Returns:
+            Список DetectionResult, способ поиска полей по страницам и ключ этапа детекции
+        """
+        from .yolo_detector import DetectionResult
+        from .result_cache import model_versions
+        
+        stage_cache = self.marker_runner.stage_cache
+        raster_key = stage_cache.key("rasterize", self.config, input_key)
+        # Веса и бэкенд: экспортированные модели дают боксы, близкие, но не равные PyTorch
+        weights = ""
+        if stage_cache.enabled:
+            if self.yolo_available:
+                weights = model_versions(self.yolo_detector.model_path).get("yolo_weights", "")
+                weights += f"|{self.yolo_detector.model.identity}"
+            if self.templates:
+                weights += f"|templates:{self.templates.fingerprint}"
+        detect_key = stage_cache.key("detect", self.config, raster_key, weights)
+        
+        detected = stage_cache.memoize(
+            "detect", detect_key, lambda: self._match_and_detect(pages, text_layers or [], reporter),
+            should_cache=lambda value: not value["errors"]
+        )
+        errors = {entry["page"]: entry["error"] for entry in detected["errors"]}
+        detections = [
+            DetectionResult(image=page, fields=fields, page_index=page.page_index, error=errors.get(page.page_index))
+            for page, fields in zip(pages, detected["fields"])
+        ]
+        return detections, detected["paths"], detect_key
     
-    def _extract_field_texts(self, input_path: Path, fields: List[Dict], output_dir: Path) -> Dict[str, str]:
-        """Извлечение текста из регионов полей через Marker"""
+    def _match_and_detect(self, pages: List[PageImage], text_layers: List[PageTextLayer],
+                          reporter: ProgressReporter) -> Dict[str, List]:
+        """
+        Боксы шаблонов для совмещенных страниц и пакетный прогон YOLO для остальных
+        
+        Без YOLO несовмещенные страницы остаются без полей (способ поиска "none").
+        """
+        layers = {layer.page_index: layer for layer in text_layers}
+        matches = [
+            self.templates.match(page, layers.get(page.page_index)) if self.templates else None
+            for page in pages
+        ]
+        yolo_pages = [page for page, match in zip(pages, matches) if not (match and match.accepted)]
+        yolo_detections = self.yolo_detector.detect_pages(
+            yolo_pages, progress=lambda done, total: reporter.page("detect", done, total)
+        ) if yolo_pages and self.yolo_available else []
+        yolo_fields = iter([detection.fields for detection in yolo_detections])
+        
+        pages_fields, paths = [], []
+        for page, match in zip(pages, matches):
+            path = match.summary() if match else {"path": "yolo"}
+            path["page"] = page.page_index
+            if match and match.accepted:
+                pages_fields.append(self.yolo_detector.fields_from_boxes(match.page_boxes(page), page))
+                logger.info(f"Стр. {page.page_index + 1}: поля по шаблону {match.template.name} "
+                            f"({match.method}, уверенность {match.confidence:.2f})")
+            elif self.yolo_available:
+                pages_fields.append(next(yolo_fields))
+            else:
+                path["path"] = "none"
+                pages_fields.append([])
+            paths.append(path)
+        # Страницы, на которых модель упала (пустые поля - заглушка, а не результат)
+        errors = [
+            {"page": detection.page_index, "error": detection.error} for detection in yolo_detections if detection.error
+        ]
+        return {"fields": pages_fields, "paths": paths, "errors": errors}
+    
+    def _extract_field_texts(self, detections, text_layers: Optional[List[PageTextLayer]] = None,
+                             reporter: Optional[ProgressReporter] = None,
+                             pdf_path: Optional[Path] = None) -> Dict[str, Any]:
+        """
+        Извлечение текста полей всех страниц
+        
+        Для страниц с пригодным текстовым слоем текст берется из слов внутри бокса,
+        остальные регионы распознаются одним пакетным вызовом. Тексты из текстового
+        слоя отправляются промежуточным результатом до распознавания регионов.
+        Регионы PDF (pdf_path) рендерятся из документа в масштабе своего типа
+        поля, регионы изображений вырезаются из растров страниц.
+        
+        Returns:
+            Словарь с текстами полей (field_texts) и ошибками распознавания регионов
+            (errors; при сбое тексты неполные и в архив этапов не пишутся)
+        """
+        reporter = reporter or ProgressReporter()
         field_texts = {}
+        errors = []
         
-        if not self.yolo_available:
-            return field_texts
+        usable_layers = {layer.page_index: layer for layer in (text_layers or []) if layer.usable}
+        ocr_detections = []
+        
+        for detection in detections:
+            layer = usable_layers.get(detection.page_index)
+            if layer is None:
+                ocr_detections.append(detection)
+                continue
+            
+            # Боксы в пикселях страницы -> пункты PDF
+            scale = detection.image.scale
+            for field_key, field in self.yolo_detector.keyed_fields(detection.fields, detection.page_index).items():
+                bbox = field["bbox"]
+                text = layer.text_in_box(bbox["x1"] / scale, bbox["y1"] / scale, bbox["x2"] / scale, bbox["y2"] / scale)
+                clean_text = self.text_processor.normalize_text(text)
+                if clean_text:
+                    field_texts[field_key] = clean_text
+        
+        if not ocr_detections:
+            return {"field_texts": field_texts, "errors": errors}
+        if field_texts:
+            reporter.partial("region_ocr", field_texts=dict(field_texts))
         
         try:
-            # Извлекаем регионы полей как изображения
-            regions = self.yolo_detector.extract_field_regions(str(input_path), fields)
+            # Извлекаем регионы полей как изображения (в памяти)
+            if pdf_path is not None:
+                regions = self._render_pdf_regions(pdf_path, ocr_detections)
+            else:
+                regions = self.yolo_detector.extract_page_regions(ocr_detections)
             
-            for field_key, region_image in regions.items():
-                try:
-                    # Сохраняем регион как временное изображение
-                    region_path = output_dir / f"field_{field_key}.png"
-                    region_image.save(region_path)
-                    
-                    # Обрабатываем регион через Marker
-                    region_output = self.marker_runner.run(region_path, output_dir / "regions")
-                    region_text = self.text_processor.extract_text_from_marker_output(region_output)
-                    
-                    # Очистка и нормализация текста
-                    clean_text = self.text_processor.normalize_text(region_text)
-                    if clean_text:
-                        field_texts[field_key] = clean_text
-                    
-                    # Удаляем временный файл
-                    region_path.unlink(missing_ok=True)
-                    
-                except Exception as e:
-                    logger.error(f"Ошибка обработки региона {field_key}: {e}")
-                    continue
+            for field_key, region_text in self.region_recognizer.recognize_regions(regions).items():
+                # Очистка и нормализация текста
+                clean_text = self.text_processor.normalize_text(region_text)
+                if clean_text:
+                    field_texts[field_key] = clean_text
             
             logger.info(f"Извлечен текст из {len(field_texts)} полей")
             
         except Exception as e:
             logger.error(f"Ошибка извлечения текстов полей: {e}")
+            errors.append(str(e))
         
-        return field_texts
+        return {"field_texts": field_texts, "errors": errors}
     
     def is_yolo_available(self) -> bool:
         """Проверка доступности YOLO"""
         return self.yolo_available
     
+    def is_field_detection_available(self) -> bool:
+        """Поиск полей доступен: загружена модель YOLO или шаблоны форм"""
+        return self.yolo_detector is not None and (self.yolo_available or bool(self.templates))
+    
     def get_field_summary(self, input_path: Path) -> Dict[str, Any]:
         """Получение сводки по полям"""
         if not self.yolo_available:
@@ -424,19 +719,22 @@ class YoloMarkerProcessor:
         
         return self.yolo_detector.get_field_summary(str(input_path))
     
-    def _convert_pdf_to_images(self, pdf_path: Path, output_dir: Path) -> List[Path]:
+    def _render_pdf_pages(self, pdf_path: Path,
+                          on_page: Optional[Callable[[int, int], None]] = None,
+                          detection_size: Optional[int] = None) -> List[PageImage]:
         """
-        Конвертация PDF в изображения для YOLO обработки
+        Растеризация страниц PDF в память для YOLO обработки
         
         Args:
             pdf_path: Путь к PDF файлу
-            output_dir: Директория для сохранения изображений
+            on_page: Вызывается после каждой страницы с числом готовых и всех страниц
+            detection_size: Длинная сторона страницы в пикселях (вход модели);
+                None - масштаб render_scale
             
         Returns:
-            Список путей к созданным изображениям
+            Список страниц PageImage
         """
-        output_dir.mkdir(parents=True, exist_ok=True)
-        image_paths = []
+        pages = []
         
         try:
             import fitz  # PyMuPDF
@@ -447,18 +745,19 @@ class YoloMarkerProcessor:
             for page_num in range(len(pdf_document)):
                 page = pdf_document.load_page(page_num)
                 
-                # Конвертируем в изображение с высоким разрешением
-                mat = fitz.Matrix(2.0, 2.0)  # Увеличиваем разрешение в 2 раза
-                pix = page.get_pixmap(matrix=mat)
-                
-                # Сохраняем изображение
-                image_path = output_dir / f"page_{page_num + 1}.png"
-                pix.save(str(image_path))
-                image_paths.append(image_path)
+                # Растеризуем без альфа-канала: в размере входа модели или с высоким разрешением
+                scale = self.config.render_scale
+                if detection_size:
+                    scale = detection_size / max(page.rect.width, page.rect.height)
+                pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), colorspace=fitz.csRGB, alpha=False)
                 
-                logger.info(f"Создано изображение: {image_path}")
+                # Страница поверх буфера пиксмапа, без PNG кодирования
+                pages.append(PageImage.from_pixmap(pix, page_index=page_num, scale=scale))
+                if on_page:
+                    on_page(page_num + 1, len(pdf_document))
             
             pdf_document.close()
+            logger.info(f"Растеризовано страниц: {len(pages)}")
             
         except ImportError:
             logger.warning("PyMuPDF не установлен, используем альтернативный метод")
@@ -467,13 +766,12 @@ class YoloMarkerProcessor:
                 import pdf2image
                 
                 # Конвертация с помощью pdf2image
-                images = pdf2image.convert_from_path(pdf_path, dpi=200)
-                
-                for i, image in enumerate(images):
-                    image_path = output_dir / f"page_{i + 1}.png"
-                    image.save(image_path, 'PNG')
-                    image_paths.append(image_path)
-                    logger.info(f"Создано изображение: {image_path}")
+                dpi = 200
+                images = pdf2image.convert_from_path(pdf_path, dpi=dpi)
+                pages = [
+                    PageImage.from_pil(image, page_index=i, scale=dpi / 72)
+                    for i, image in enumerate(images)
+                ]
                     
             except ImportError:
                 logger.error("Не установлены библиотеки для конвертации PDF: PyMuPDF или pdf2image")
@@ -483,4 +781,40 @@ class YoloMarkerProcessor:
             logger.error(f"Ошибка при конвертации PDF в изображения: {e}")
             return []
         
-        return image_paths
+        return pages
+    
+    def _render_pdf_regions(self, pdf_path: Path, detections) -> Dict[str, Image.Image]:
+        """
+        Рендер регионов полей из PDF (clip страницы) без растеризации всей страницы
+        
+        Боксы переводятся из пикселей страницы детекции в пункты PDF; масштаб -
+        field_render_scales для типа поля или render_scale, отступ - 5 пикселей
+        результата, как в YoloFieldDetector.crop_fields. Без PyMuPDF регионы
+        вырезаются из растров страниц.
+        """
+        try:
+            import fitz  # PyMuPDF
+        except ImportError:
+            return self.yolo_detector.extract_page_regions(detections)
+        
+        regions = {}
+        with fitz.open(pdf_path) as pdf_document:
+            for detection in detections:
+                page = pdf_document.load_page(detection.page_index)
+                scale = detection.image.scale
+                for field_key, field in self.yolo_detector.keyed_fields(detection.fields, detection.page_index).items():
+                    bbox = field["bbox"]
+                    render_scale = self.config.field_render_scales.get(field["field_type"], self.config.render_scale)
+                    padding = 5 / render_scale
+                    clip = fitz.Rect(
+                        bbox["x1"] / scale - padding, bbox["y1"] / scale - padding,
+                        bbox["x2"] / scale + padding, bbox["y2"] / scale + padding
+                    ) & page.rect
+                    if clip.is_empty:
+                        continue
+                    matrix = fitz.Matrix(render_scale, render_scale)
+                    pix = page.get_pixmap(matrix=matrix, clip=clip, colorspace=fitz.csRGB, alpha=False)
+                    regions[field_key] = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+        
+        logger.info(f"Отрендерено регионов: {len(regions)}")
+        return regions
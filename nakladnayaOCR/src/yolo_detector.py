@@ -3,36 +3,65 @@
 YOLO детектор для сегментации полей в накладных
 """
 
+import time
 import cv2
 import numpy as np
 from PIL import Image
 from pathlib import Path
-from typing import List, Dict, Tuple, Optional, Any
+import dataclasses
+from typing import List, Dict, Optional, Any, Union, Callable
 import logging
 
-try:
-    from ultralytics import YOLO
-    YOLO_AVAILABLE = True
-except ImportError:
-    YOLO_AVAILABLE = False
-    logging.warning("ultralytics не установлен. YOLO детекция недоступна.")
+from .page_image import PageImage
+from .metrics import MODEL_LOAD_SECONDS
+from .inference_backends import DEFAULT_IMGSZ, DetectorBackend, RUNTIME_AVAILABLE, load_backend, manifest_path
+
+# Детекция доступна, если установлена хотя бы одна среда выполнения (ultralytics, onnxruntime, ...)
+YOLO_AVAILABLE = any(RUNTIME_AVAILABLE.values())
+if not RUNTIME_AVAILABLE["pytorch"]:
+    logging.warning("ultralytics не установлен. YOLO детекция доступна только через экспортированные модели.")
 
 logger = logging.getLogger(__name__)
 
 
+@dataclasses.dataclass
+class DetectionResult:
+    """Результат однократной YOLO детекции страницы"""
+    
+    image: PageImage
+    fields: List[Dict[str, Any]] = dataclasses.field(default_factory=list)
+    page_index: int = 0
+    image_path: Optional[str] = None
+    error: Optional[str] = None  # сбой модели: поля страницы не найдены, а не отсутствуют
+    
+    @property
+    def field_count(self) -> int:
+        return len(self.fields)
+
+
 class YoloFieldDetector:
     """Детектор полей документов на основе YOLO"""
     
-    def __init__(self, model_path: str = None, confidence_threshold: float = 0.25):
+    def __init__(self, model_path: str = None, confidence_threshold: float = 0.25, batch_size: int = 4,
+                 backend: str = "auto", threads: Optional[int] = None):
         """
         Инициализация детектора
         
         Args:
             model_path: Путь к обученной модели YOLO
             confidence_threshold: Порог уверенности для детекции
+            batch_size: Количество страниц в одном прогоне модели
+            backend: Бэкенд инференса: auto, openvino, onnx, torchscript, pytorch
+                (см. src/inference_backends.py)
+            threads: Потоков инференса (None - по умолчанию среды выполнения)
         """
-        self.model = None
+        self.model: Optional[DetectorBackend] = None
+        self.model_path: Optional[str] = None
         self.confidence_threshold = confidence_threshold
+        self.iou_threshold = 0.6
+        self.batch_size = max(1, batch_size)
+        self.backend = backend
+        self.threads = threads
         
         # Классы полей
         self.field_classes = {
@@ -57,14 +86,14 @@ class YoloFieldDetector:
         }
         
         if not YOLO_AVAILABLE:
-            logger.warning("YOLO недоступен. Используйте 'pip install ultralytics'")
+            logger.warning("YOLO недоступен. Используйте 'pip install ultralytics' или 'pip install onnxruntime'")
             return
             
         # Попытка загрузить модель
-        if model_path and Path(model_path).exists():
+        if model_path and (Path(model_path).exists() or manifest_path(model_path).exists()):
             self.load_model(model_path)
         else:
-            # Попытка найти обученную модель
+            # Попытка найти обученную модель (веса .pt или манифест экспортированных артефактов)
             default_paths = [
                 "src/best_invoice_model.pt",
                 "yolo_training/overfit_models/best_overfit_model.pt",
@@ -72,19 +101,23 @@ class YoloFieldDetector:
             ]
             
             for path in default_paths:
-                if Path(path).exists():
+                if Path(path).exists() or manifest_path(path).exists():
                     self.load_model(path)
                     break
     
     def load_model(self, model_path: str) -> bool:
-        """Загрузка модели YOLO"""
+        """Загрузка модели YOLO в первом доступном бэкенде (self.backend)"""
         try:
-            if not YOLO_AVAILABLE:
-                logger.error("ultralytics не установлен")
+            start = time.perf_counter()
+            model = load_backend(model_path, self.backend, self.threads)
+            if model is None:
+                logger.error(f"Нет доступного бэкенда для модели {model_path}")
                 return False
-                
-            self.model = YOLO(model_path)
-            logger.info(f"YOLO модель загружена: {model_path}")
+            
+            self.model = model
+            self.model_path = str(model_path)
+            MODEL_LOAD_SECONDS.set(time.perf_counter() - start, model="yolo")
+            logger.info(f"YOLO модель загружена: {model.artifact} (бэкенд {model.name})")
             return True
             
         except Exception as e:
@@ -93,7 +126,17 @@ class YoloFieldDetector:
     
     def is_available(self) -> bool:
         """Проверка доступности детектора"""
-        return YOLO_AVAILABLE and self.model is not None
+        return self.model is not None
+    
+    @property
+    def backend_name(self) -> Optional[str]:
+        """Имя загруженного бэкенда (openvino, onnx_int8, onnx, torchscript, pytorch)"""
+        return self.model.name if self.model else None
+    
+    @property
+    def input_size(self) -> int:
+        """Длинная сторона входа модели: страницы крупнее уменьшаются перед детекцией"""
+        return self.model.input_size if self.model else DEFAULT_IMGSZ
     
     def detect_fields(self, image_path: str) -> List[Dict[str, Any]]:
         """
@@ -105,49 +148,113 @@ class YoloFieldDetector:
         Returns:
             Список обнаруженных полей с координатами и метаданными
         """
-        if not self.is_available():
-            logger.warning("YOLO детектор недоступен")
-            return []
+        return self.detect(image_path).fields
+    
+    def detect(self, image: Union[str, Path, PageImage], page_index: int = 0) -> DetectionResult:
+        """
+        Однократная детекция полей на изображении
         
-        try:
-            # Предсказание
-            results = self.model(
-                image_path,
-                conf=self.confidence_threshold,
-                iou=0.6,
-                verbose=False
-            )
-            
-            if not results or not results[0].boxes:
-                logger.info("Поля не обнаружены")
-                return []
-            
-            # Обработка результатов
-            fields = []
-            boxes = results[0].boxes
-            
-            for box in boxes:
-                field = self._process_detection(box, image_path)
-                if field:
-                    fields.append(field)
-            
-            # Сортировка по уверенности
-            fields.sort(key=lambda x: x['confidence'], reverse=True)
+        Результат передается в summarize(), annotate() и extract_regions(),
+        чтобы не запускать модель повторно на той же странице.
+        
+        Args:
+            image: Страница в памяти или путь к изображению
+            page_index: Номер страницы документа (с нуля), если передан путь
             
-            logger.info(f"Обнаружено полей: {len(fields)}")
-            return fields
+        Returns:
+            DetectionResult с обнаруженными полями
+        """
+        return self.detect_pages([self._as_page(image, page_index)])[0]
+    
+    def detect_pages(self, pages: List[Union[str, Path, PageImage]],
+                     batch_size: Optional[int] = None,
+                     progress: Optional[Callable[[int, int], None]] = None) -> List[DetectionResult]:
+        """
+        Пакетная детекция полей на всех страницах документа
+        
+        Args:
+            pages: Страницы в памяти или пути к изображениям в порядке следования
+            batch_size: Размер пакета (по умолчанию self.batch_size)
+            progress: Вызывается после каждого пакета с числом готовых и всех страниц
             
-        except Exception as e:
-            logger.error(f"Ошибка детекции полей: {e}")
-            return []
+        Returns:
+            Список DetectionResult, по одному на страницу
+        """
+        batch_size = max(1, batch_size or self.batch_size)
+        page_images = [self._as_page(page, i) for i, page in enumerate(pages)]
+        detections = []
+        
+        for start in range(0, len(page_images), batch_size):
+            chunk = page_images[start:start + batch_size]
+            try:
+                chunk_fields, error = self._run_model(chunk), None
+            except Exception as e:
+                logger.error(f"Ошибка детекции полей: {e}")
+                chunk_fields, error = [[] for _ in chunk], str(e)
+            for source, page, fields in zip(pages[start:start + batch_size], chunk, chunk_fields):
+                detections.append(DetectionResult(
+                    image=page,
+                    fields=fields,
+                    page_index=page.page_index,
+                    image_path=None if isinstance(source, PageImage) else str(source),
+                    error=error
+                ))
+            if progress:
+                progress(len(detections), len(page_images))
+        
+        return detections
     
-    def _process_detection(self, box, image_path: str) -> Optional[Dict[str, Any]]:
-        """Обработка одного обнаружения"""
+    @staticmethod
+    def _as_page(image: Union[str, Path, PageImage], page_index: int = 0) -> PageImage:
+        """Приведение пути к изображению к PageImage"""
+        if isinstance(image, PageImage):
+            return image
+        return PageImage.from_file(image, page_index=page_index)
+    
+    def _run_model(self, pages: List[PageImage]) -> List[List[Dict[str, Any]]]:
+        """Прогон пакета страниц через модель YOLO и разбор боксов (ошибки модели пробрасываются)"""
+        empty = [[] for _ in pages]
+        
+        if not self.is_available():
+            logger.warning("YOLO детектор недоступен")
+            return empty
+        
+        # Предсказание для всего пакета за один вызов (бэкенды ожидают BGR)
+        results = self.model.predict(
+            [page.to_bgr() for page in pages],
+            conf=self.confidence_threshold,
+            iou=self.iou_threshold
+        )
+        
+        if not results:
+            logger.info("Поля не обнаружены")
+            return empty
+        
+        pages_fields = [self.fields_from_boxes(boxes, page) for page, boxes in zip(pages, results)]
+        
+        logger.info(f"Обнаружено полей: {sum(len(f) for f in pages_fields)} на {len(pages)} стр.")
+        return pages_fields
+    
+    def fields_from_boxes(self, boxes: np.ndarray, page: PageImage) -> List[Dict[str, Any]]:
+        """Поля страницы из боксов [x1, y1, x2, y2, conf, class] в пикселях (модели или шаблона формы)"""
+        fields = []
+        for box in boxes:
+            field = self._process_detection(box, page.name)
+            if field:
+                field["page"] = page.page_index
+                fields.append(field)
+        
+        # Сортировка по уверенности
+        fields.sort(key=lambda x: x['confidence'], reverse=True)
+        return fields
+    
+    def _process_detection(self, box: np.ndarray, image_path: str) -> Optional[Dict[str, Any]]:
+        """Обработка одного обнаружения [x1, y1, x2, y2, conf, class]"""
         try:
             # Координаты
-            coords = box.xyxy[0].tolist()  # [x1, y1, x2, y2]
-            confidence = float(box.conf[0])
-            class_id = int(box.cls[0])
+            coords = [float(value) for value in box[:4]]  # [x1, y1, x2, y2]
+            confidence = float(box[4])
+            class_id = int(box[5])
             
             # Фильтрация по уверенности
             if confidence < self.confidence_threshold:
@@ -198,51 +305,67 @@ class YoloFieldDetector:
         Returns:
             Словарь {field_type: PIL.Image} с вырезанными регионами
         """
+        try:
+            page = self._as_page(image_path)
+        except ValueError as e:
+            logger.error(str(e))
+            return {}
+        
         if fields is None:
-            fields = self.detect_fields(image_path)
+            fields = self.detect(page).fields
+        
+        return self.crop_fields(page, fields)
+    
+    def extract_regions(self, detection: DetectionResult) -> Dict[str, Image.Image]:
+        """Извлечение регионов полей по готовому результату детекции"""
+        return self.crop_fields(detection.image, detection.fields)
+    
+    def keyed_fields(self, fields: List[Dict], page_index: int = 0) -> Dict[str, Dict]:
+        """
+        Уникальные ключи полей страницы
+        
+        Дубликаты получают суффикс счетчика (carrier_1), поля страниц после
+        первой - суффикс номера страницы (carrier_p2).
+        """
+        keyed = {}
+        for field in fields:
+            field_type = field['field_type']
+            key = field_type
+            counter = 1
+            while key in keyed:
+                key = f"{field_type}_{counter}"
+                counter += 1
+            keyed[key] = field
         
+        if page_index > 0:
+            keyed = {f"{key}_p{page_index + 1}": field for key, field in keyed.items()}
+        return keyed
+    
+    def crop_fields(self, page: PageImage, fields: List[Dict]) -> Dict[str, Image.Image]:
+        """
+        Вырезка регионов полей из страницы в памяти
+        
+        Returns:
+            Словарь {ключ поля: PIL.Image} с вырезанными регионами
+        """
         if not fields:
             return {}
         
         try:
-            # Загружаем изображение
-            image = cv2.imread(image_path)
-            if image is None:
-                logger.error(f"Не удалось загрузить изображение: {image_path}")
-                return {}
-            
             regions = {}
             
-            for field in fields:
+            for key, field in self.keyed_fields(fields, page.page_index).items():
                 bbox = field['bbox']
-                field_type = field['field_type']
-                
-                # Вырезаем регион
-                x1, y1 = int(bbox['x1']), int(bbox['y1'])
-                x2, y2 = int(bbox['x2']), int(bbox['y2'])
                 
-                # Добавляем небольшой отступ
+                # Вырезаем регион с небольшим отступом
                 padding = 5
-                x1 = max(0, x1 - padding)
-                y1 = max(0, y1 - padding)
-                x2 = min(image.shape[1], x2 + padding)
-                y2 = min(image.shape[0], y2 + padding)
-                
-                region = image[y1:y2, x1:x2]
+                region = page.crop(
+                    int(bbox['x1']) - padding, int(bbox['y1']) - padding,
+                    int(bbox['x2']) + padding, int(bbox['y2']) + padding
+                )
                 
                 if region.size > 0:
-                    # Конвертируем в PIL
-                    region_rgb = cv2.cvtColor(region, cv2.COLOR_BGR2RGB)
-                    pil_image = Image.fromarray(region_rgb)
-                    
-                    # Используем уникальный ключ для дубликатов
-                    key = field_type
-                    counter = 1
-                    while key in regions:
-                        key = f"{field_type}_{counter}"
-                        counter += 1
-                    
-                    regions[key] = pil_image
+                    regions[key] = Image.fromarray(region)
                     
             logger.info(f"Извлечено регионов: {len(regions)}")
             return regions
@@ -251,6 +374,18 @@ class YoloFieldDetector:
             logger.error(f"Ошибка извлечения регионов: {e}")
             return {}
     
+    def extract_page_regions(self, detections: List[DetectionResult]) -> Dict[str, Image.Image]:
+        """
+        Извлечение регионов полей со всех страниц документа
+        
+        Ключи первой страницы совпадают с extract_regions(), к ключам
+        последующих страниц добавляется суффикс номера страницы (carrier_p2).
+        """
+        regions = {}
+        for detection in detections:
+            regions.update(self.extract_regions(detection))
+        return regions
+    
     def create_annotated_image(self, image_path: str, output_path: str = None) -> str:
         """
         Создание изображения с аннотациями
@@ -262,63 +397,41 @@ class YoloFieldDetector:
         Returns:
             Путь к сохраненному изображению
         """
-        fields = self.detect_fields(image_path)
+        return self.annotate(self.detect(image_path), output_path)
+    
+    def annotate_pages(self, detections: List[DetectionResult], output_dir: Path) -> List[str]:
+        """Сохранение аннотированных страниц документа на диск, возвращает пути по страницам"""
+        output_dir = Path(output_dir)
+        return [
+            self.annotate(detection, str(output_dir / f"{detection.image.name}_annotated.png"))
+            for detection in detections
+        ]
+    
+    def annotate(self, detection: DetectionResult, output_path: str = None) -> str:
+        """
+        Сохранение изображения с аннотациями по готовому результату детекции
         
-        if not fields:
+        Args:
+            detection: Результат детекции страницы
+            output_path: Путь для сохранения (если None, то рядом с исходным)
+            
+        Returns:
+            Путь к сохраненному изображению
+        """
+        image_path = detection.image_path
+        
+        if not detection.fields:
             logger.info("Нет полей для аннотации")
             return image_path
         
         try:
-            # Загружаем изображение
-            image = cv2.imread(image_path)
-            if image is None:
-                logger.error(f"Не удалось загрузить изображение: {image_path}")
-                return image_path
-            
-            # Цвета для разных классов
-            colors = [
-                (255, 0, 0),    # delivery-date - красный
-                (0, 255, 0),    # order-date - зеленый
-                (0, 0, 255),    # carrier - синий
-                (255, 255, 0),  # recipient - желтый
-                (255, 0, 255),  # payload - фиолетовый
-                (0, 255, 255),  # price - голубой
-                (128, 128, 128) # address - серый
-            ]
-            
-            # Рисуем боксы
-            for field in fields:
-                bbox = field['bbox']
-                class_id = field['class_id']
-                confidence = field['confidence']
-                field_name = field['field_name']
-                
-                x1, y1 = int(bbox['x1']), int(bbox['y1'])
-                x2, y2 = int(bbox['x2']), int(bbox['y2'])
-                
-                color = colors[class_id % len(colors)]
-                
-                # Рисуем прямоугольник
-                cv2.rectangle(image, (x1, y1), (x2, y2), color, 2)
-                
-                # Подпись
-                label = f"{field_name}: {confidence:.2f}"
-                label_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)[0]
-                
-                # Фон для текста
-                cv2.rectangle(image, (x1, y1 - label_size[1] - 10), 
-                             (x1 + label_size[0], y1), color, -1)
-                
-                # Текст
-                cv2.putText(image, label, (x1, y1 - 5), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-            
-            # Сохранение
             if output_path is None:
-                base_path = Path(image_path)
+                base_path = Path(image_path) if image_path else Path(f"{detection.image.name}.png")
                 output_path = str(base_path.parent / f"{base_path.stem}_annotated{base_path.suffix}")
             
-            cv2.imwrite(output_path, image)
+            annotated = self.render_annotations(detection)
+            Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+            cv2.imwrite(output_path, cv2.cvtColor(annotated, cv2.COLOR_RGB2BGR))
             logger.info(f"Аннотированное изображение сохранено: {output_path}")
             
             return output_path
@@ -327,6 +440,55 @@ class YoloFieldDetector:
             logger.error(f"Ошибка создания аннотаций: {e}")
             return image_path
     
+    def render_annotations(self, detection: DetectionResult) -> np.ndarray:
+        """
+        Отрисовка аннотаций в памяти
+        
+        Returns:
+            Копия страницы (RGB) с нарисованными боксами полей
+        """
+        image = detection.image.to_bgr()
+        
+        # Цвета для разных классов
+        colors = [
+            (255, 0, 0),    # delivery-date - красный
+            (0, 255, 0),    # order-date - зеленый
+            (0, 0, 255),    # carrier - синий
+            (255, 255, 0),  # recipient - желтый
+            (255, 0, 255),  # payload - фиолетовый
+            (0, 255, 255),  # price - голубой
+            (128, 128, 128) # address - серый
+        ]
+        
+        # Рисуем боксы
+        for field in detection.fields:
+            bbox = field['bbox']
+            class_id = field['class_id']
+            confidence = field['confidence']
+            field_name = field['field_name']
+            
+            x1, y1 = int(bbox['x1']), int(bbox['y1'])
+            x2, y2 = int(bbox['x2']), int(bbox['y2'])
+            
+            color = colors[class_id % len(colors)]
+            
+            # Рисуем прямоугольник
+            cv2.rectangle(image, (x1, y1), (x2, y2), color, 2)
+            
+            # Подпись
+            label = f"{field_name}: {confidence:.2f}"
+            label_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)[0]
+            
+            # Фон для текста
+            cv2.rectangle(image, (x1, y1 - label_size[1] - 10), 
+                         (x1 + label_size[0], y1), color, -1)
+            
+            # Текст
+            cv2.putText(image, label, (x1, y1 - 5), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+        
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    
     def get_field_summary(self, image_path: str) -> Dict[str, Any]:
         """
         Получение сводки обнаруженных полей
@@ -334,8 +496,31 @@ class YoloFieldDetector:
         Returns:
             Сводная информация о полях
         """
-        fields = self.detect_fields(image_path)
+        return self.summarize(self.detect(image_path))
+    
+    def summarize_pages(self, detections: List[DetectionResult]) -> Dict[str, Any]:
+        """
+        Сводка по всем страницам документа
+        
+        Returns:
+            Общая сводка о полях с разбивкой количества полей по страницам
+        """
+        summary = self._summarize_fields([f for d in detections for f in d.fields])
+        summary["page_count"] = len(detections)
+        summary["fields_by_page"] = {d.page_index: d.field_count for d in detections}
+        return summary
+    
+    def summarize(self, detection: DetectionResult) -> Dict[str, Any]:
+        """
+        Сводка по готовому результату детекции
         
+        Returns:
+            Сводная информация о полях
+        """
+        return self._summarize_fields(detection.fields)
+    
+    def _summarize_fields(self, fields: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Сводная статистика по списку полей"""
         summary = {
             "total_fields": len(fields),
             "fields_by_type": {},
@@ -3,23 +3,50 @@
 import os
 import re
 import json
+import time
 import shutil
 import tempfile
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
 from pathlib import Path
-from typing import Dict, Optional, Tuple, List
+from typing import Dict, Any, Optional, Tuple, List
 import logging
 
 import streamlit as st
 
 from src.parser import InvoiceParser
-from src.utils import TextProcessor, MarkerRunner, YoloMarkerProcessor
+from src.utils import TextProcessor
 from src.config import Config
+from src.batch import BatchPipeline
+from src.progress import ProgressReporter, ProgressCallback, ProgressEvent
+from src.metrics import serve_metrics
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+SAMPLE_PATH = Path("data/Obrazets-zapolneniya-TN-2025-2.pdf")
+
+# Период опроса фоновой задачи извлечения, секунд
+POLL_INTERVAL = 0.5
+
+# Этапы, по которым считается прогресс (имена из src/progress.py)
+ENHANCED_STAGES = ("rasterize", "detect", "ocr", "region_ocr", "parse", "annotate")
+STANDARD_STAGES = ("ocr", "parse")
+STAGE_TITLES = {
+    "rasterize": "🖼️ Растеризация страниц",
+    "detect": "🎯 YOLO детекция полей",
+    "ocr": "🔍 Извлечение текста",
+    "region_ocr": "📝 Распознавание полей",
+    "parse": "🧠 Извлечение информации",
+    "save": "📥 Сохранение файла",
+    "text_layer": "📄 Текстовый слой",
+    "marker": "🔍 Marker OCR",
+    "annotate": "🖍️ Аннотации",
+    "total": "Итого"
+}
+
 # Конфигурация страницы
 st.set_page_config(
     page_title="Парсер накладной (Marker OCR)", 
@@ -30,6 +57,7 @@ st.set_page_config(
 
 def main():
     """Основная функция приложения"""
+    start_metrics_server()
     
     # Заголовок и описание
     st.title("🧾 Сервис извлечения информации из накладных")
@@ -52,8 +80,9 @@ def main():
         # Принудительное OCR
         force_ocr = st.checkbox(
             "Принудительное OCR", 
-            value=True,
-            help="Использовать OCR даже для PDF с текстовым слоем"
+            value=False,
+            help="Использовать OCR даже для PDF с текстовым слоем. "
+                 "Если выключено, страницы с пригодным текстовым слоем обрабатываются без OCR"
         )
         
         # Отладочный режим
@@ -94,121 +123,238 @@ def main():
         use_sample = st.button("📋 Использовать образец ТН-2025")
         
         if use_sample:
-            sample_path = Path("data/Obrazets-zapolneniya-TN-2025-2.pdf")
-            if sample_path.exists():
-                with open(sample_path, "rb") as f:
-                    uploaded_file = type('MockFile', (), {
-                        'read': lambda: f.read(),
-                        'name': sample_path.name
-                    })()
+            if SAMPLE_PATH.exists():
+                # Выбор образца переживает перезапуски скрипта до нажатия "Обработать"
+                st.session_state["use_sample"] = True
             else:
                 st.error("Образец файла не найден")
+        if uploaded_file is not None:
+            st.session_state["use_sample"] = False
+        elif st.session_state.get("use_sample"):
+            st.caption(f"Выбран образец: {SAMPLE_PATH.name}")
     
     with col2:
         st.subheader("🔧 Статус обработки")
         status_container = st.empty()
         progress_bar = st.progress(0)
     
-    # Обработка файла
-    if uploaded_file is not None:
-        if st.button("🚀 Обработать документ", type="primary"):
-            try:
-                # Инициализация компонентов
-                config = Config(
-                    output_format=output_format,
-                    force_ocr=force_ocr,
-                    max_lines_section=max_lines_section,
-                    confidence_threshold=confidence_threshold,
-                    debug_mode=debug_mode
-                )
-                
-                # Выбор обработчика
-                if use_yolo:
-                    processor = YoloMarkerProcessor(config)
-                    use_enhanced_processing = processor.is_yolo_available()
-                    if not use_enhanced_processing:
-                        st.warning("⚠️ YOLO недоступен, используется стандартная обработка")
-                else:
-                    use_enhanced_processing = False
-                
-                if not use_enhanced_processing:
-                    marker_runner = MarkerRunner(config)
-                    text_processor = TextProcessor(config)
-                    invoice_parser = InvoiceParser(config, text_processor)
-                
-                with tempfile.TemporaryDirectory() as tmpdir:
-                    tmpdir = Path(tmpdir)
-                    
-                    # Сохранение загруженного файла
-                    status_container.info("📥 Сохранение файла...")
-                    progress_bar.progress(10)
-                    
-                    input_path = tmpdir / uploaded_file.name
-                    with open(input_path, "wb") as f:
-                        f.write(uploaded_file.read())
-                    
-                    if use_enhanced_processing:
-                        # YOLO + Marker обработка
-                        status_container.info("🎯 YOLO детекция полей...")
-                        progress_bar.progress(20)
-                        
-                        status_container.info("🔍 Выполнение OCR...")
-                        progress_bar.progress(50)
-                        
-                        status_container.info("📝 Извлечение текста из полей...")
-                        progress_bar.progress(80)
-                        
-                        # Полная обработка через YOLO + Marker
-                        enhanced_result = processor.process_document(input_path, tmpdir / "output")
-                        
-                        status_container.success("✅ Расширенная обработка завершена!")
-                        progress_bar.progress(100)
-                        
-                        # Отображение результатов
-                        display_enhanced_results(enhanced_result, debug_mode)
-                        
-                    else:
-                        # Стандартная обработка
-                        status_container.info("🔍 Выполнение OCR...")
-                        progress_bar.progress(30)
-                        
-                        try:
-                            output_path = marker_runner.run(input_path, tmpdir / "marker_out")
-                            
-                            # Извлечение текста
-                            status_container.info("📝 Извлечение текста...")
-                            progress_bar.progress(60)
-                            
-                            text = text_processor.extract_text_from_marker_output(output_path)
-                            
-                            if debug_mode:
-                                st.expander("🔍 Извлеченный текст (первые 2000 символов)").text(text[:2000])
-                            
-                            # Парсинг информации
-                            status_container.info("🧠 Извлечение информации...")
-                            progress_bar.progress(80)
-                            
-                            result = invoice_parser.parse(text)
-                            
-                            status_container.success("✅ Обработка завершена!")
-                            progress_bar.progress(100)
-                            
-                            # Отображение результатов
-                            display_results(result, debug_mode, text if debug_mode else None)
-                        
-                    except subprocess.CalledProcessError as e:
-                        status_container.error("❌ Ошибка при запуске Marker OCR")
-                        st.error(f"Команда завершилась с ошибкой: {e}")
-                        if e.stderr:
-                            st.code(e.stderr, language="bash")
-                        
-            except Exception as e:
-                status_container.error("❌ Произошла ошибка")
-                st.error(f"Ошибка обработки: {str(e)}")
-                logger.exception("Ошибка при обработке файла")
-                
-                if debug_mode:
-                    st.exception(e)
+    # Обработка файла: модели берутся из кэша процесса, извлечение идет в фоновом потоке
+    has_input = uploaded_file is not None or st.session_state.get("use_sample")
+    if has_input and st.button("🚀 Обработать документ", type="primary",
+                               disabled="extraction_job" in st.session_state):
+        try:
+            # Режим отладки влияет только на отображение, поэтому в Config не входит
+            config = Config(
+                output_format=output_format,
+                force_ocr=force_ocr,
+                max_lines_section=max_lines_section,
+                confidence_threshold=confidence_threshold
+            )
+            
+            with st.spinner("Загрузка моделей..."):
+                pipeline = get_pipeline(config.fingerprint(), use_yolo, config)
+            if use_yolo and pipeline.processor is None:
+                st.warning("⚠️ YOLO недоступен, используется стандартная обработка")
+            elif use_yolo and not pipeline.processor.is_yolo_available():
+                st.info("ℹ️ YOLO недоступен, поля ищутся только по шаблонам форм")
+            
+            if uploaded_file is not None:
+                data, file_name = uploaded_file.getvalue(), uploaded_file.name
+            else:
+                data, file_name = SAMPLE_PATH.read_bytes(), SAMPLE_PATH.name
+            
+            # События пишутся фоновым потоком и читаются при опросе
+            events: List[ProgressEvent] = []
+            st.session_state.pop("extraction", None)
+            st.session_state["extraction_job"] = {
+                "future": get_executor().submit(run_extraction, pipeline, data, file_name, events.append),
+                "file_name": file_name,
+                "events": events,
+                "stages": ENHANCED_STAGES if pipeline.processor is not None else STANDARD_STAGES,
+                "started": time.monotonic()
+            }
+        
+        except Exception as e:
+            status_container.error("❌ Произошла ошибка")
+            st.error(f"Ошибка обработки: {str(e)}")
+            logger.exception("Ошибка при запуске обработки")
+            
+            if debug_mode:
+                st.exception(e)
+    
+    # Результат последнего извлечения хранится в сессии: переключение
+    # режима отладки и вкладок не запускает OCR заново
+    extraction = st.session_state.get("extraction")
+    if extraction is not None:
+        record = extraction["record"]
+        if record.get("error"):
+            status_container.error(f"❌ Ошибка обработки: {extraction['file_name']}")
+            st.error(f"Детали ошибки: {record['error']}")
+        else:
+            status_container.success(f"✅ Обработка завершена: {extraction['file_name']}")
+            progress_bar.progress(100)
+            if record.get("timings"):
+                display_timings(record["timings"])
+            if record.get("cache") == "hit":
+                st.info("♻️ Результат найден в кэше")
+            
+            if extraction["kind"] == "enhanced":
+                display_enhanced_results(record, extraction["annotated_images"], debug_mode)
+            result = record["result"]
+            if debug_mode:
+                result = debug_result(extraction)
+                st.expander("🔍 Извлеченный текст (первые 2000 символов)").text(record["text"][:2000])
+            display_results(result, debug_mode, record["text"] if debug_mode else None)
+    
+    poll_extraction_job(status_container, progress_bar, debug_mode)
+
+
+@st.cache_resource(show_spinner=False)
+def get_pipeline(config_key: str, use_yolo: bool, _config: Config) -> BatchPipeline:
+    """
+    Конвейер с загруженными моделями, общий для всех сессий процесса
+    
+    Ключ кэша - отпечаток Config и выбор YOLO; сам Config не хешируется Streamlit.
+    """
+    return BatchPipeline(_config, use_yolo)
+
+
+@st.cache_resource(show_spinner=False)
+def start_metrics_server() -> Optional[object]:
+    """Сервер метрик процесса на порту из METRICS_PORT (один на процесс Streamlit)"""
+    port = os.environ.get("METRICS_PORT")
+    return serve_metrics(int(port)) if port else None
+
+
+@st.cache_resource(show_spinner=False)
+def get_executor() -> ThreadPoolExecutor:
+    """Фоновый исполнитель извлечения; один поток, так как конвейеры общие для сессий"""
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="streamlit-extract")
+
+
+def run_extraction(pipeline: BatchPipeline, data: bytes, file_name: str,
+                   progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+    """Извлечение информации из документа (выполняется в фоновом потоке)"""
+    reporter = ProgressReporter(progress, pipeline.config.trace_memory)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        input_path = Path(tmpdir) / file_name
+        with reporter.stage("save"):
+            input_path.write_bytes(data)
+        
+        # Тот же путь, что в пакетной обработке: кэш результатов, архив этапов, метрики
+        record = pipeline.process(input_path, reporter, details=True)
+    
+    # Растры аннотаций строятся здесь и в запись не входят; этап добавляется в замеры записи
+    detections = record.pop("detections")
+    annotated_images = []
+    if pipeline.processor is not None:
+        with reporter.stage("annotate", page_count=len(detections)):
+            annotated_images = [
+                pipeline.processor.yolo_detector.render_annotations(detection) for detection in detections
+            ]
+        record["timings"] = reporter.report()
+    return {
+        "kind": "enhanced" if pipeline.processor is not None else "standard",
+        "file_name": file_name,
+        "record": record,
+        "annotated_images": annotated_images,
+        "config": pipeline.config
+    }
+
+
+def debug_result(extraction: Dict[str, Any]) -> Dict:
+    """Результат с отладочной информацией парсера: повторный разбор сохраненного текста без OCR"""
+    if "debug_result" not in extraction:
+        config = replace(extraction["config"], debug_mode=True)
+        invoice_parser = InvoiceParser(config, TextProcessor(config))
+        extraction["debug_result"] = invoice_parser.parse(extraction["record"]["text"])
+    return extraction["debug_result"]
+
+
+def poll_extraction_job(status_container, progress_bar, debug_mode: bool):
+    """Опрос фоновой задачи: перезапуск скрипта, пока задача не завершится"""
+    job = st.session_state.get("extraction_job")
+    if job is None:
+        return
+    
+    future = job["future"]
+    if not future.done():
+        events = list(job["events"])
+        elapsed = time.monotonic() - job["started"]
+        status_container.info(f"⏳ {job['file_name']}: {describe_progress(events)}, {elapsed:.0f} с")
+        progress_bar.progress(progress_fraction(events, job["stages"]))
+        display_partial_results(events)
+        time.sleep(POLL_INTERVAL)
+        st.rerun()
+    
+    del st.session_state["extraction_job"]
+    try:
+        st.session_state["extraction"] = future.result()
+    except Exception as e:
+        status_container.error("❌ Произошла ошибка")
+        st.error(f"Ошибка обработки: {str(e)}")
+        logger.error(f"Ошибка при обработке файла {job['file_name']}: {e}")
+        if debug_mode:
+            st.exception(e)
+        return
+    st.rerun()
+
+
+def progress_fraction(events: List[ProgressEvent], stages: Tuple[str, ...]) -> float:
+    """Доля выполненной работы: завершенные этапы плюс доля страниц текущего этапа"""
+    finished = {event.stage for event in events if event.kind == "end"}
+    done = len(finished & set(stages))
+    
+    running = next((event for event in reversed(events) if event.stage not in finished), None)
+    if running is not None and running.kind == "page" and running.page_count:
+        done += running.page / running.page_count
+    return min(1.0, done / len(stages))
+
+
+def describe_progress(events: List[ProgressEvent]) -> str:
+    """Текущий этап обработки по последнему событию"""
+    if not events:
+        return "ожидание запуска"
+    
+    event = events[-1]
+    title = STAGE_TITLES.get(event.stage, event.stage)
+    if event.kind == "page":
+        return f"{title}: стр. {event.page} из {event.page_count}"
+    if event.kind == "end":
+        return f"{title}: готово за {event.stage_ms / 1000:.1f} с"
+    return title
+
+
+def display_timings(timings: Dict[str, Dict[str, float]]):
+    """Замеры этапов: время, процессорное время и прирост пикового RSS"""
+    total = timings.get("total", {})
+    with st.expander(f"⏱ Время обработки: {total.get('wall_ms', 0) / 1000:.1f} с"):
+        import pandas as pd
+        st.dataframe(pd.DataFrame([
+            {
+                "Этап": STAGE_TITLES.get(stage, stage),
+                "Время, мс": sample.get("wall_ms"),
+                "CPU, мс": sample.get("cpu_ms"),
+                "Пик RSS, +МБ": round(sample.get("rss_peak_delta_kb", 0) / 1024, 1),
+                **({"Пик Python, МБ": round(sample["py_peak_kb"] / 1024, 1)} if "py_peak_kb" in sample else {})
+            }
+            for stage, sample in timings.items()
+        ]), use_container_width=True)
+
+
+def display_partial_results(events: List[ProgressEvent]):
+    """Промежуточные результаты, полученные до завершения обработки"""
+    partial = {}
+    for event in events:
+        if event.kind == "partial":
+            partial.setdefault(event.stage, {}).update(event.data)
+    
+    if "detect" in partial:
+        st.caption(f"🎯 Обнаружено полей: {partial['detect'].get('field_count', 0)}")
+    field_texts = partial.get("region_ocr", {}).get("field_texts")
+    if field_texts:
+        st.caption("📝 Распознанные поля: " + ", ".join(field_texts))
+
 
 def display_results(result: Dict, debug_mode: bool, raw_text: Optional[str] = None):
     """Отображение результатов парсинга"""
@@ -367,20 +513,13 @@ def create_csv_export(result: Dict) -> str:
     return output.getvalue()
 
 
-def display_enhanced_results(enhanced_result: Dict, debug_mode: bool):
-    """Отображение результатов расширенной обработки (YOLO + Marker)"""
+def display_enhanced_results(record: Dict, annotated_images: List, debug_mode: bool):
+    """Отображение результатов расширенной обработки (YOLO + Marker) из записи BatchPipeline"""
     
     st.subheader("🎯 Результаты YOLO + Marker обработки")
     
-    # Проверяем успешность обработки
-    if not enhanced_result.get("processing_success", False):
-        st.error("❌ Ошибка при обработке документа")
-        if "error" in enhanced_result:
-            st.error(f"Детали ошибки: {enhanced_result['error']}")
-        return
-    
     # Статистика YOLO детекции
-    yolo_data = enhanced_result.get("yolo_detection")
+    yolo_data = record.get("yolo_detection")
     if yolo_data:
         st.subheader("📊 Статистика детекции полей")
         
@@ -409,6 +548,7 @@ def display_enhanced_results(enhanced_result: Dict, debug_mode: bool):
             fields_data = []
             for field in yolo_data["fields"]:
                 fields_data.append({
+                    "Стр.": field.get("page", 0) + 1,
                     "Тип поля": field["field_name"],
                     "Уверенность": f"{field['confidence']:.3f}",
                     "Координаты": f"({field['bbox']['x1']:.0f}, {field['bbox']['y1']:.0f}) - ({field['bbox']['x2']:.0f}, {field['bbox']['y2']:.0f})",
@@ -420,13 +560,24 @@ def display_enhanced_results(enhanced_result: Dict, debug_mode: bool):
             st.dataframe(df, use_container_width=True)
     
     # Аннотированное изображение
-    annotated_image = enhanced_result.get("annotated_image")
-    if annotated_image and Path(annotated_image).exists():
+    # Аннотированные страницы в памяти (массивы RGB)
+    if annotated_images:
         st.subheader("🖼️ Аннотированное изображение")
-        st.image(annotated_image, caption="Обнаруженные поля", use_container_width=True)
+        for page_num, annotated_image in enumerate(annotated_images, 1):
+            caption = "Обнаруженные поля" if len(annotated_images) == 1 else f"Обнаруженные поля, стр. {page_num}"
+            st.image(annotated_image, caption=caption, use_container_width=True)
+    
+    # Источник текста по страницам (текстовый слой или OCR)
+    page_sources = [source for source in record.get("page_sources", []) if source.get("page") is not None]
+    if page_sources:
+        source_names = {"text_layer": "текстовый слой", "ocr": "OCR"}
+        st.caption("Источник текста: " + ", ".join(
+            f"стр. {source['page'] + 1} - {source_names.get(source['source'], source['source'])}"
+            for source in page_sources
+        ))
     
     # Тексты полей
-    field_texts = enhanced_result.get("field_texts", {})
+    field_texts = record.get("field_texts", {})
     if field_texts:
         st.subheader("📝 Извлеченные тексты полей")
         
@@ -439,7 +590,7 @@ def display_enhanced_results(enhanced_result: Dict, debug_mode: bool):
                     st.text_area(f"Текст поля {field_name}", text, height=100, disabled=True)
     
     # Полный текст документа
-    full_text = enhanced_result.get("marker_text")
+    full_text = record.get("text")
     if full_text:
         with st.expander("📄 Полный текст документа"):
             st.text_area("Marker OCR", full_text[:2000] + "..." if len(full_text) > 2000 else full_text, 
@@ -448,7 +599,7 @@ def display_enhanced_results(enhanced_result: Dict, debug_mode: bool):
     # Отладочная информация
     if debug_mode:
         with st.expander("🔧 Отладочная информация"):
-            st.json(enhanced_result)
+            st.json(record)
     
     # Экспорт результатов
     st.subheader("💾 Экспорт результатов")
@@ -457,7 +608,7 @@ def display_enhanced_results(enhanced_result: Dict, debug_mode: bool):
     
     with col1:
         # JSON экспорт
-        json_str = json.dumps(enhanced_result, ensure_ascii=False, indent=2, default=str)
+        json_str = json.dumps(record, ensure_ascii=False, indent=2, default=str)
         st.download_button(
             label="📄 Скачать полные результаты (JSON)",
             data=json_str,
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Тест инвалидации кэшей: версии этапов и результаты со сбоем
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+from src.config import Config
+from src.result_cache import ResultCache
+from src.stage_cache import StageCache, STAGE_VERSIONS
+
+
+def make_config(tmpdir: str) -> Config:
+    """Конфигурация с кэшами во временном каталоге"""
+    return Config(
+        result_cache_dir=str(Path(tmpdir) / "result_cache"),
+        stage_cache_dir=str(Path(tmpdir) / "stage_cache")
+    )
+
+
+def test_stage_version_bump():
+    """Увеличение версии этапа меняет пространство кэша результатов и ключ этапа"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        check_stage_version_bump(make_config(tmpdir))
+
+
+def test_failures_not_stored():
+    """Результат, отвергнутый should_cache, вычисляется заново при следующем обращении"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        check_failures_not_stored(make_config(tmpdir))
+
+
+def check_stage_version_bump(config: Config):
+    stage_cache = StageCache.from_config(config)
+    namespace = ResultCache.from_config(config).namespace
+    parse_key = stage_cache.key("parse", config, "ocr-key")
+    calls = []
+    stage_cache.memoize("parse", parse_key, lambda: calls.append(1) or {"number": "1"})
+
+    STAGE_VERSIONS["parse"] += 1
+    try:
+        bumped_namespace = ResultCache.from_config(config).namespace
+        bumped_key = stage_cache.key("parse", config, "ocr-key")
+        stage_cache.memoize("parse", bumped_key, lambda: calls.append(1) or {"number": "1"})
+    finally:
+        STAGE_VERSIONS["parse"] -= 1
+
+    ok = bumped_namespace != namespace and bumped_key != parse_key and len(calls) == 2
+    print(f"{'✅' if ok else '❌'} версия этапа parse: пространство кэша результатов "
+          f"{'изменилось' if bumped_namespace != namespace else 'не изменилось'}, "
+          f"вычислений этапа {len(calls)} из 2")
+    assert ok
+
+
+def check_failures_not_stored(config: Config):
+    stage_cache = StageCache.from_config(config)
+    key = stage_cache.key("parse", config, "failed-ocr-key")
+    calls = []
+
+    def parse():
+        calls.append(1)
+        return {"error": "Ошибка парсинга: сбой"} if len(calls) == 1 else {"number": "1"}
+
+    for _ in range(3):
+        result = stage_cache.memoize("parse", key, parse, should_cache=lambda value: not value.get("error"))
+
+    ok = len(calls) == 2 and result == {"number": "1"}
+    print(f"{'✅' if ok else '❌'} сбой не записан в архив: вычислений этапа {len(calls)} из 2")
+    assert ok
+
+
+def main():
+    """Главная функция"""
+
+    print("🧪 Тестирование инвалидации кэшей")
+    print("=" * 50)
+
+    passed = True
+    for test in (test_stage_version_bump, test_failures_not_stored):
+        try:
+            test()
+        except AssertionError:
+            passed = False
+
+    print(f"\n{'✅ ТЕСТ ПРОЙДЕН' if passed else '❌ ТЕСТ ПРОВАЛЕН'}")
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
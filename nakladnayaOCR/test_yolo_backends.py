@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Тест совпадения CPU-бэкендов детектора с PyTorch
+"""
+
+import sys
+from pathlib import Path
+
+import cv2
+
+from src.inference_backends import BACKENDS, load_backend, read_manifest, export_model, compare_detections
+
+# Допуски: поля не теряются и не появляются, боксы и уверенность почти совпадают
+MIN_IOU = 0.9
+MAX_CONF_DRIFT = 0.05
+
+# INT8-модель: с запасом на шум квантования
+TOLERANCES = {"onnx_int8": (0.8, 0.1)}
+
+
+def test_yolo_backends(model_path: str, image_paths: list, conf: float = 0.25) -> bool:
+    """Сравнение всех доступных экспортированных бэкендов с эталоном PyTorch"""
+
+    print("🧪 Тестирование CPU-бэкендов детектора")
+    print("=" * 50)
+
+    if not read_manifest(model_path):
+        print("📦 Манифест не найден, экспортируем в ONNX")
+        export_model(model_path, ("onnx",))
+
+    images = [cv2.imread(str(path)) for path in image_paths]
+    if any(image is None for image in images):
+        print("❌ Не удалось прочитать изображения")
+        return False
+
+    reference = load_backend(model_path, "pytorch")
+    if reference is None or reference.name != "pytorch":
+        print("❌ Эталонная модель PyTorch недоступна")
+        return False
+    expected = reference.predict(images, conf, 0.6)
+    print(f"✅ Эталон: {sum(len(boxes) for boxes in expected)} боксов на {len(images)} изображениях")
+
+    passed = True
+    checked = 0
+    for name in BACKENDS:
+        if name == "pytorch":
+            continue
+        backend = load_backend(model_path, name)
+        if backend is None or backend.name != name:
+            print(f"⏭️  {name}: нет артефакта или среды выполнения")
+            continue
+
+        checked += 1
+        stats = compare_detections(expected, backend.predict(images, conf, 0.6))
+        missed = sum(entry["missed"] for entry in stats.values())
+        extra = sum(entry["extra"] for entry in stats.values())
+        ious = [entry["min_iou"] for entry in stats.values() if entry["min_iou"] is not None]
+        drifts = [entry["max_conf_drift"] for entry in stats.values() if entry["max_conf_drift"] is not None]
+        min_iou = min(ious) if ious else 1.0
+        drift = max(drifts) if drifts else 0.0
+        tolerance_iou, tolerance_drift = TOLERANCES.get(name, (MIN_IOU, MAX_CONF_DRIFT))
+        ok = missed == 0 and extra == 0 and min_iou >= tolerance_iou and drift <= tolerance_drift
+        print(f"{'✅' if ok else '❌'} {name}: пропущено {missed}, лишних {extra}, "
+              f"min IoU {min_iou:.4f}, дрейф уверенности {drift:.4f}")
+        passed = passed and ok
+
+    if checked == 0:
+        print("❌ Нет экспортированных бэкендов для проверки")
+        return False
+
+    print(f"\n{'✅ ТЕСТ ПРОЙДЕН' if passed else '❌ ТЕСТ ПРОВАЛЕН'}")
+    return passed
+
+
+def main():
+    """Главная функция"""
+
+    if len(sys.argv) < 3:
+        print("Использование: python test_yolo_backends.py <model_path> <image_path> [image_path ...]")
+        print("Пример: python test_yolo_backends.py yolo_training/overfit_models/best_overfit_model.pt data/yolo_dataset/Obrazets-zapolneniya-TN-2025-2-4.pdf_page_1.png")
+        return
+
+    model_path = sys.argv[1]
+    image_paths = [Path(path) for path in sys.argv[2:]]
+
+    success = test_yolo_backends(model_path, image_paths)
+
+    sys.exit(0 if success else 1)
+
+
+if __name__ == "__main__":
+    main()